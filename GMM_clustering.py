@@ -1,12 +1,18 @@
 """ Step 2 : Clustering step """
 
 ##### Imports
-from sklearn.mixture import BayesianGaussianMixture
 from termcolor import colored
 import warnings
 import random
 import math
-import hdbscan
+import tracing
+
+### File imports
+from label_lattice import LabelLattice, SharedSubproblems
+from fca import concept_clustering
+
+### Whether the fallback of warm_started_mixture to a random initialization was already reported
+_warned_cold_start = False
 
 def to_format(similarities_dict, amount_dict, list_of_distinct_nodes):
     """ Format data to a correct input for the Gaussian Model
@@ -180,6 +186,8 @@ def compute_similarities(list_of_distinct_nodes, ref_node):
     """
     similarities_dict = {}
 
+    tracing.count("similarity_calls", len(list_of_distinct_nodes))
+
     # iterate through each different node
     for node in list_of_distinct_nodes:
 
@@ -191,7 +199,8 @@ def compute_similarities(list_of_distinct_nodes, ref_node):
 
     return similarities_dict
 
-def iter_gmm(amount_dict, list_of_distinct_nodes, distinct_labels, all_sets_labels):
+def iter_gmm(amount_dict, list_of_distinct_nodes, distinct_labels, all_sets_labels, warm_start=False, share=False,
+             fca_threshold=None, min_support=0.01, batch_threshold=None):
     """ Makes a cluster computation, call rec_clustering to find subclusters
 
     Parameters
@@ -208,6 +217,25 @@ def iter_gmm(amount_dict, list_of_distinct_nodes, distinct_labels, all_sets_labe
     all_sets_labels : Python list of list
         A list of all labels sets
         Its format is : [['Label 1','Label2'],['Label1'],['Label3'],...]
+    warm_start : Boolean
+        When warm_start is at True, the model of a subcluster starts from the split of the component of its parent,
+        mapped onto the similarities to its own reference node, instead of a k-means initialization
+        (see warm_started_mixture)
+    share : Boolean
+        When share is at True, the members of the base types are taken from a LabelLattice and the similarities,
+        reference nodes and splits are computed once for all the base types (see label_lattice) : a set of patterns
+        already split under another base type keeps that split instead of being fitted again.
+        Otherwise every base type is clustered from scratch, every subcluster being fitted
+    fca_threshold : Int
+        The base types with at most fca_threshold distinct nodes are clustered with the concepts of their nodes
+        (see fca) instead of Gaussian Mixture Models, None to never use them.
+        As the clusters of rec_clustering, the concepts already found for another base type are not kept.
+        The hierarchy must then be stored with storing(..., disjoint_subtypes=False)
+    min_support : Float
+        Minimum share of the occurrences of a base type in one of its concepts
+    batch_threshold : Int
+        When given, the hierarchy is built level by level and the splits of at most batch_threshold distinct nodes of
+        a level are fitted together (see batched_clustering), None to build it depth-first with rec_clustering
 
     Returns
     -------
@@ -224,6 +252,27 @@ def iter_gmm(amount_dict, list_of_distinct_nodes, distinct_labels, all_sets_labe
     all_clusters = []
     hierarchy_tree = []
 
+    # base types left to level_clustering : their patterns and their node of the hierarchy
+    pending = []
+
+    if share:
+        lattice = LabelLattice(list_of_distinct_nodes, distinct_labels)
+        shared = SharedSubproblems(distinct_labels)
+
+        for lab_set in all_sets_labels:
+            correct_nodes = lattice.members(lab_set)
+            with tracing.span("base type", labels=":".join(lab_set)):
+                if fca_threshold is not None and len(correct_nodes) <= fca_threshold:
+                    all_clusters, hierarchy = concept_clustering(amount_dict, correct_nodes, lab_set, all_clusters, min_support, shared)
+                elif batch_threshold is not None:
+                    hierarchy = [set(lab_set),None,None]
+                    pending.append((correct_nodes, hierarchy))
+                else:
+                    all_clusters, hierarchy = rec_clustering(amount_dict, correct_nodes, distinct_labels, all_clusters, [set(lab_set),None,None], warm_start, shared=shared)
+            hierarchy_tree.append(hierarchy)
+        return cluster_pending(amount_dict, pending, distinct_labels, all_clusters, hierarchy_tree, warm_start, shared,
+                               batch_threshold)
+
     # iterate through each different sets of labels
     for lab_set in all_sets_labels:
         correct_nodes = []
@@ -264,11 +313,28 @@ def iter_gmm(amount_dict, list_of_distinct_nodes, distinct_labels, all_sets_labe
                 correct_nodes.append(node)
 
         # search for all subclusters
-        all_clusters, hierarchy = rec_clustering(amount_dict, correct_nodes, distinct_labels, all_clusters, [set(lab_set),None,None])
+        with tracing.span("base type", labels=":".join(lab_set)):
+            if fca_threshold is not None and len(correct_nodes) <= fca_threshold:
+                all_clusters, hierarchy = concept_clustering(amount_dict, correct_nodes, lab_set, all_clusters, min_support)
+            elif batch_threshold is not None:
+                hierarchy = [set(lab_set),None,None]
+                pending.append((correct_nodes, hierarchy))
+            else:
+                all_clusters, hierarchy = rec_clustering(amount_dict, correct_nodes, distinct_labels, all_clusters, [set(lab_set),None,None], warm_start)
         hierarchy_tree.append(hierarchy)
+    return cluster_pending(amount_dict, pending, distinct_labels, all_clusters, hierarchy_tree, warm_start, None,
+                           batch_threshold)
+
+def cluster_pending(amount_dict, pending, distinct_labels, all_clusters, hierarchy_tree, warm_start, shared, batch_threshold):
+    """ Builds the hierarchies of the base types iter_gmm left to level_clustering """
+    if pending:
+        # imported here : batched_clustering imports this module
+        from batched_clustering import level_clustering
+        all_clusters = level_clustering(amount_dict, pending, distinct_labels, all_clusters, warm_start, shared,
+                                        batch_threshold)
     return all_clusters, hierarchy_tree
 
-def rec_clustering(amount_dict, correct_nodes, distinct_labels, all_clusters, hierarchy):
+def rec_clustering(amount_dict, correct_nodes, distinct_labels, all_clusters, hierarchy, warm_start=False, parent_component=None, shared=None):
     """
 
     Parameters
@@ -287,78 +353,222 @@ def rec_clustering(amount_dict, correct_nodes, distinct_labels, all_clusters, hi
         they may contain one element or more,
         an element is a string node that was clustered in this cluster
         Its format is : [{'Label1 prop1', 'Label1', 'Label1 prop1 prop2'}, {'Label3', 'Label3 prop1 prop4'}, ...]
+    hierarchy : Python list
+        The node of the hierarchy representing this cluster : [cluster, None, None]
+    warm_start : Boolean
+        Start the models of the subclusters from the components of this cluster's model (see warm_started_mixture)
+    parent_component : Python tuple
+        Mean, variance and weight of the component of the parent's model this cluster comes from, and the parent's
+        reference node they are measured against (None for a base type or without warm_start)
+    shared : SharedSubproblems
+        The similarities, reference nodes and splits already computed, None to compute everything again
 
     Returns
     -------
     all_clusters : The same all_clusters as in parameters but with new clusters added
     """
 
+    with tracing.span("split") as current:
+        if current:
+            current.set(patterns=len(correct_nodes), weight=sum(amount_dict[node] for node in correct_nodes))
+
+        # a set of patterns already split for another base type is not clustered again
+        split = shared.split(correct_nodes) if shared is not None else None
+        if split is None:
+            split = split_nodes(amount_dict, correct_nodes, distinct_labels, warm_start, parent_component, shared)
+            if shared is not None:
+                shared.store_split(correct_nodes, *split)
+        clusters, components = split
+
+        for k in range(len(clusters)):
+            set_cluster = set(clusters[k])
+
+            # if the cluster is new and if not empty (ie. there are two found clusters)
+            if shared is not None:
+                new = shared.add_cluster(all_clusters, set_cluster) is not None
+            else:
+                new = set_cluster not in all_clusters and set_cluster != set()
+                if new:
+                    # add the cluster to our main variable
+                    all_clusters.append(set_cluster)
+
+            if new:
+                # make a new dataset with all nodes found in the subcluster
+                correct_nodes = sorted(set_cluster)
+
+                # search for more subclusters in this subcluster
+                all_clusters,subhierarchy = rec_clustering(amount_dict, correct_nodes, distinct_labels, all_clusters, [set_cluster,None,None], warm_start, components[k], shared)
+                hierarchy[k+1] = subhierarchy
+
+    return all_clusters,hierarchy
+
+def split_nodes(amount_dict, correct_nodes, distinct_labels, warm_start=False, parent_component=None, shared=None):
+    """ Splits a cluster in two with a BayesianGaussianMixture trained on the similarities to a reference node
+
+    Parameters
+    ----------
+    See rec_clustering
+
+    Returns
+    -------
+    clusters : Python list of sets
+        The nodes predicted in each component ([] when there is at most one node)
+        Its format is : [{'Label1 prop1', 'Label1', ...}, {'Label1 prop2', ...}]
+    components : Python list
+        Mean, variance, weight and reference node of each component (see component)
+    """
+    # sklearn is only imported once a model has to be trained
+    from sklearn.mixture import BayesianGaussianMixture
+
     # get a reference node
-    ref_node = max_labs_props(amount_dict, correct_nodes, 1, distinct_labels)
+    if shared is not None:
+        ref_node = shared.reference_node(amount_dict, correct_nodes)
+    else:
+        ref_node = max_labs_props(amount_dict, correct_nodes, 1, distinct_labels)
 
     # compute all similarity measures according to the reference node
-    similarities_dict = compute_similarities(correct_nodes, ref_node)
+    if shared is not None:
+        similarities_dict = shared.compute_similarities(correct_nodes, ref_node)
+    else:
+        similarities_dict = compute_similarities(correct_nodes, ref_node)
 
     # create a list of lists with the number of occurrences of each node respected and that can be used by a Gaussian Mixture Model
     computed_measures = to_format(similarities_dict, amount_dict, correct_nodes)
 
     # BayesianGaussianMixture cannot cluter one node
-    if len(computed_measures)>1:
+    if len(computed_measures)<=1:
+        return [], []
+
+    if warm_start and parent_component is not None:
+        # the same occurrences measured against the parent's reference node, to map its component onto the new measures
+        parent_ref_node = parent_component[3]
+        if shared is not None:
+            parent_similarities = shared.compute_similarities(correct_nodes, parent_ref_node)
+        else:
+            parent_similarities = compute_similarities(correct_nodes, parent_ref_node)
+        parent_measures = to_format(parent_similarities, amount_dict, correct_nodes)
 
+        bgmm = warm_started_mixture(computed_measures, parent_measures, parent_component)
+    else:
         # Train the model with some parameters to speed the process
         bgmm = BayesianGaussianMixture(n_components=2, tol=1, max_iter=10).fit(computed_measures)
 
+    if bgmm is None:
+        # every node has the same similarity measure : they cannot be separated
+        predictions = [0]*len(computed_measures)
+    else:
+        tracing.count("bgmm_fits")
+        tracing.count("bgmm_iterations", bgmm.n_iter_)
+
         # Make the clustering
         predictions = bgmm.predict(computed_measures)
 
-        # variable to keep separated nodes of the two clusters
-        clusters = [[],[]]
-
-        # variable to keep track on the index of the node in the list 'predictions'
-        j = 0
-
-        # iterate through each different nodes in this dataset
-        for node in correct_nodes:
-
-            # get the number of occurrences of each of the current node
-            amount = amount_dict[node]
-
-            # add "amount" times the node to its predicted cluster
-            for i in range(amount):
-                clusters[predictions[j]].append(node)
-                j+=1
-
-        ### First cluster
-        set_cluster_1 = set(clusters[0])
+    # variable to keep separated nodes of the two clusters
+    clusters = [set(),set()]
 
-        # if the cluster is new and if not empty (ie. there are two found clusters)
-        if set_cluster_1 not in all_clusters and set_cluster_1 != set():
-            # add the cluster to our main variable
-            all_clusters.append(set_cluster_1)
+    # variable to keep track on the index of the node in the list 'predictions'
+    j = 0
 
-            # make a new dataset with all nodes found in the subcluster
-            correct_nodes = list(set_cluster_1)
+    # iterate through each different nodes in this dataset
+    for node in correct_nodes:
 
-            # search for more subclusters in this subcluster
-            all_clusters,hierarchy1 = rec_clustering(amount_dict, correct_nodes, distinct_labels, all_clusters, [set_cluster_1,None,None])
-            hierarchy[1] = hierarchy1
+        # get the number of occurrences of each of the current node
+        amount = amount_dict[node]
 
-        ### Second cluster
-        set_cluster_2 = set(clusters[1])
-
-        # if the cluster is new and if not empty (ie. there are two found clusters)
-        if set_cluster_2 not in all_clusters and set_cluster_2 != set():
-            # add the cluster to our main variable
-            all_clusters.append(set_cluster_2)
+        # add the node to the cluster predicted for each of its occurrences
+        for i in range(amount):
+            clusters[predictions[j]].add(node)
+            j+=1
+
+    return clusters, [component(bgmm, 0, ref_node), component(bgmm, 1, ref_node)]
+
+def component(bgmm, k, ref_node):
+    """ Mean, variance and weight of the k-th component of a trained model and the reference node of its measures
+    (None without model) """
+    if bgmm is None:
+        return None
+    return float(bgmm.means_[k][0]), float(bgmm.covariances_[k].ravel()[0]), float(bgmm.weights_[k]), ref_node
+
+def warm_started_mixture(computed_measures, parent_measures, parent_component, tol=1, max_iter=10):
+    """ Trains a two-component BayesianGaussianMixture which starts from the split of the parent's component
+
+    The nodes of a subcluster are the ones of a component of the parent's model, whose mean and variance are measured
+    against the parent's reference node. The same occurrences are measured against both reference nodes, so the
+    component is mapped onto the new measures by the least squares line new = a*old + b : its mean becomes a*mean + b
+    and its variance a^2*variance plus the variance left around the line. As in split-and-merge EM, the mapped
+    component is then split in two at its mean : the occurrences below it start in the first subcomponent and the
+    others in the second (at the mean of the measures when they are all on one side). The mapped component is also
+    the prior of the model (mean_prior and covariance_prior) and the concentration of the weights is half of the
+    parent's weight (the default 1/2 of BayesianGaussianMixture for a component holding all the weight). The model is
+    then trained by variational inference from there (warm_start) until its lower bound changes by less than tol.
+
+    With tol=1 a model started by k-means usually converges in two iterations already, so the warm start does not
+    save iterations : it saves the k-means initialization, and its splits follow the parent's component.
 
-            # make a new dataset with all nodes found in the subcluster
-            correct_nodes = list(set_cluster_2)
+    Parameters
+    ----------
+    computed_measures : Python list of lists
+        A list with each element representing the similarity measure of an occurrence to the new reference node
+        Its format is : [[float1],[float2],[float1],...]
+    parent_measures : Python list of lists
+        The similarity measures of the same occurrences to the parent's reference node, in the same order
+    parent_component : Python tuple
+        Mean, variance, weight and reference node of the parent's component (see component)
+    tol, max_iter :
+        Convergence threshold and maximum number of iterations of the model
 
-            # search for more subclusters in this subcluster
-            all_clusters,hierarchy2 = rec_clustering(amount_dict, correct_nodes, distinct_labels, all_clusters, [set_cluster_2,None,None])
-            hierarchy[2] = hierarchy2
+    Returns
+    -------
+    bgmm : BayesianGaussianMixture
+        The trained model, None when all similarity measures are equal (nothing to separate)
+    """
+    import numpy as np
+    from sklearn.mixture import BayesianGaussianMixture
+
+    X = np.asarray(computed_measures, dtype=float)
+
+    # early exit : a single value cannot be separated
+    if X.min() == X.max():
+        return None
+
+    # the parent's component mapped onto the new measures
+    parent_mean, parent_variance, parent_weight = parent_component[:3]
+    new, old = X[:, 0], np.asarray(parent_measures, dtype=float)[:, 0]
+    if old.min() == old.max():
+        # the parent's measures do not tell the occurrences apart : nothing to map, the line is flat
+        a, b = 0.0, new.mean()
+    else:
+        a, b = np.polyfit(old, new, 1)
+    residual = (new - (a*old + b)).var()
+    mean = a*parent_mean + b
+    variance = max(a*a*parent_variance + residual, 1e-6)
+
+    bgmm = BayesianGaussianMixture(n_components=2, tol=tol, max_iter=max_iter, warm_start=True,
+                                   mean_prior=[mean], covariance_prior=[[variance]],
+                                   weight_concentration_prior=max(parent_weight, 1e-6)/2)
+
+    # responsibilities of the split component : the occurrences below its mean and the others
+    upper = X[:, 0] > mean
+    if upper.all() or not upper.any():
+        upper = X[:, 0] > X[:, 0].mean()
+    resp = np.column_stack([~upper, upper]).astype(float)
 
-    return all_clusters,hierarchy
+    try:
+        bgmm._check_parameters(X)
+        bgmm._initialize(X, resp)
+    except (AttributeError, TypeError) as error:
+        # the initialization relies on private methods of sklearn : train from a random initialization instead
+        global _warned_cold_start
+        if not _warned_cold_start:
+            print(colored("warm start unavailable with this version of sklearn (%s), models start cold" % error, "yellow"))
+            _warned_cold_start = True
+        tracing.count("cold_starts")
+        return BayesianGaussianMixture(n_components=2, tol=tol, max_iter=max_iter).fit(X)
+
+    # the fit continues from the parameters above instead of initializing them again
+    bgmm.lower_bound_ = -np.inf
+    bgmm.converged_ = False
+    return bgmm.fit(X)
 
 def dice_coefficient(a,b):
     """ Compute the similarity measure value between two strings
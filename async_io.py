@@ -0,0 +1,310 @@
+""" Asynchronous path for the profiling queries of step 1 and the export of the inferred schema """
+
+##### Imports
+import asyncio
+import csv
+from termcolor import colored
+
+### File imports
+from preprocessing_step import LABELS_QUERY, LABEL_SETS_QUERY, label_set_query
+from infer import EDGES_QUERY
+
+def open_async_driver(uri, user, passwd, max_concurrency=8):
+    """ Opens an asynchronous driver (neo4j >= 4.4) with a connection pool sized for max_concurrency queries
+
+    Parameters
+    ----------
+    uri : String
+        Neo4j bolt address
+    user, passwd : String
+        Neo4j username and password
+    max_concurrency : Int
+        Maximum number of queries running at the same time
+
+    Returns
+    -------
+    driver : AsyncGraphDatabase.driver object
+    """
+    from neo4j import AsyncGraphDatabase
+    return AsyncGraphDatabase.driver(uri, auth=(user, passwd), max_connection_pool_size=max_concurrency)
+
+async def fetch(driver, semaphore, query, database=None, parameters=None):
+    """ Runs a query in its own session once the semaphore allows it and returns all its records """
+    async with semaphore:
+        async with driver.session(database=database) as session:
+            result = await session.run(query, parameters or {})
+            return [record async for record in result]
+
+async def async_preprocessing(driver, max_concurrency=8, database=None):
+    """ Asynchronous version of preprocessing : the two label queries run concurrently,
+    then the properties of each set of labels are counted by concurrent label-scoped queries
+
+    Parameters
+    ----------
+    driver : AsyncGraphDatabase.driver object
+        Driver used to access the PG stored in a Neo4j database.
+    max_concurrency : Int
+        Maximum number of queries running at the same time (should not exceed the connection pool size)
+    database : String
+        Name of the database, None for the default one
+
+    Returns
+    -------
+    The same amount_dict, list_of_distinct_nodes, distinct_labels and labs_sets as preprocessing
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    print(colored("Querying neo4j to get all distinct labels and sets of labels:", "yellow"))
+    all_labels, labels_sets = await asyncio.gather(
+        fetch(driver, semaphore, LABELS_QUERY, database),
+        fetch(driver, semaphore, LABEL_SETS_QUERY, database))
+
+    distinct_labels = [labs["lab"] for labs in all_labels]
+    labs_sets = [labels_set["LABELS(n)"] for labels_set in labels_sets]
+    print(colored("Done.", "green"))
+
+    print(colored("Querying neo4j to get the sets of props of each set of labels:", "yellow"))
+
+    # a set of labels is queried once even if it was returned in different orders
+    distinct_sets = []
+    for lab_set in labs_sets:
+        if sorted(lab_set) not in distinct_sets:
+            distinct_sets.append(sorted(lab_set))
+
+    results = await asyncio.gather(*[fetch(driver, semaphore, label_set_query(lab_set), database)
+                                     for lab_set in distinct_sets])
+
+    amount_dict = {}
+    list_of_distinct_nodes = []
+
+    for lab_set, nodes in zip(distinct_sets, results):
+        for node in nodes:
+            labels_properties_str = ' '.join(lab_set+sorted(node["keys"]))
+            if labels_properties_str in amount_dict:
+                amount_dict[labels_properties_str] += node["count"]
+            else:
+                list_of_distinct_nodes.append(labels_properties_str)
+                amount_dict[labels_properties_str] = node["count"]
+    print(colored("Done.", "green"))
+
+    return amount_dict,list_of_distinct_nodes,distinct_labels,labs_sets
+
+async def write_batches(driver, batches, max_concurrency=8, database=None):
+    """ Runs write queries from several sessions while the batches are still being produced
+
+    Parameters
+    ----------
+    driver : AsyncGraphDatabase.driver object
+        Driver of the database written into
+    batches : Python iterable of tuples
+        The query of each batch and its rows, given to the query as the $rows parameter
+        Its format is : [("UNWIND $rows AS row CREATE ...", [{...}, {...}]), ...]
+    max_concurrency : Int
+        Number of sessions writing at the same time
+    database : String
+        Name of the database, None for the default one
+
+    Returns
+    -------
+    n_batches : Int
+        Number of batches written
+    """
+    queue = asyncio.Queue(maxsize=2*max_concurrency)
+    written = [0]
+
+    async def writer():
+        async with driver.session(database=database) as session:
+            while True:
+                batch = await queue.get()
+                try:
+                    if batch is None:
+                        return
+                    query, rows = batch
+                    result = await session.run(query, {"rows": rows})
+                    await result.consume()
+                    written[0] += 1
+                finally:
+                    queue.task_done()
+
+    writers = [asyncio.create_task(writer()) for i in range(max_concurrency)]
+
+    def check_writers():
+        """ Raises the exception of a writer that failed """
+        for task in writers:
+            if task.done() and task.exception() is not None:
+                raise task.exception()
+
+    async def put(batch):
+        """ Puts a batch in the queue, waiting for a place unless a writer fails meanwhile """
+        check_writers()
+        if not queue.full():
+            queue.put_nowait(batch)
+            return
+        putting = asyncio.ensure_future(queue.put(batch))
+        try:
+            while not putting.done():
+                await asyncio.wait([putting]+[task for task in writers if not task.done()],
+                                   return_when=asyncio.FIRST_COMPLETED)
+                check_writers()
+        finally:
+            putting.cancel()
+
+    try:
+        # the queue is bounded : producing waits for the writers when they fall behind
+        for batch in batches:
+            await put(batch)
+        for i in range(max_concurrency):
+            await put(None)
+
+        await asyncio.gather(*writers)
+    except BaseException:
+        # a failed write stops the other writers
+        for task in writers:
+            task.cancel()
+        await asyncio.gather(*writers, return_exceptions=True)
+        raise
+    return written[0]
+
+def escape(name):
+    """ Escapes a label or a relationship type for a query """
+    return "`"+name.replace("`","``")+"`"
+
+def grouped_batches(rows, query, batch_size):
+    """ Groups the rows by key (labels and types cannot be parameters) and cuts the groups into batches
+
+    Parameters
+    ----------
+    rows : Python iterable of tuples
+        The key of each row and its parameters
+        Its format is : [(key, {...}), ...]
+    query : Python function
+        Builds the query of a group from its key
+    batch_size : Int
+        Maximum number of rows in a batch
+
+    Returns
+    -------
+    A generator of tuples (query, rows)
+    """
+    groups = {}
+    for group, row in rows:
+        groups.setdefault(group, []).append(row)
+        if len(groups[group]) >= batch_size:
+            yield query(group), groups.pop(group)
+    for group, group_rows in groups.items():
+        yield query(group), group_rows
+
+def node_query(label):
+    return "UNWIND $rows AS row CREATE (n:"+escape(label)+" {labels: row.labels, props: row.props})"
+
+def subtype_query(labels):
+    label, label_parent = labels
+    return "UNWIND $rows AS row MATCH (n:"+escape(label)+"),(m:"+escape(label_parent)+") \
+WHERE n.labels = row.labels AND n.props = row.props AND m.labels = row.labels_parent AND m.props = row.props_parent \
+CREATE (n)-[r:SUBTYPE_OF]->(m)"
+
+def edge_query(type_r):
+    return "UNWIND $rows AS row MATCH (n),(m) \
+WHERE n.labels = row.labels_n AND n.props = row.keys_n AND m.labels = row.labels_m AND m.props = row.keys_m \
+CREATE (n)-[r:"+escape(type_r)+"]->(m)"
+
+def read_types(file):
+    """ Reads the types of a file written by storing
+
+    Parameters
+    ----------
+    file : String
+        Name of the file
+
+    Returns
+    -------
+    nodes : Python list of tuples
+        The type name of each type and its labels and properties
+    subtypes : Python list of tuples
+        The type names of each subtype and its parent, with their labels and properties
+    """
+    nodes = []
+    subtypes = []
+    ind_dict = {}
+
+    with open(file) as csv_file:
+        csv_reader = csv.reader(csv_file, delimiter=',')
+        line_count = 0
+        for row in csv_reader:
+            if line_count == 0:
+                line_count += 1
+            else:
+                label = row[4]
+                labels = ":".join(sorted(row[1].split(":")))
+                props = ":".join(sorted(row[2].split(":")))
+                ind_dict[row[0]] = [label,labels,props]
+                nodes.append((label, {"labels": labels, "props": props}))
+
+                # storing does not write the base types without common properties
+                if row[5] != "yes" and row[3] in ind_dict:
+                    label_parent, labels_parent, props_parent = ind_dict[row[3]]
+                    subtypes.append(((label, label_parent), {"labels": labels, "props": props,
+                                                             "labels_parent": labels_parent, "props_parent": props_parent}))
+
+    return nodes, subtypes
+
+async def async_create_neo4j_graph(source_driver, target_driver, file, edges=True, batch_size=500,
+                                   max_concurrency=8, database=None, target_database=None):
+    """ Asynchronous version of create_neo4j_graph writing batches of types concurrently
+
+    Parameters
+    ----------
+    source_driver : AsyncGraphDatabase.driver object
+        Driver of the PG the schema was inferred from (only used when edges is at True)
+    target_driver : AsyncGraphDatabase.driver object
+        Driver of the database the schema graph is written into
+    file : String
+        Name of the file written by storing
+    edges : Boolean
+        When edges is at True, add all edges to the Neo4j graph.
+        When edges is at False, only add edges SUBTYPE_OF.
+    batch_size : Int
+        Maximum number of types or edges written by one query
+    max_concurrency : Int
+        Number of sessions writing at the same time
+    database, target_database : String
+        Names of the source and target databases, None for the default ones
+
+    Returns
+    -------
+    n_batches : Int
+        Number of batches written
+    """
+    # the edges are read from the PG while the types are written
+    edge_types = None
+    if edges:
+        edge_types = asyncio.create_task(fetch(source_driver, asyncio.Semaphore(1), EDGES_QUERY, database))
+
+    try:
+        nodes, subtypes = read_types(file)
+
+        n_batches = await write_batches(target_driver, grouped_batches(nodes, node_query, batch_size),
+                                        max_concurrency, target_database)
+
+        # every type has to exist before linking them
+        n_batches += await write_batches(target_driver, grouped_batches(subtypes, subtype_query, batch_size),
+                                         max_concurrency, target_database)
+
+        if edges:
+            edge_rows = []
+            for edge_type in await edge_types:
+                edge_rows.append((edge_type["type(r)"], {
+                    "labels_n": ":".join(sorted(edge_type["labels(n)"])),
+                    "keys_n": ":".join(sorted(edge_type["keys(n)"])),
+                    "labels_m": ":".join(sorted(edge_type["labels(m)"])),
+                    "keys_m": ":".join(sorted(edge_type["keys(m)"]))}))
+
+            n_batches += await write_batches(target_driver, grouped_batches(edge_rows, edge_query, batch_size),
+                                             max_concurrency, target_database)
+    finally:
+        # the edges are not needed any more when writing the types failed
+        if edge_types is not None:
+            edge_types.cancel()
+            await asyncio.gather(edge_types, return_exceptions=True)
+
+    return n_batches
@@ -0,0 +1,249 @@
+""" Infer the schemas of many databases in one process, listed in a manifest """
+
+##### Imports
+import argparse
+import csv
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from termcolor import colored
+
+### File imports
+from preprocessing_step import preprocessing
+
+def check_name(name):
+    """ Raises a ValueError when a database name cannot be used as the name of its output directory """
+    if not isinstance(name, str) or name in ("", ".", "..") or "/" in name or "\\" in name:
+        raise ValueError("The name "+repr(name)+" of a database cannot be a directory name (no path separators)")
+
+def read_manifest(file):
+    """ Reads the manifest of the databases to infer
+
+    The manifest is a json file :
+    {"defaults": {"uri": "bolt://localhost:7687", "user": "neo4j", "password_env": "NEO4J_PASSWORD"},
+     "databases": [{"name": "tenant1", "database": "tenant1"}, {"name": "ldbc", "uri": "bolt://other:7687", "password": "..."}, ...]}
+    Each entry takes the defaults for the fields it does not give. The password can be read from
+    an environment variable with password_env. training_percentage (80, 70 or 50) samples the nodes
+    as cluster_script does, all nodes are used when it is not given. The name of a database is the name of its
+    output directory : it cannot contain path separators.
+
+    Parameters
+    ----------
+    file : String
+        Name of the json manifest
+
+    Returns
+    -------
+    entries : Python list of dict
+        One dictionary per database with the keys name, uri, user, password, database, training_percentage
+    """
+    with open(file) as f:
+        manifest = json.load(f)
+
+    defaults = manifest.get("defaults", {})
+    entries = []
+    names = set()
+
+    for database in manifest["databases"]:
+        entry = dict(defaults, **database)
+
+        if "password_env" in entry and "password" not in entry:
+            entry["password"] = os.environ[entry["password_env"]]
+
+        entry.setdefault("database", None)
+        entry.setdefault("training_percentage", None)
+        entry.setdefault("name", entry["database"])
+
+        if entry["name"] is None or entry["name"] in names:
+            raise ValueError("Every database of the manifest needs a distinct name")
+        check_name(entry["name"])
+        names.add(entry["name"])
+
+        entries.append(entry)
+
+    return entries
+
+def cluster_database(name, profile, training_percentage, file, seed=0):
+    """ Steps 2 and 3 for one database, run in a worker process
+
+    Parameters
+    ----------
+    name : String
+        Name of the database
+    profile : Python tuple
+        amount_dict, list_of_distinct_nodes, distinct_labels, labs_sets as returned by preprocessing
+    training_percentage : Int
+        80, 70 or 50 to sample the nodes, None to use all of them
+    file : String
+        Name of the file the schema is written into
+    seed : Int
+        Seed used by the sampling and the clustering
+
+    Returns
+    -------
+    timings : Python dict
+        Time spent in each step and size of the result
+    """
+    import numpy as np
+    from sampling import sampling
+    from GMM_clustering import iter_gmm
+    from storing import storing
+
+    # the Gaussian Mixture Models draw from numpy's generator
+    random.seed(seed)
+    np.random.seed(seed)
+    amount_dict, list_of_distinct_nodes, distinct_labels, labs_sets = profile
+    timings = {"name": name, "patterns": len(list_of_distinct_nodes), "nodes": sum(amount_dict.values())}
+
+    t = time.perf_counter()
+    if training_percentage is not None:
+        amount_dict, list_of_distinct_nodes, validate, test = sampling(amount_dict, list_of_distinct_nodes, training_percentage)
+    timings["sampling_s"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    all_clusters, hierarchy_tree = iter_gmm(amount_dict, list_of_distinct_nodes, distinct_labels, labs_sets)
+    timings["clustering_s"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    storing(distinct_labels, labs_sets, hierarchy_tree, file)
+    timings["storing_s"] = time.perf_counter() - t
+
+    with open(file) as f:
+        timings["types"] = sum(1 for line in f) - 1
+
+    return timings
+
+def profile_database(drivers, entry):
+    """ Step 1 for one database, run in a worker thread with a driver shared by the databases of the same server
+
+    Parameters
+    ----------
+    drivers : Python dict
+        Drivers already opened, by bolt address and user
+    entry : Python dict
+        An entry of the manifest
+
+    Returns
+    -------
+    profile : Python tuple
+        amount_dict, list_of_distinct_nodes, distinct_labels, labs_sets as returned by preprocessing
+    profiling_s : Float
+        Time spent in step 1
+    """
+    driver = drivers[(entry["uri"], entry["user"])]
+    t = time.perf_counter()
+    profile = preprocessing(driver, entry["database"])
+    return profile, time.perf_counter() - t
+
+def batch_inference(entries, output_dir, profile_workers=4, cluster_workers=None, max_connections=None, drivers=None):
+    """ Infers the schema of every database : the profiling queries run in a thread pool and
+    each profile is clustered in a process pool as soon as it is fetched
+
+    Parameters
+    ----------
+    entries : Python list of dict
+        The databases to infer (see read_manifest)
+    output_dir : String
+        The schema of a database is written in output_dir/<name>/data.csv,
+        and the timings of all databases in output_dir/summary.csv
+    profile_workers : Int
+        Number of databases profiled at the same time
+    cluster_workers : Int
+        Number of processes clustering, the number of cpus by default
+    max_connections : Int
+        Connection pool size of each driver, profile_workers by default
+    drivers : Python dict
+        Drivers already opened by bolt address and user (they are opened from the manifest otherwise)
+
+    Returns
+    -------
+    summary : Python list of dict
+        Timings of every database, with the error for databases that failed
+        (the summary file also has a last row with the wall time of the whole batch)
+    """
+    for entry in entries:
+        check_name(entry["name"])
+    os.makedirs(output_dir, exist_ok=True)
+
+    # one driver (and connection pool) per server, shared by its databases
+    opened = {}
+    if drivers is None:
+        from neo4j import GraphDatabase
+        drivers = {}
+        for entry in entries:
+            key = (entry["uri"], entry["user"])
+            if key not in drivers:
+                drivers[key] = GraphDatabase.driver(entry["uri"], auth=(entry["user"], entry["password"]), encrypted=False,
+                                                    max_connection_pool_size=max_connections or profile_workers)
+                opened[key] = drivers[key]
+
+    summary = []
+    t = time.perf_counter()
+
+    try:
+        with ThreadPoolExecutor(profile_workers) as threads, ProcessPoolExecutor(cluster_workers) as processes:
+            profiling = {threads.submit(profile_database, drivers, entry): entry for entry in entries}
+            clustering = {}
+            profiling_times = {}
+
+            for future in as_completed(profiling):
+                entry = profiling[future]
+                try:
+                    profile, profiling_times[entry["name"]] = future.result()
+                except Exception as e:
+                    print(colored("Profiling "+entry["name"]+" failed: "+str(e), "red"))
+                    summary.append({"name": entry["name"], "error": repr(e)})
+                    continue
+
+                directory = os.path.join(output_dir, entry["name"])
+                os.makedirs(directory, exist_ok=True)
+                clustering[processes.submit(cluster_database, entry["name"], profile, entry["training_percentage"],
+                                            os.path.join(directory, "data.csv"))] = entry
+
+            for future in as_completed(clustering):
+                entry = clustering[future]
+                try:
+                    timings = future.result()
+                except Exception as e:
+                    print(colored("Clustering "+entry["name"]+" failed: "+str(e), "red"))
+                    summary.append({"name": entry["name"], "profiling_s": profiling_times[entry["name"]], "error": repr(e)})
+                    continue
+
+                timings["profiling_s"] = profiling_times[entry["name"]]
+                summary.append(timings)
+                print(colored(entry["name"]+" done.", "green"))
+    finally:
+        for driver in opened.values():
+            driver.close()
+
+    total = time.perf_counter() - t
+
+    header = ["name", "patterns", "nodes", "types", "profiling_s", "sampling_s", "clustering_s", "storing_s", "wall_s", "error"]
+    order = {entry["name"]: i for i, entry in enumerate(entries)}
+    summary.sort(key=lambda timings: order[timings["name"]])
+
+    with open(os.path.join(output_dir, "summary.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=header)
+        writer.writeheader()
+        for timings in summary:
+            writer.writerow(timings)
+        writer.writerow({"name": "total", "wall_s": total})
+
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Infer the schemas of all databases listed in a manifest")
+    parser.add_argument("manifest", help="json manifest of the databases")
+    parser.add_argument("output_dir", nargs="?", default="schemas", help="directory the schemas are written into")
+    parser.add_argument("--profile-workers", type=int, default=4, help="databases profiled at the same time")
+    parser.add_argument("--cluster-workers", type=int, default=None, help="clustering processes (number of cpus by default)")
+    parser.add_argument("--max-connections", type=int, default=None, help="connection pool size of each driver")
+    args = parser.parse_args()
+
+    print(colored("Batch schema inference\n", "red"))
+    summary = batch_inference(read_manifest(args.manifest), args.output_dir, args.profile_workers,
+                              args.cluster_workers, args.max_connections)
+    failed = [timings["name"] for timings in summary if timings.get("error")]
+    print(len(summary)-len(failed), "schemas inferred,", len(failed), "failed", failed if failed != [] else "")
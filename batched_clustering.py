@@ -0,0 +1,257 @@
+""" Step 2 level by level : the small splits of a depth are fitted together
+
+rec_clustering goes down the hierarchy one split at a time, and deep in the hierarchy most splits have a handful of
+distinct nodes : building and fitting a BayesianGaussianMixture then costs more than the split itself.
+level_clustering goes breadth-first instead. All the splits of a depth are gathered, the ones with more than
+batch_threshold distinct nodes are made by split_nodes as before, and the small ones are fitted at once by
+batched_mixture : a two-component Gaussian mixture trained by EM on padded arrays (one row per split, a mask for
+the padding), the distinct similarity values weighted by their number of occurrences.
+
+The EM of batched_mixture starts from the best cut between two consecutive values, it does not draw anything at
+random. Its splits are close to the ones of the Bayesian model but not always equal, and
+since the clusters are found in another order, a cluster found under two parents is kept under the first one met
+breadth-first.
+"""
+
+##### Imports
+from termcolor import colored
+import math
+
+### File imports
+import tracing
+
+### Lower bound of the variances, as reg_covar in sklearn
+REG_VARIANCE = 1e-6
+
+def batched_mixture(problems, max_iter=10, tol=1e-3):
+    """ Trains a two-component Gaussian mixture on each problem, all problems at once
+
+    Parameters
+    ----------
+    problems : Python list of tuples
+        The distinct values of each problem and their number of occurrences
+        Its format is : [([float1, float2, ...], [int1, int2, ...]), ...]
+    max_iter : Int
+        Maximum number of EM iterations
+    tol : Float
+        A problem stops when its mean log-likelihood changes by less than tol
+
+    Returns
+    -------
+    predictions : Python list of lists
+        The component of each value of each problem (0 or 1)
+    components : Python list of lists
+        Mean, variance and weight of the two components of each problem (None for both when its values are all
+        equal)
+        Its format is : [[(mean, variance, weight), (mean, variance, weight)], ...]
+    """
+    import numpy as np
+
+    if problems == []:
+        return [], []
+
+    # padded arrays : the padding weighs nothing and is sorted after the values
+    length = max(len(values) for values, counts in problems)
+    X = np.full((len(problems), length), np.inf)
+    W = np.zeros((len(problems), length))
+    for p, (values, counts) in enumerate(problems):
+        X[p, :len(values)] = values
+        W[p, :len(counts)] = counts
+    order = np.argsort(X, axis=1, kind="stable")
+    X = np.take_along_axis(X, order, axis=1)
+    W = np.take_along_axis(W, order, axis=1)
+    mask = W > 0
+    X = np.where(mask, X, 0.0)
+
+    # best cut between two consecutive distinct values (weighted two-means, with prefix sums)
+    weights = np.cumsum(W, axis=1)[:, :-1]
+    sums = np.cumsum(W*X, axis=1)[:, :-1]
+    total_weight = W.sum(axis=1, keepdims=True)
+    total_sum = (W*X).sum(axis=1, keepdims=True)
+    valid = mask[:, 1:] & (X[:, 1:] > X[:, :-1])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        gain = np.where(valid, sums**2/weights + (total_sum-sums)**2/(total_weight-weights), -np.inf)
+    separable = valid.any(axis=1) if length > 1 else np.zeros(len(problems), dtype=bool)
+    cut = np.argmax(gain, axis=1) if length > 1 else np.zeros(len(problems), dtype=int)
+    threshold = (np.take_along_axis(X, cut[:, None], axis=1) + np.take_along_axis(X, np.minimum(cut+1, length-1)[:, None], axis=1))/2
+
+    # hard responsibilities of the upper component to start with
+    upper = (X > threshold).astype(float)
+    resp = np.stack((1-upper, upper))
+
+    lower_bound = np.full(len(problems), -np.inf)
+    running = separable.copy()
+    for iteration in range(max_iter):
+        # M step
+        Nk = np.maximum((resp*W).sum(axis=2), 10*np.finfo(float).eps)
+        means = (resp*W*X).sum(axis=2)/Nk
+        variances = (resp*W*(X-means[:, :, None])**2).sum(axis=2)/Nk + REG_VARIANCE
+        log_weights = np.log(Nk/total_weight[:, 0])
+
+        # E step
+        log_prob = (log_weights[:, :, None] - 0.5*np.log(2*math.pi*variances)[:, :, None]
+                    - (X-means[:, :, None])**2/(2*variances[:, :, None]))
+        log_norm = np.logaddexp(log_prob[0], log_prob[1])
+        new_resp = np.exp(log_prob - log_norm)
+
+        # the problems that converged keep their responsibilities
+        resp = np.where(running[:, None], new_resp, resp)
+        new_bound = (W*log_norm).sum(axis=1)/total_weight[:, 0]
+        running &= np.abs(new_bound-lower_bound) >= tol
+        lower_bound = np.where(running, new_bound, lower_bound)
+        if not running.any():
+            break
+
+    tracing.count("batched_iterations", iteration+1 if separable.any() else 0)
+
+    labels = np.argmax(resp, axis=0)
+    predictions = []
+    components = []
+    for p, (values, counts) in enumerate(problems):
+        # back to the order of the values of the problem
+        prediction = [0]*len(values)
+        if separable[p]:
+            for j in range(len(values)):
+                prediction[order[p, j]] = int(labels[p, j])
+            components.append([(float(means[k, p]), float(variances[k, p]), float(Nk[k, p]/total_weight[p, 0]))
+                               for k in range(2)])
+        else:
+            components.append([None, None])
+        predictions.append(prediction)
+
+    return predictions, components
+
+def batched_splits(amount_dict, problems, distinct_labels, shared=None, max_iter=10, tol=1e-3):
+    """ split_nodes for many sets of patterns, with one batched_mixture
+
+    Parameters
+    ----------
+    amount_dict : Python dict
+        A dictionary with node strings as keys and the number of occurrences of the node as a value
+        Its format is : {'Label1 Label2 Label3 prop1 prop2 prop3 ...': int, ...}
+    problems : Python list of lists
+        The patterns of each cluster to split
+        Its format is : [['Label1 prop1 prop2 prop3', 'Label1 prop1 prop2', ...], ...]
+    distinct_labels : Python list
+        A list of labels
+    shared : SharedSubproblems
+        The similarities and reference nodes already computed, None to compute everything again
+
+    Returns
+    -------
+    splits : Python list of tuples
+        The clusters and components of each set of patterns, as returned by split_nodes
+    """
+    from GMM_clustering import max_labs_props, compute_similarities
+
+    splits = [None]*len(problems)
+    fitted = []
+    ref_nodes = []
+    inputs = []
+    for i, correct_nodes in enumerate(problems):
+        # BayesianGaussianMixture cannot cluster one node, neither does batched_mixture
+        if sum(amount_dict[node] for node in correct_nodes) <= 1:
+            splits[i] = ([], [])
+            continue
+
+        # get a reference node and the similarity measures, as split_nodes
+        if shared is not None:
+            ref_node = shared.reference_node(amount_dict, correct_nodes)
+            similarities_dict = shared.compute_similarities(correct_nodes, ref_node)
+        else:
+            ref_node = max_labs_props(amount_dict, correct_nodes, 1, distinct_labels)
+            similarities_dict = compute_similarities(correct_nodes, ref_node)
+
+        fitted.append(i)
+        ref_nodes.append(ref_node)
+        inputs.append(([similarities_dict[node] for node in correct_nodes], [amount_dict[node] for node in correct_nodes]))
+
+    predictions, components = batched_mixture(inputs, max_iter, tol)
+    tracing.count("batched_fits", len(fitted))
+
+    for i, ref_node, prediction, component in zip(fitted, ref_nodes, predictions, components):
+        # variable to keep separated nodes of the two clusters
+        clusters = [set(), set()]
+        for node, k in zip(problems[i], prediction):
+            clusters[k].add(node)
+        # the reference node goes with each component, as in split_nodes
+        splits[i] = (clusters, [c + (ref_node,) if c is not None else None for c in component])
+
+    return splits
+
+def level_clustering(amount_dict, base_types, distinct_labels, all_clusters, warm_start=False, shared=None,
+                     batch_threshold=32):
+    """ rec_clustering for many base types, breadth-first, the small splits of each depth being fitted together
+
+    Parameters
+    ----------
+    amount_dict : Python dict
+        A dictionary with node strings as keys and the number of occurrences of the node as a value
+    base_types : Python list of tuples
+        The patterns of each base type and its node of the hierarchy, [set(lab_set), None, None], filled in place
+        Its format is : [(['Label1 prop1', 'Label1 prop2', ...], [{'Label1'}, None, None]), ...]
+    distinct_labels : Python list
+        A list of labels
+    all_clusters : Python list of sets
+        The clusters already found
+    warm_start : Boolean
+        Start the models of the large splits from the components of their parent (see warm_started_mixture)
+    shared : SharedSubproblems
+        The similarities, reference nodes and splits already computed, None to compute everything again
+    batch_threshold : Int
+        The splits of at most batch_threshold distinct nodes are fitted by batched_mixture
+
+    Returns
+    -------
+    all_clusters : The same all_clusters as in parameters but with new clusters added
+    """
+    from GMM_clustering import split_nodes
+
+    print(colored("Clustering the base types level by level:", "yellow"))
+
+    # splits of the current depth : the patterns, the node of the hierarchy and the parent's component
+    level = [(correct_nodes, hierarchy, None) for correct_nodes, hierarchy in base_types]
+    depth = 0
+    while level:
+        with tracing.span("level", depth=depth, splits=len(level)):
+            splits = [None]*len(level)
+            small = []
+            for i, (correct_nodes, hierarchy, parent_component) in enumerate(level):
+                splits[i] = shared.split(correct_nodes) if shared is not None else None
+                if splits[i] is not None:
+                    continue
+                if len(correct_nodes) <= batch_threshold:
+                    small.append(i)
+                else:
+                    splits[i] = split_nodes(amount_dict, correct_nodes, distinct_labels, warm_start, parent_component, shared)
+
+            for i, split in zip(small, batched_splits(amount_dict, [level[i][0] for i in small], distinct_labels, shared)):
+                splits[i] = split
+
+            next_level = []
+            for (correct_nodes, hierarchy, parent_component), (clusters, components) in zip(level, splits):
+                if shared is not None:
+                    shared.store_split(correct_nodes, clusters, components)
+
+                for k in range(len(clusters)):
+                    set_cluster = set(clusters[k])
+
+                    # if the cluster is new and if not empty (ie. there are two found clusters)
+                    if shared is not None:
+                        new = shared.add_cluster(all_clusters, set_cluster) is not None
+                    else:
+                        new = set_cluster not in all_clusters and set_cluster != set()
+                        if new:
+                            all_clusters.append(set_cluster)
+
+                    # the subcluster is split at the next depth
+                    if new:
+                        subhierarchy = [set_cluster, None, None]
+                        hierarchy[k+1] = subhierarchy
+                        next_level.append((sorted(set_cluster), subhierarchy, components[k]))
+
+        level = next_level
+        depth += 1
+    print(colored("Done. "+str(depth)+" levels.", "green"))
+
+    return all_clusters
@@ -0,0 +1,331 @@
+""" Benchmarks of the steps and of the hot kernels over synthetic profiles of increasing sizes
+
+The time and the peak memory of each benchmark are appended to a json history. A run fails when a tracked metric
+is worse than the median of the last runs of the history by more than a threshold.
+"""
+
+##### Imports
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+### Sizes (number of nodes) of the synthetic profiles
+DEFAULT_SIZES = [10000, 50000, 200000]
+QUICK_SIZES = [2000, 10000]
+
+### Benchmarks, in the order they run
+STAGES = ["preprocessing", "sampling", "iter_gmm", "storing", "compute_f_score", "hdbscan_indexes"]
+KERNELS = ["dice_coefficient", "count_labs_props", "adjusted_random_index", "normalized_mutual_info"]
+
+def measure(function, setup=None, repeat=1, memory=True):
+    """ Times a function and measures its peak memory
+
+    Parameters
+    ----------
+    function : Callable
+        The function benchmarked, called with the arguments returned by setup
+    setup : Callable
+        Returns a tuple of fresh arguments for each call (not timed), no arguments when None
+    repeat : Int
+        The best time of repeat calls is kept
+    memory : Boolean
+        Measure the peak memory in another call, with tracemalloc (which slows the timed calls down otherwise)
+
+    Returns
+    -------
+    seconds : Float
+        Best time of the calls
+    peak : Int
+        Peak memory allocated during the call, in bytes (None without memory)
+    result : Object
+        The result of the last call
+    """
+    best = None
+    result = None
+    for i in range(repeat):
+        args = setup() if setup is not None else ()
+        with contextlib.redirect_stdout(io.StringIO()):
+            t = time.perf_counter()
+            result = function(*args)
+            seconds = time.perf_counter() - t
+        if best is None or seconds < best:
+            best = seconds
+
+    peak = None
+    if memory:
+        args = setup() if setup is not None else ()
+        tracemalloc.start()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                function(*args)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return best, peak, result
+
+def partitions(amount_dict, list_of_distinct_nodes, ground_truth):
+    """ Two partitions of the distinct nodes for the clustering indexes : the planted types and the first tokens """
+    types = {}
+    firsts = {}
+    for node in list_of_distinct_nodes:
+        types.setdefault(ground_truth.get(node), set()).add(node)
+        firsts.setdefault(node.split(" ")[0], set()).add(node)
+    return set(list_of_distinct_nodes), list(types.values()), list(firsts.values())
+
+def benchmark_size(n_nodes, results, names, repeat=1, memory=True, seed=0, directory="."):
+    """ Runs the benchmarks on a synthetic profile of n_nodes nodes
+
+    Parameters
+    ----------
+    n_nodes : Int
+        Number of nodes of the profile
+    results : Python dict
+        Results of the benchmarks, 'name@n_nodes' : {'time': seconds, 'peak_mb': megabytes}
+    names : Python list
+        The stages and kernels to run
+    repeat, memory :
+        See measure
+    seed : Int
+        Seed of the profile, of the sampling and of the clustering
+    directory : String
+        Directory of the schema files written
+    """
+    import numpy as np
+    from synthetic_graph import generate_profile
+    from local_driver import LocalGraph, LocalDriver
+    from preprocessing_step import preprocessing
+    from sampling import sampling
+    from GMM_clustering import iter_gmm, dice_coefficient, count_labs_props
+    from storing import storing
+    from rand_index import adjusted_random_index
+    from mutual_information import normalized_mutual_info
+
+    # without overlapping labels, the f-score can be computed (see f_score)
+    # the number of distinct nodes grows with the number of nodes
+    amount_dict, list_of_distinct_nodes, distinct_labels, labs_sets, truth = generate_profile(
+        n_nodes, seed, overlap_rate=0, patterns_per_type=max(8, n_nodes//2000))
+
+    def record(name, seconds, peak):
+        results[name+"@"+str(n_nodes)] = {"time": seconds, "peak_mb": peak/2**20 if peak is not None else None}
+
+    graph = LocalGraph.from_profile(amount_dict, distinct_labels)
+    if "preprocessing" in names:
+        seconds, peak, profile = measure(lambda: preprocessing(LocalDriver(graph)), repeat=repeat, memory=memory)
+        record("preprocessing", seconds, peak)
+
+    def sampled():
+        random.seed(seed)
+        return dict(amount_dict), list(list_of_distinct_nodes), 80
+
+    seconds, peak, (train_dict, train_nodes, validate, test) = measure(sampling, sampled, repeat, memory and "sampling" in names)
+    if "sampling" in names:
+        record("sampling", seconds, peak)
+
+    def clustered():
+        # the Gaussian Mixture Models draw from numpy's generator
+        random.seed(seed)
+        np.random.seed(seed)
+        return train_dict, train_nodes, distinct_labels, labs_sets
+
+    need_schema = any(name in names for name in ("iter_gmm", "storing", "compute_f_score", "hdbscan_indexes"))
+    if need_schema:
+        seconds, peak, (all_clusters, hierarchy_tree) = measure(iter_gmm, clustered, repeat, memory and "iter_gmm" in names)
+        if "iter_gmm" in names:
+            record("iter_gmm", seconds, peak)
+
+        file = os.path.join(directory, "benchmark_"+str(n_nodes)+".csv")
+        seconds, peak, file = measure(lambda: storing(distinct_labels, labs_sets, hierarchy_tree, file),
+                                      repeat=repeat, memory=memory and "storing" in names)
+        if "storing" in names:
+            record("storing", seconds, peak)
+
+    if "compute_f_score" in names:
+        from f_score import compute_f_score
+        try:
+            seconds, peak, score = measure(lambda: compute_f_score(test, distinct_labels, file), repeat=repeat, memory=memory)
+            record("compute_f_score", seconds, peak)
+        except ValueError:
+            # a test node matching no type without optional tokens (see f_score)
+            results["compute_f_score@"+str(n_nodes)] = {"skipped": "a test node matches no inferred type"}
+
+    if "hdbscan_indexes" in names:
+        try:
+            import hdbscan
+        except ImportError:
+            results["hdbscan_indexes@"+str(n_nodes)] = {"skipped": "hdbscan is not installed"}
+        else:
+            from hdbscan_indexes import hdbscan_indexes
+            with open(file) as f:
+                len_X = sum(1 for line in f) - 1
+            seconds, peak, indexes = measure(lambda: hdbscan_indexes(validate, distinct_labels, len_X, file),
+                                             repeat=repeat, memory=memory)
+            record("hdbscan_indexes", seconds, peak)
+
+    ### Kernels
+    if "dice_coefficient" in names:
+        references = list_of_distinct_nodes[:10]
+        def dice():
+            for reference in references:
+                for node in list_of_distinct_nodes:
+                    dice_coefficient(reference, node)
+        seconds, peak, result = measure(dice, repeat=repeat, memory=memory)
+        record("dice_coefficient", seconds, peak)
+
+    if "count_labs_props" in names:
+        seconds, peak, result = measure(lambda: count_labs_props(amount_dict, list_of_distinct_nodes, distinct_labels),
+                                        repeat=repeat, memory=memory)
+        record("count_labs_props", seconds, peak)
+
+    S, X, Y = partitions(amount_dict, list_of_distinct_nodes, truth["patterns"])
+    if "adjusted_random_index" in names:
+        seconds, peak, result = measure(lambda: adjusted_random_index(S, X, Y), repeat=repeat, memory=memory)
+        record("adjusted_random_index", seconds, peak)
+
+    if "normalized_mutual_info" in names:
+        seconds, peak, result = measure(lambda: normalized_mutual_info(S, X, Y), repeat=repeat, memory=memory)
+        record("normalized_mutual_info", seconds, peak)
+
+def run_benchmarks(sizes=DEFAULT_SIZES, names=None, repeat=1, memory=True, seed=0, import_time=True):
+    """ Runs the benchmarks over profiles of increasing sizes
+
+    Parameters
+    ----------
+    sizes : Python list
+        Numbers of nodes of the profiles
+    names : Python list
+        The stages and kernels to run (see STAGES and KERNELS), all of them when None
+    repeat, memory :
+        See measure
+    seed : Int
+        Seed of the profiles
+    import_time : Boolean
+        Also measure the time taken to import the library (see cli.import_time)
+
+    Returns
+    -------
+    results : Python dict
+        'name@size' : {'time': seconds, 'peak_mb': megabytes}
+    """
+    if names is None:
+        names = STAGES+KERNELS
+
+    results = {}
+    if import_time:
+        from cli import import_time as library_import_time, LIBRARY_MODULES
+        results["import@0"] = {"time": library_import_time(LIBRARY_MODULES)[0], "peak_mb": None}
+
+    with tempfile.TemporaryDirectory() as directory:
+        for n_nodes in sizes:
+            print("Benchmarking", n_nodes, "nodes...")
+            benchmark_size(n_nodes, results, names, repeat, memory, seed, directory)
+
+    return results
+
+def git_commit():
+    """ Commit of the working tree, None outside of a git repository """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def read_history(file):
+    """ Runs recorded in a history file (an empty list if it does not exist) """
+    if not os.path.exists(file):
+        return []
+    with open(file) as f:
+        return json.load(f)["runs"]
+
+def record_run(file, results):
+    """ Appends the results of a run to a history file """
+    runs = read_history(file)
+    runs.append({"timestamp": time.time(), "commit": git_commit(), "python": platform.python_version(),
+                 "machine": platform.machine(), "results": results})
+    with open(file, "w") as f:
+        json.dump({"runs": runs}, f, indent=1)
+
+def median(values):
+    values = sorted(values)
+    middle = len(values)//2
+    return values[middle] if len(values) % 2 == 1 else (values[middle-1]+values[middle])/2
+
+def check_regressions(runs, results, threshold=0.25, memory_threshold=0.2, window=5, min_time=0.005, min_memory=1.0):
+    """ Compares the results of a run with the last runs of a history
+
+    Parameters
+    ----------
+    runs : Python list
+        Runs of the history, as returned by read_history
+    results : Python dict
+        Results of the new run
+    threshold, memory_threshold : Float
+        Tolerated relative increase of the time and of the peak memory
+    window : Int
+        Number of last runs whose median is the baseline of a metric
+    min_time, min_memory : Float
+        Increases smaller than min_time seconds or min_memory megabytes are noise and are ignored
+
+    Returns
+    -------
+    regressions : Python list
+        A description of each metric worse than its baseline by more than its threshold
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        for metric, tolerance, floor in (("time", threshold, min_time), ("peak_mb", memory_threshold, min_memory)):
+            value = result.get(metric)
+            if value is None:
+                continue
+            previous = [run["results"][name][metric] for run in runs
+                        if run["results"].get(name, {}).get(metric) is not None][-window:]
+            if previous == []:
+                continue
+            baseline = median(previous)
+            if value > baseline*(1+tolerance) and value-baseline > floor:
+                regressions.append(name+" "+metric+": "+format(value, ".4g")+" instead of "+format(baseline, ".4g")+
+                                   " (+"+format(100*(value/baseline-1), ".0f")+"%)")
+    return regressions
+
+def scaling_exponent(sizes, values):
+    """ Slope of the least squares line of log(value) against log(size) : 1 for linear, 2 for quadratic... """
+    points = [(math.log(size), math.log(value)) for size, value in zip(sizes, values) if size > 0 and value > 0]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, y in points)/len(points)
+    mean_y = sum(y for x, y in points)/len(points)
+    variance = sum((x-mean_x)**2 for x, y in points)
+    if variance == 0:
+        return None
+    return sum((x-mean_x)*(y-mean_y) for x, y in points)/variance
+
+def print_scaling(results, width=40):
+    """ Prints the time and memory of each benchmark against the size of the profiles """
+    benchmarks = {}
+    for key, result in results.items():
+        name, size = key.rsplit("@", 1)
+        benchmarks.setdefault(name, []).append((int(size), result))
+
+    for name, points in benchmarks.items():
+        points.sort()
+        timed = [(size, result) for size, result in points if "time" in result]
+        if timed == [] or timed[0][0] == 0:
+            for size, result in points:
+                print(name+":", result.get("skipped", format(result.get("time", 0), ".4f")+" s"))
+            continue
+
+        exponent = scaling_exponent([size for size, result in timed], [result["time"] for size, result in timed])
+        print(name+(" (time ~ n^"+format(exponent, ".2f")+")" if exponent is not None else ""))
+        longest = max(result["time"] for size, result in timed)
+        for size, result in timed:
+            bar = "#"*max(1, int(round(width*result["time"]/longest))) if longest > 0 else ""
+            memory = format(result["peak_mb"], ".1f")+" MB" if result["peak_mb"] is not None else ""
+            print("  "+str(size).rjust(9)+"  "+format(result["time"], ".4f").rjust(9)+" s  "+memory.rjust(10)+"  "+bar)
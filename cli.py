@@ -0,0 +1,445 @@
+""" Command line interface : python3 cli.py <command> --help
+
+Only the modules of the command that runs are imported, and the heavy dependencies
+(sklearn, hdbscan, numpy, neo4j) are only imported by the steps that need them.
+"""
+
+##### Imports
+import argparse
+import os
+import subprocess
+import sys
+
+### Modules of the library that must stay cheap to import
+LIBRARY_MODULES = ["cli", "schema_inference", "preprocessing_step", "sampling", "GMM_clustering", "storing",
+                   "infer", "f_score", "hdbscan_indexes", "rand_index", "mutual_information", "batch_inference", "tracing",
+                   "property_stats", "edge_clustering", "schema_diff",
+                   "sketch_profile", "profile_cache",
+                   "benchmarks", "label_lattice", "streaming_pipeline", "sweep", "fca",
+                   "server_metadata", "batched_clustering", "schema_service",
+                   "conformance", "query_profiling"]
+
+### Modules that must not be imported by the library modules
+HEAVY_MODULES = ["sklearn", "hdbscan", "numpy", "neo4j", "scipy"]
+
+def open_driver(args):
+    """ Opens a driver from the --uri, --user and --password(-env) options """
+    from neo4j import GraphDatabase
+
+    password = args.password
+    if password is None:
+        password = os.environ.get(args.password_env, "")
+    return GraphDatabase.driver(args.uri, auth=(args.user, password), encrypted=False)
+
+def add_connection_arguments(parser):
+    parser.add_argument("--uri", default="bolt://localhost:7687", help="Neo4j bolt address")
+    parser.add_argument("--user", default="neo4j", help="Neo4j username")
+    parser.add_argument("--password", default=None, help="Neo4j password (prefer --password-env)")
+    parser.add_argument("--password-env", default="NEO4J_PASSWORD", help="environment variable holding the password")
+    parser.add_argument("--database", default=None, help="name of the database, the default one otherwise")
+
+def cache_key(args):
+    """ Name of the database of the connection options in the profile cache """
+    return args.uri+"/"+(args.database or "")
+
+def infer_command(args):
+    import tracing
+    from schema_inference import infer_schema
+
+    if args.trace:
+        tracing.enable(memory=not args.no_trace_memory)
+
+    profile = None
+    if args.sketch is not None:
+        from sketch_profile import SketchProfile
+        profile = SketchProfile.load(args.sketch).to_profile()
+
+    cache = None
+    if args.cache_dir is not None:
+        from profile_cache import ProfileCache
+        cache = ProfileCache(args.cache_dir, args.max_age)
+        if args.refresh:
+            cache.invalidate(cache_key(args))
+            cache.invalidate(cache_key(args)+"#property_stats")
+
+    driver = open_driver(args) if profile is None else None
+    if driver is not None and (args.profile_queries or args.profile_plans):
+        from query_profiling import ProfilingDriver
+        driver = ProfilingDriver(driver, plans=args.profile_plans)
+    try:
+        if args.stream:
+            from streaming_pipeline import streaming_inference
+            result = streaming_inference(driver, file=args.output, database=args.database, scan_workers=args.scan_workers,
+                                         cluster_workers=args.cluster_workers, warm_start=args.warm_start, seed=args.seed)
+        else:
+            result = infer_schema(driver, profile, training_percentage=args.training_percentage, file=args.output,
+                                  database=args.database, seed=args.seed, warm_start=args.warm_start,
+                                  property_stats=args.property_stats, cache=cache, cache_key=cache_key(args),
+                                  fca_threshold=args.fca_threshold, min_support=args.min_support,
+                                  metadata=args.metadata, batch_threshold=args.batch_threshold,
+                                  progressive=args.progressive, tolerance=args.tolerance, share=args.share)
+    finally:
+        if driver is not None:
+            driver.close()
+
+    for step, duration in result["timings"].items():
+        print(step+":", duration, "s")
+    print("Schema written to", result["file"])
+
+    if driver is not None and (args.profile_queries or args.profile_plans):
+        driver.stats.print_report()
+
+    if args.trace:
+        tracer = tracing.disable()
+        tracer.write_chrome_trace(args.trace)
+        tracer.print_summary()
+
+    if args.f_score:
+        from f_score import compute_f_score
+        print("F-score : ", compute_f_score(result["test"], result["distinct_labels"], result["file"]))
+
+    if args.hdbscan:
+        from hdbscan_indexes import hdbscan_indexes
+        with open(result["file"]) as f:
+            len_X = sum(1 for line in f) - 1
+        ari, ami = hdbscan_indexes(result["validate"], result["distinct_labels"], len_X, result["file"])
+        print("Rand Index : ", ari)
+        print("Adjusted Mutual Information : ", ami)
+
+def edges_command(args):
+    from edge_clustering import infer_edge_types
+
+    driver = open_driver(args)
+    try:
+        result = infer_edge_types(driver, file=args.output, database=args.database, warm_start=args.warm_start)
+    finally:
+        driver.close()
+
+    for step, duration in result["timings"].items():
+        print(step+":", duration, "s")
+    print("Edge types written to", result["file"])
+
+def sweep_command(args):
+    from sweep import profile_once, sweep
+
+    if args.profile_dir is not None:
+        from columnar_profile import ColumnarProfile
+        profile = ColumnarProfile(args.profile_dir)
+    else:
+        driver = open_driver(args)
+        try:
+            profile = profile_once(driver, os.path.join(args.output_dir, "profile"), args.database)
+        finally:
+            driver.close()
+
+    choices = {"off": [False], "on": [True], "both": [False, True]}
+    grid = {"training_percentage": args.training_percentages, "seed": args.seeds,
+            "warm_start": choices[args.warm_start], "share": choices[args.share]}
+    metrics = [metric for metric in ("f_score", "hdbscan") if metric not in args.skip_metrics]
+
+    rows = sweep(profile, grid, args.output_dir, args.workers, metrics)
+    print(len(rows), "configurations in", os.path.join(args.output_dir, "results.csv"))
+
+def diff_command(args):
+    import json
+    from schema_diff import diff_schemas, print_diff
+
+    diff = diff_schemas(args.old, args.new, args.min_similarity)
+    if args.json:
+        print(json.dumps(diff, indent=2))
+    else:
+        print_diff(diff)
+
+    if args.fail_on_drift and diff["old_hash"] != diff["new_hash"]:
+        sys.exit(1)
+
+def conform_command(args):
+    import json
+    from conformance import conformance_scan, print_report
+
+    driver = open_driver(args)
+    try:
+        report = conformance_scan(driver, args.schema, database=args.database, batch_size=args.batch_size,
+                                  workers=args.workers, samples=args.samples, seed=args.seed)
+    finally:
+        driver.close()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+    if args.fail_on_violation and report["invalid"] > 0:
+        sys.exit(1)
+
+def serve_command(args):
+    from schema_service import serve
+    serve(args.schema, host=args.host, port=args.port, socket_path=args.socket,
+          reload_interval=args.reload_interval if args.reload_interval > 0 else None)
+
+def sketch_command(args):
+    from sketch_profile import sketch_files, sketch_driver, merge_sketches
+
+    params = {"capacity": args.capacity, "width": args.width, "depth": args.depth}
+    sketches = []
+    if args.files != []:
+        sketches.append(sketch_files(args.files, args.workers, **params))
+    if args.neo4j:
+        driver = open_driver(args)
+        try:
+            sketches.append(sketch_driver(driver, args.database, **params))
+        finally:
+            driver.close()
+
+    sketch = merge_sketches(sketches)
+    if sketch is None:
+        sys.exit("Nothing to profile : give JSONL exports, saved sketches or --neo4j")
+    sketch.save(args.output)
+    summary = sketch.summary()
+    print(summary["nodes"], "nodes,", summary["patterns"], "distinct patterns (estimated),",
+          summary["kept_patterns"], "kept, written to", args.output)
+
+def cache_clear_command(args):
+    from profile_cache import ProfileCache
+
+    cache = ProfileCache(args.cache_dir)
+    if args.all:
+        removed = cache.invalidate()
+    else:
+        removed = cache.invalidate(cache_key(args)) + cache.invalidate(cache_key(args)+"#property_stats")
+    print(removed, "cached profiles removed")
+
+def bench_command(args):
+    from benchmarks import (run_benchmarks, read_history, record_run, check_regressions, print_scaling,
+                            DEFAULT_SIZES, QUICK_SIZES)
+
+    sizes = args.sizes or (QUICK_SIZES if args.quick else DEFAULT_SIZES)
+    results = run_benchmarks(sizes, args.only, args.repeat, not args.no_memory, args.seed)
+    print_scaling(results)
+
+    regressions = check_regressions(read_history(args.history), results, args.threshold, args.memory_threshold, args.window)
+    if not args.no_record:
+        record_run(args.history, results)
+
+    if regressions != []:
+        print("Regressions:")
+        for regression in regressions:
+            print("  "+regression)
+        sys.exit(1)
+
+def batch_command(args):
+    from batch_inference import batch_inference, read_manifest
+
+    batch_inference(read_manifest(args.manifest), args.output_dir, args.profile_workers,
+                    args.cluster_workers, args.max_connections)
+
+def synthetic_command(args):
+    from synthetic_graph import write_neo4j_admin_csv
+
+    write_neo4j_admin_csv(args.directory, args.nodes, seed=args.seed, n_base_types=args.base_types,
+                          overlap_rate=args.overlap_rate, optional_prob=args.optional_prob,
+                          key_vocabulary=args.key_vocabulary, zipf_exponent=args.zipf_exponent,
+                          subtype_depth=args.subtype_depth)
+
+def import_time(modules):
+    """ Imports modules in a new interpreter
+
+    Parameters
+    ----------
+    modules : Python list
+        Names of the modules to import
+
+    Returns
+    -------
+    duration : Float
+        Time spent importing the modules, in seconds
+    heavy : Python list
+        Heavy modules (HEAVY_MODULES) that were imported along
+    """
+    code = ("import sys, time\n"
+            "t = time.perf_counter()\n"
+            "import "+", ".join(modules)+"\n"
+            "print(time.perf_counter() - t)\n"
+            "print(' '.join(m for m in "+repr(HEAVY_MODULES)+" if m in sys.modules))\n")
+    output = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, check=True).stdout.split("\n")
+    return float(output[0]), output[1].split()
+
+def check_imports_command(args):
+    duration, heavy = import_time(LIBRARY_MODULES)
+    print("Importing the library took", round(duration, 3), "s (budget:", args.budget, "s)")
+
+    failed = False
+    if heavy != []:
+        print("Heavy modules imported at import time:", ", ".join(heavy))
+        failed = True
+    if duration > args.budget:
+        print("The import time budget is exceeded")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Property graph schema inference")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    infer = commands.add_parser("infer", help="infer the schema of a database (steps 1 to 3)")
+    add_connection_arguments(infer)
+    infer.add_argument("--output", default="data.csv", help="file the schema is written into")
+    infer.add_argument("--training-percentage", type=int, choices=[80, 70, 50], default=None,
+                       help="cluster a training set only (needed by --f-score and --hdbscan)")
+    infer.add_argument("--seed", type=int, default=None, help="seed of the sampling and the clustering")
+    infer.add_argument("--warm-start", action="store_true", help="start the model of each subcluster from its parent's component")
+    infer.add_argument("--fca-threshold", type=int, default=None,
+                       help="cluster the base types with at most this many distinct nodes with formal concept analysis")
+    infer.add_argument("--min-support", type=float, default=0.01, help="minimum share of a base type in a concept")
+    infer.add_argument("--batch-threshold", type=int, default=None,
+                       help="cluster level by level, fitting the splits of at most this many distinct nodes together")
+    infer.add_argument("--progressive", action="store_true",
+                       help="cluster growing samples (1%%, 2%%, 5%%, ...) until the hierarchy stops changing")
+    infer.add_argument("--tolerance", type=float, default=0.95,
+                       help="similarity of the hierarchies of two samples from which --progressive stops")
+    infer.add_argument("--share", action="store_true",
+                       help="share similarities and splits between overlapping label sets (a set of patterns is split once)")
+    infer.add_argument("--sketch", default=None, help="infer the schema of a sketch written by the sketch command")
+    infer.add_argument("--property-stats", action="store_true",
+                       help="scan the property values to write the datatypes of the properties")
+    infer.add_argument("--cache-dir", default=None, help="reuse the profile cached in this directory while the database does not change")
+    infer.add_argument("--max-age", type=float, default=None, help="seconds after which a cached profile is not reused (needed to reuse it on servers without JMX, e.g. Neo4j 5)")
+    infer.add_argument("--refresh", action="store_true", help="profile the database again and update the cache")
+    infer.add_argument("--metadata", action="store_true",
+                       help="read labels, label counts and sets of labels from the metadata of the server instead of scanning")
+    infer.add_argument("--stream", action="store_true",
+                       help="cluster each base type as soon as its sets of labels are scanned (no sampling, cache or sketch); "
+                            "base types are clustered separately, so a cluster shared by two base types is kept twice and "
+                            "the schema can differ from the one written without --stream")
+    infer.add_argument("--scan-workers", type=int, default=4, help="sets of labels scanned at the same time with --stream")
+    infer.add_argument("--cluster-workers", type=int, default=None,
+                       help="clustering processes with --stream (number of cpus by default, 0 for none)")
+    infer.add_argument("--profile-queries", action="store_true",
+                       help="report the client and server time of the queries, per query template")
+    infer.add_argument("--profile-plans", action="store_true",
+                       help="run the queries with PROFILE and report their db hits (implies --profile-queries)")
+    infer.add_argument("--trace", default=None, help="write a Chrome trace of the run into this json file")
+    infer.add_argument("--no-trace-memory", action="store_true", help="do not measure memory while tracing")
+    infer.add_argument("--f-score", action="store_true", help="compute the f-score on the test set (only LDBC)")
+    infer.add_argument("--hdbscan", action="store_true", help="compare the types with Hdbscan's clusters")
+    infer.set_defaults(run=infer_command)
+
+    edges = commands.add_parser("edges", help="infer the hierarchy of the edge types of a database")
+    add_connection_arguments(edges)
+    edges.add_argument("--output", default="edges.csv", help="file the edge types are written into")
+    edges.add_argument("--warm-start", action="store_true", help="start the model of each subcluster from its parent's component")
+    edges.set_defaults(run=edges_command)
+
+    sweep = commands.add_parser("sweep", help="run a grid of settings over one profile and tabulate the metrics")
+    add_connection_arguments(sweep)
+    sweep.add_argument("output_dir", nargs="?", default="sweep", help="directory of results.csv and of the schemas")
+    sweep.add_argument("--profile-dir", default=None, help="profile directory to use instead of profiling the database")
+    sweep.add_argument("--training-percentages", nargs="+", type=int, choices=[80, 70, 50], default=[80],
+                       help="training percentages of the grid")
+    sweep.add_argument("--seeds", nargs="+", type=int, default=[0], help="seeds of the grid")
+    sweep.add_argument("--warm-start", choices=["off", "on", "both"], default="off", help="warm start values of the grid")
+    sweep.add_argument("--share", choices=["off", "on", "both"], default="off",
+                       help="sharing of the subproblems of overlapping label sets in the grid")
+    sweep.add_argument("--skip-metrics", nargs="+", choices=["f_score", "hdbscan"], default=[], help="metrics not computed")
+    sweep.add_argument("--workers", type=int, default=None, help="processes running the configurations")
+    sweep.set_defaults(run=sweep_command)
+
+    diff = commands.add_parser("diff", help="compare two schema files")
+    diff.add_argument("old", help="schema file of the previous run")
+    diff.add_argument("new", help="schema file of the new run")
+    diff.add_argument("--min-similarity", type=float, default=0.5,
+                      help="similarity of two types to report a change instead of a removal and an addition")
+    diff.add_argument("--json", action="store_true", help="print the diff as json")
+    diff.add_argument("--fail-on-drift", action="store_true", help="exit with an error when the schemas differ")
+    diff.set_defaults(run=diff_command)
+
+    conform = commands.add_parser("conform", help="count the nodes of a database that violate their inferred type")
+    add_connection_arguments(conform)
+    conform.add_argument("schema", nargs="?", default="data.csv", help="schema file written by storing")
+    conform.add_argument("--batch-size", type=int, default=10000, help="number of ids read by one query")
+    conform.add_argument("--workers", type=int, default=4, help="ranges of ids read at the same time")
+    conform.add_argument("--samples", type=int, default=5, help="ids of invalid nodes kept per base type")
+    conform.add_argument("--seed", type=int, default=None, help="seed of the samples")
+    conform.add_argument("--json", action="store_true", help="print the report as json")
+    conform.add_argument("--fail-on-violation", action="store_true", help="exit with an error when a node is invalid")
+    conform.set_defaults(run=conform_command)
+
+    serve = commands.add_parser("serve", help="classify and validate nodes against a schema file over HTTP or a Unix socket")
+    serve.add_argument("schema", nargs="?", default="data.csv", help="schema file written by storing")
+    serve.add_argument("--host", default="127.0.0.1", help="address of the HTTP server")
+    serve.add_argument("--port", type=int, default=7475, help="port of the HTTP server")
+    serve.add_argument("--socket", default=None, help="serve this Unix socket instead of HTTP")
+    serve.add_argument("--reload-interval", type=float, default=1.0,
+                       help="seconds between two checks of the schema file for a new version (0 to never reload)")
+    serve.set_defaults(run=serve_command)
+
+    sketch = commands.add_parser("sketch", help="profile JSONL exports or a database into a mergeable sketch")
+    add_connection_arguments(sketch)
+    sketch.add_argument("output", help="json file the merged sketch is written into")
+    sketch.add_argument("files", nargs="*", help=".jsonl exports or sketches to merge")
+    sketch.add_argument("--neo4j", action="store_true", help="also profile the database of the connection options")
+    sketch.add_argument("--workers", type=int, default=None, help="processes profiling the files")
+    sketch.add_argument("--capacity", type=int, default=100000, help="number of patterns counted exactly")
+    sketch.add_argument("--width", type=int, default=1 << 16, help="width of the Count-Min sketch")
+    sketch.add_argument("--depth", type=int, default=4, help="depth of the Count-Min sketch")
+    sketch.set_defaults(run=sketch_command)
+
+    cache_clear = commands.add_parser("cache-clear", help="remove cached profiles")
+    add_connection_arguments(cache_clear)
+    cache_clear.add_argument("--cache-dir", default=".pg_cache", help="directory of the cache")
+    cache_clear.add_argument("--all", action="store_true", help="remove the profiles of every database")
+    cache_clear.set_defaults(run=cache_clear_command)
+
+    batch = commands.add_parser("batch", help="infer the schemas of the databases of a manifest")
+    batch.add_argument("manifest", help="json manifest of the databases")
+    batch.add_argument("output_dir", nargs="?", default="schemas", help="directory the schemas are written into")
+    batch.add_argument("--profile-workers", type=int, default=4, help="databases profiled at the same time")
+    batch.add_argument("--cluster-workers", type=int, default=None, help="clustering processes")
+    batch.add_argument("--max-connections", type=int, default=None, help="connection pool size of each driver")
+    batch.set_defaults(run=batch_command)
+
+    synthetic = commands.add_parser("synthetic", help="write a synthetic graph for neo4j-admin import")
+    synthetic.add_argument("directory", help="directory the csv files are written into")
+    synthetic.add_argument("--nodes", type=int, default=1000000, help="number of nodes")
+    synthetic.add_argument("--seed", type=int, default=0, help="seed of the generator")
+    synthetic.add_argument("--base-types", type=int, default=5, help="number of base types")
+    synthetic.add_argument("--overlap-rate", type=float, default=0.1, help="probability of an extra label")
+    synthetic.add_argument("--optional-prob", type=float, default=0.3, help="probability of an optional property")
+    synthetic.add_argument("--key-vocabulary", type=int, default=50, help="number of distinct properties")
+    synthetic.add_argument("--zipf-exponent", type=float, default=1.2, help="exponent of the pattern frequencies")
+    synthetic.add_argument("--subtype-depth", type=int, default=2, help="depth of the planted subtypes")
+    synthetic.set_defaults(run=synthetic_command)
+
+    bench = commands.add_parser("bench", help="benchmark the steps and kernels, fail on regressions")
+    bench.add_argument("sizes", nargs="*", type=int, help="numbers of nodes of the synthetic profiles")
+    bench.add_argument("--quick", action="store_true", help="small profiles only")
+    bench.add_argument("--only", nargs="+", default=None, help="stages and kernels to run (all by default)")
+    bench.add_argument("--history", default="benchmarks.json", help="json history of the runs")
+    bench.add_argument("--threshold", type=float, default=0.25, help="tolerated relative increase of a time")
+    bench.add_argument("--memory-threshold", type=float, default=0.2, help="tolerated relative increase of a peak memory")
+    bench.add_argument("--window", type=int, default=5, help="number of last runs whose median is the baseline")
+    bench.add_argument("--repeat", type=int, default=1, help="best time of repeat runs")
+    bench.add_argument("--seed", type=int, default=0, help="seed of the profiles")
+    bench.add_argument("--no-memory", action="store_true", help="do not measure peak memory")
+    bench.add_argument("--no-record", action="store_true", help="do not append the run to the history")
+    bench.set_defaults(run=bench_command)
+
+    check = commands.add_parser("check-imports", help="fail if importing the library is too slow or imports heavy modules")
+    check.add_argument("--budget", type=float, default=0.5, help="import time budget in seconds")
+    check.set_defaults(run=check_imports_command)
+
+    args = parser.parse_args(argv)
+    if args.command == "infer" and args.stream:
+        for option in ["training_percentage", "sketch", "cache_dir", "f_score", "hdbscan", "property_stats", "fca_threshold",
+                       "metadata", "batch_threshold",
+                       "progressive", "share"]:
+            if getattr(args, option) not in (None, False):
+                parser.error("--stream cannot be used with --"+option.replace("_", "-"))
+    if args.command == "infer" and (args.f_score or args.hdbscan) and args.training_percentage is None:
+        parser.error("--f-score/--hdbscan need --training-percentage")
+    args.run(args)
+
+if __name__ == "__main__":
+    main()
@@ -3,34 +3,47 @@
 ##### Imports
 from termcolor import colored
 import csv
+import os
 import time
+import tracing
 
-### Neo4j imports
-from neo4j import GraphDatabase
-
-### File imports
-from preprocessing_step import *
-from sampling import *
-from GMM_clustering import *
-from storing import *
-from infer import *
-from f_score import *
-from hdbscan_indexes import *
+### File imports (the heavy dependencies are only imported by the steps using them)
+from preprocessing_step import preprocessing
+from sampling import sampling
+from GMM_clustering import iter_gmm
+from storing import storing
+from infer import create_neo4j_graph
+from f_score import compute_f_score
+from hdbscan_indexes import hdbscan_indexes
 
 if __name__ == "__main__":
+    from neo4j import GraphDatabase
 
     print(colored("Schema inference using Gaussian Mixture Model clustering on PG\n", "red"))
 
+    # set PG_TRACE to the name of a json file to trace every step (PG_TRACE_MEMORY=0 to skip memory measures)
+    trace_file = os.environ.get("PG_TRACE")
+    if trace_file:
+        tracing.enable(memory=os.environ.get("PG_TRACE_MEMORY", "1") != "0")
+
+    # set PG_PROFILE_QUERIES to 1 to profile the queries of step 1 and of the export (to plans to run them with PROFILE)
+    profile_queries = os.environ.get("PG_PROFILE_QUERIES", "0")
+    if profile_queries != "0":
+        from query_profiling import ProfilingDriver
+
     ### Inputs
     DBname = input("Name of the database: ")
     uri = input("Neo4j bolt address: ")
     user = input("Neo4j username: ")
     passwd = input('Neo4j password: ')
     driver = GraphDatabase.driver(uri, auth=(user, passwd), encrypted=False) # set encrypted to False to avoid possible errors
+    if profile_queries != "0":
+        driver = ProfilingDriver(driver, plans=profile_queries == "plans")
     
     print(colored("Starting to query on ", "red"), colored(DBname, "red"), colored(":","red"))
     t1 = time.perf_counter()
-    amount_dict,list_of_distinct_nodes,distinct_labels,labs_sets = preprocessing(driver)
+    with tracing.span("preprocessing"):
+        amount_dict,list_of_distinct_nodes,distinct_labels,labs_sets = preprocessing(driver)
     t1f = time.perf_counter()
 
     step1 = t1f - t1 # time to complete step 1
@@ -41,7 +54,8 @@ if __name__ == "__main__":
 
     print(colored("Data sampling : ","blue"))
     ts = time.perf_counter()
-    amount_dict,list_of_distinct_nodes,validate,test = sampling(amount_dict,list_of_distinct_nodes, 80)
+    with tracing.span("sampling"):
+        amount_dict,list_of_distinct_nodes,validate,test = sampling(amount_dict,list_of_distinct_nodes, 80)
     tsf = time.perf_counter()
     steps = tsf - ts # time to complete the sampling step
     print(colored("Separating done.", "green"))
@@ -51,7 +65,10 @@ if __name__ == "__main__":
 
     print(colored("Starting to cluster data using GMM :","red"))
     t2 = time.perf_counter()
-    all_clusters, hierarchy_tree = iter_gmm(amount_dict, list_of_distinct_nodes, distinct_labels, labs_sets)
+    with tracing.span("clustering") as current:
+        if current:
+            current.set(patterns=len(list_of_distinct_nodes), base_types=len(labs_sets))
+        all_clusters, hierarchy_tree = iter_gmm(amount_dict, list_of_distinct_nodes, distinct_labels, labs_sets)
     t2f = time.perf_counter()
 
     step2 = t2f - t2 # time to complete step 2
@@ -62,7 +79,8 @@ if __name__ == "__main__":
 
     print(colored("Writing file and identifying subtypes :","red"))
     t3 = time.perf_counter()
-    file = storing(distinct_labels,labs_sets,hierarchy_tree)
+    with tracing.span("storing"):
+        file = storing(distinct_labels,labs_sets,hierarchy_tree)
     t3f = time.perf_counter()
 
     step3 = t3f - t3 # time to complete step 3
@@ -71,6 +89,13 @@ if __name__ == "__main__":
 
     print("---------------")
 
+    if trace_file:
+        tracer = tracing.disable()
+        tracer.write_chrome_trace(trace_file)
+        tracer.print_summary()
+        print("Trace written to", trace_file)
+        print("---------------")
+
     ### Uncomment to compute the f-score
 
     q = input("Do you want to compute the f-score ? (only LDBC) y/n")
@@ -96,10 +121,22 @@ if __name__ == "__main__":
 
     if q3 == "y":
         q4 = input("Do you want to add all edges (ie. also non SUBTYPEOF edges ? y/n")
+        target_driver = None
+        if profile_queries != "0":
+            # the driver of the new graph is profiled too, its queries are added to the same statistics
+            uri2 = input("Neo4j bolt address of the new graph: ")
+            user2 = input("Neo4j username: ")
+            passwd2 = input('Neo4j password: ')
+            target_driver = ProfilingDriver(GraphDatabase.driver(uri2, auth=(user2, passwd2), encrypted=False),
+                                            plans=profile_queries == "plans", stats=driver.stats)
         t4 = time.perf_counter()
-        create_neo4j_graph(driver, q4=="y")
+        create_neo4j_graph(driver, q4=="y", target_driver)
         t4f = time.perf_counter()
 
         step4 = t4f - t4
         print(colored("Graph created.", "green"))
-        print("Step 4: Creating neo4j graph was completed in ", step4, "s")
\ No newline at end of file
+        print("Step 4: Creating neo4j graph was completed in ", step4, "s")
+
+    if profile_queries != "0":
+        print("---------------")
+        driver.stats.print_report()
\ No newline at end of file
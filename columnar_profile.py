@@ -0,0 +1,560 @@
+""" Out-of-core profiles : the distinct nodes are stored in columns on disk and read through memory maps
+
+A profile directory holds :
+- meta.json : the token dictionary (labels and properties), the distinct labels and the labels sets
+- token_ids.u32 : the token ids of every distinct node, one after the other
+- offsets.u64 : where the tokens of each distinct node start in token_ids.u32 (one more value than distinct nodes)
+- counts.u64 : the number of occurrences of each distinct node (other counts files can share the same tokens)
+
+Step 1, the sampling (split_profile) and the clustering (iter_gmm_columnar) read the columns by chunks and keep
+clusters as arrays of ids. The evaluation (compute_f_score, hdbscan_indexes) is not out of core : given a
+ColumnarProfile as a validation or test set, it loads the distinct nodes of the set and their counts in memory (not
+one element per occurrence), as does looking a node string up in a ColumnarProfile.
+"""
+
+##### Imports
+import hashlib
+import json
+import os
+import warnings
+from collections.abc import Mapping
+import numpy as np
+from termcolor import colored
+
+### File imports
+import tracing
+from GMM_clustering import dice_coefficient
+
+DEFAULT_MEMORY_LIMIT = 1 << 30 # 1 GiB
+
+TRAINING_SPLITS = {80: (0.8, 0.1), 70: (0.7, 0.15), 50: (0.5, 0.25)}
+
+def open_memmap(file, dtype):
+    """ Memory maps a column, numpy cannot map an empty file """
+    if os.path.getsize(file) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(file, dtype=dtype, mode="r")
+
+def chunk_size(memory_limit):
+    """ Number of distinct nodes processed at once to stay under memory_limit bytes """
+    return max(1024, memory_limit // 256)
+
+def max_points(memory_limit):
+    """ Number of points given to the Gaussian Mixture Model to stay under memory_limit bytes """
+    return max(1000, memory_limit // 128)
+
+class ColumnarProfileWriter:
+    """ Streams distinct nodes into a profile directory
+
+    Parameters
+    ----------
+    directory : String
+        Directory the profile is written into
+    buffer_size : Int
+        Number of distinct nodes kept in memory before being appended to the files
+    """
+
+    def __init__(self, directory, buffer_size=1 << 16):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.buffer_size = buffer_size
+
+        self.token_index = {}
+        self.tokens = []
+
+        self.ids_file = open(os.path.join(directory, "token_ids.u32"), "wb")
+        self.offsets_file = open(os.path.join(directory, "offsets.u64"), "wb")
+        self.counts_file = open(os.path.join(directory, "counts.u64"), "wb")
+
+        self.n_ids = 0
+        self.ids_buffer = []
+        self.offsets_buffer = [0]
+        self.counts_buffer = []
+
+    def add(self, labels, keys, count):
+        """ Appends a distinct node
+
+        Parameters
+        ----------
+        labels : Python list
+            Labels of the node
+        keys : Python list
+            Properties of the node
+        count : Int
+            Number of occurrences of the node
+        """
+        for token in sorted(labels)+sorted(keys):
+            if token not in self.token_index:
+                self.token_index[token] = len(self.tokens)
+                self.tokens.append(token)
+            self.ids_buffer.append(self.token_index[token])
+            self.n_ids += 1
+
+        self.offsets_buffer.append(self.n_ids)
+        self.counts_buffer.append(count)
+
+        if len(self.counts_buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        np.asarray(self.ids_buffer, dtype=np.uint32).tofile(self.ids_file)
+        np.asarray(self.offsets_buffer, dtype=np.uint64).tofile(self.offsets_file)
+        np.asarray(self.counts_buffer, dtype=np.uint64).tofile(self.counts_file)
+        self.ids_buffer = []
+        self.offsets_buffer = []
+        self.counts_buffer = []
+
+    def close(self, distinct_labels, labs_sets):
+        """ Writes the token dictionary and merges the distinct nodes written twice
+
+        Parameters
+        ----------
+        distinct_labels : Python list
+            A list of labels
+            Its format is : ['Label1', 'Label2', 'Label3', ...]
+        labs_sets : Python list of list
+            A list of all labels sets
+            Its format is : [['Label 1','Label2'],['Label1'],['Label3'],...]
+
+        Returns
+        -------
+        profile : ColumnarProfile
+            The profile written
+        """
+        self.flush()
+        self.ids_file.close()
+        self.offsets_file.close()
+        self.counts_file.close()
+
+        with open(os.path.join(self.directory, "meta.json"), "w") as f:
+            json.dump({"tokens": self.tokens, "distinct_labels": list(distinct_labels),
+                       "labs_sets": [list(lab_set) for lab_set in labs_sets]}, f)
+
+        merge_duplicates(self.directory)
+
+        return ColumnarProfile(self.directory)
+
+def pattern_hashes(token_ids, offsets, start, end):
+    """ Hashes the token ids of the distinct nodes start to end-1 (wrapping 64 bits arithmetic) """
+    lo, hi = int(offsets[start]), int(offsets[end])
+    ids = np.asarray(token_ids[lo:hi], dtype=np.uint64) + np.uint64(1)
+    bounds = np.asarray(offsets[start:end+1], dtype=np.int64) - lo
+    lengths = np.diff(bounds)
+
+    # position of each token in its node
+    positions = np.arange(hi-lo, dtype=np.int64) - np.repeat(bounds[:-1], lengths)
+    with np.errstate(over="ignore"):
+        weighted = ids * np.power(np.uint64(1099511628211), positions.astype(np.uint64))
+        cumulated = np.concatenate((np.zeros(1, dtype=np.uint64), np.cumsum(weighted, dtype=np.uint64)))
+        return (cumulated[bounds[1:]] - cumulated[bounds[:-1]]) ^ lengths.astype(np.uint64)
+
+def merge_duplicates(directory, memory_limit=DEFAULT_MEMORY_LIMIT):
+    """ Adds the counts of a distinct node written several times (keys returned in different orders) to its first occurrence
+
+    Parameters
+    ----------
+    directory : String
+        Directory of the profile
+    memory_limit : Int
+        Memory used to hash the distinct nodes, in bytes
+    """
+    token_ids = open_memmap(os.path.join(directory, "token_ids.u32"), np.uint32)
+    offsets = open_memmap(os.path.join(directory, "offsets.u64"), np.uint64)
+    n_patterns = len(offsets) - 1
+    if n_patterns < 2:
+        return
+
+    step = chunk_size(memory_limit)
+    hashes = np.concatenate([pattern_hashes(token_ids, offsets, start, min(start+step, n_patterns))
+                             for start in range(0, n_patterns, step)])
+
+    order = np.argsort(hashes, kind="stable")
+    sorted_hashes = hashes[order]
+    duplicated = np.nonzero(sorted_hashes[1:] == sorted_hashes[:-1])[0]
+    if len(duplicated) == 0:
+        return
+
+    counts = np.memmap(os.path.join(directory, "counts.u64"), dtype=np.uint64, mode="r+")
+    for position in duplicated:
+        other = order[position+1]
+
+        # follow the chain of equal hashes back to its first node
+        while position > 0 and sorted_hashes[position-1] == sorted_hashes[position]:
+            position -= 1
+        first = order[position]
+
+        # the hash may collide, the tokens are compared
+        same = np.array_equal(token_ids[offsets[first]:offsets[first+1]], token_ids[offsets[other]:offsets[other+1]])
+        if same:
+            counts[first] += counts[other]
+            counts[other] = 0
+    counts.flush()
+
+def write_profile(directory, amount_dict, list_of_distinct_nodes, distinct_labels, labs_sets):
+    """ Writes an in-memory profile (as returned by preprocessing) into a profile directory
+
+    Returns
+    -------
+    profile : ColumnarProfile
+        The profile written
+    """
+    labels_set = set(distinct_labels)
+    writer = ColumnarProfileWriter(directory)
+    for node in list_of_distinct_nodes:
+        tokens = node.split(" ") if node != "" else []
+        writer.add([token for token in tokens if token in labels_set],
+                   [token for token in tokens if token not in labels_set], amount_dict[node])
+    return writer.close(distinct_labels, labs_sets)
+
+def preprocessing_columnar(driver, directory, database=None):
+    """ Step 1 streaming the distinct nodes into a profile directory instead of Python objects
+
+    Parameters
+    ----------
+    driver : GraphDatabase.driver object
+        Driver used to access the PG stored in a Neo4j database.
+    directory : String
+        Directory the profile is written into
+    database : String
+        Name of the database to query, None for the default database of the server.
+
+    Returns
+    -------
+    profile : ColumnarProfile
+        The profile written
+    """
+    from preprocessing_step import PATTERNS_QUERY
+
+    writer = ColumnarProfileWriter(directory)
+    distinct_labels = []
+    labs_sets = []
+
+    print(colored("Querying neo4j to get all distinct sets of labels and props:", "yellow"))
+    with driver.session(database=database) as session:
+        for node in session.run(PATTERNS_QUERY):
+            labels = node["labels(n)"]
+            writer.add(labels, node["keys(n)"], node["COUNT(n)"])
+
+            # labels and labels sets are few
+            for label in labels:
+                if label not in distinct_labels:
+                    distinct_labels.append(label)
+            if labels not in labs_sets:
+                labs_sets.append(labels)
+    print(colored("Done.", "green"))
+
+    return writer.close(distinct_labels, labs_sets)
+
+class ColumnarProfile(Mapping):
+    """ A profile directory read through memory maps
+
+    It can be used as a read-only amount_dict : a mapping from node strings to their number of occurrences,
+    where only the distinct nodes occurring at least once are keys. Iterating over it streams the columns, looking a
+    node string up builds an in-memory index of the distinct nodes on first use.
+
+    Parameters
+    ----------
+    directory : String
+        Directory of the profile
+    counts : String
+        Name of the counts file, to read a sample of the profile (see split_profile)
+    """
+
+    def __init__(self, directory, counts="counts.u64"):
+        self.directory = directory
+        self.counts_name = counts
+
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        self.tokens = meta["tokens"]
+        self.distinct_labels = meta["distinct_labels"]
+        self.labs_sets = meta["labs_sets"]
+        self.token_index = {token: i for i, token in enumerate(self.tokens)}
+
+        labels_set = set(self.distinct_labels)
+        self.label_mask = np.array([token in labels_set for token in self.tokens], dtype=bool)
+
+        self.token_ids = open_memmap(os.path.join(directory, "token_ids.u32"), np.uint32)
+        self.offsets = open_memmap(os.path.join(directory, "offsets.u64"), np.uint64)
+        self.counts = open_memmap(os.path.join(directory, counts), np.uint64)
+        self.n_patterns = len(self.offsets) - 1
+
+        self._index = None
+        self._len = None
+
+    def __reduce__(self):
+        # worker processes map the same files instead of receiving a copy
+        return (ColumnarProfile, (self.directory, self.counts_name))
+
+    def with_counts(self, counts):
+        """ The same distinct nodes with other counts """
+        return ColumnarProfile(self.directory, counts)
+
+    def pattern_tokens(self, i):
+        return self.token_ids[int(self.offsets[i]):int(self.offsets[i+1])]
+
+    def pattern(self, i):
+        """ The node string of the distinct node i """
+        return " ".join([self.tokens[token] for token in self.pattern_tokens(i)])
+
+    def iter_ids(self, memory_limit=DEFAULT_MEMORY_LIMIT):
+        """ Ids of the distinct nodes occurring at least once """
+        step = chunk_size(memory_limit)
+        for start in range(0, self.n_patterns, step):
+            for i in np.nonzero(self.counts[start:start+step])[0]:
+                yield start + int(i)
+
+    def __iter__(self):
+        for i in self.iter_ids():
+            yield self.pattern(i)
+
+    def items(self):
+        for i in self.iter_ids():
+            yield self.pattern(i), int(self.counts[i])
+
+    def __len__(self):
+        if self._len is None:
+            step = chunk_size(DEFAULT_MEMORY_LIMIT)
+            self._len = sum(int(np.count_nonzero(self.counts[start:start+step])) for start in range(0, self.n_patterns, step))
+        return self._len
+
+    def __getitem__(self, node):
+        # looking a node string up needs an in-memory index, built on first use only
+        if self._index is None:
+            self._index = {self.pattern(i): i for i in self.iter_ids()}
+        return int(self.counts[self._index[node]])
+
+    def to_profile(self):
+        """ Loads the profile in memory, in the format returned by preprocessing """
+        amount_dict = dict(self.items())
+        return amount_dict, list(amount_dict), list(self.distinct_labels), [list(lab_set) for lab_set in self.labs_sets]
+
+class ColumnarCluster:
+    """ A cluster of distinct nodes of a ColumnarProfile, iterating over its node strings like the sets of iter_gmm """
+
+    def __init__(self, profile, ids):
+        self.profile = profile
+        self.ids = ids
+
+    def __iter__(self):
+        for i in self.ids:
+            yield self.profile.pattern(int(i))
+
+    def __len__(self):
+        return len(self.ids)
+
+def split_profile(profile, training_percentage, seed=None, memory_limit=DEFAULT_MEMORY_LIMIT):
+    """ Separates the occurrences of every distinct node in three sets, as sampling does, without loading them
+
+    Each set is stored as a counts file sharing the tokens of the profile.
+
+    Parameters
+    ----------
+    profile : ColumnarProfile
+        The profile to separate
+    training_percentage : Int
+        An integer to represent the percentage of data used for the training set
+        It should be 80, 70 or 50
+    seed : Int
+        Seed of the random generator
+    memory_limit : Int
+        Memory used at once, in bytes
+
+    Returns
+    -------
+    train, validate, test : ColumnarProfile
+        The three sets
+    """
+    if training_percentage not in TRAINING_SPLITS:
+        print(colored("Unvalid training percentage, should be 80, 70 or 50.", "red"))
+        raise ValueError("Unvalid training percentage: "+str(training_percentage))
+
+    p_train, p_validate = TRAINING_SPLITS[training_percentage]
+    rng = np.random.default_rng(seed)
+    names = ["counts_train.u64", "counts_validate.u64", "counts_test.u64"]
+    files = [open(os.path.join(profile.directory, name), "wb") for name in names]
+
+    step = chunk_size(memory_limit)
+    for start in range(0, profile.n_patterns, step):
+        counts = np.asarray(profile.counts[start:start+step], dtype=np.int64)
+        train = rng.binomial(counts, p_train)
+        validate = rng.binomial(counts-train, p_validate/(1-p_train))
+        test = counts - train - validate
+        for f, values in zip(files, (train, validate, test)):
+            values.astype(np.uint64).tofile(f)
+
+    for f in files:
+        f.close()
+
+    return tuple(profile.with_counts(name) for name in names)
+
+def select_patterns(profile, lab_set, memory_limit=DEFAULT_MEMORY_LIMIT):
+    """ Ids of the distinct nodes having every label of lab_set (or no label when lab_set is empty), as iter_gmm selects them
+
+    Returns
+    -------
+    ids : numpy array
+        Sorted ids of the selected distinct nodes
+    """
+    label_ids = []
+    for label in lab_set:
+        if label not in profile.token_index:
+            return np.zeros(0, dtype=np.int64)
+        label_ids.append(profile.token_index[label])
+
+    selected = []
+    step = chunk_size(memory_limit)
+    for start in range(0, profile.n_patterns, step):
+        end = min(start+step, profile.n_patterns)
+        lo, hi = int(profile.offsets[start]), int(profile.offsets[end])
+        ids = np.asarray(profile.token_ids[lo:hi])
+        bounds = np.asarray(profile.offsets[start:end+1], dtype=np.int64) - lo
+
+        def present(hits):
+            cumulated = np.concatenate(([0], np.cumsum(hits, dtype=np.int64)))
+            return cumulated[bounds[1:]] - cumulated[bounds[:-1]] > 0
+
+        if lab_set == []:
+            keep = ~present(profile.label_mask[ids])
+        else:
+            keep = np.ones(end-start, dtype=bool)
+            for label_id in label_ids:
+                keep &= present(ids == label_id)
+
+        keep &= np.asarray(profile.counts[start:end]) > 0
+        selected.append(np.nonzero(keep)[0].astype(np.int64) + start)
+
+    if selected == []:
+        return np.zeros(0, dtype=np.int64)
+    return np.concatenate(selected)
+
+def token_weights(profile, ids, memory_limit=DEFAULT_MEMORY_LIMIT):
+    """ Number of occurrences of each label and property among the distinct nodes ids (count_labs_props on token ids) """
+    weights = np.zeros(len(profile.tokens))
+    step = chunk_size(memory_limit)
+
+    for start in range(0, len(ids), step):
+        chunk = ids[start:start+step]
+        starts = np.asarray(profile.offsets[chunk], dtype=np.int64)
+        lengths = np.asarray(profile.offsets[chunk+1], dtype=np.int64) - starts
+        if lengths.sum() == 0:
+            continue
+
+        # index of every token of the chunk in token_ids
+        first = np.cumsum(lengths) - lengths
+        positions = np.repeat(starts, lengths) + np.arange(lengths.sum()) - np.repeat(first, lengths)
+        tokens = profile.token_ids[positions]
+        weights += np.bincount(tokens, weights=np.repeat(np.asarray(profile.counts[chunk], dtype=np.float64), lengths),
+                               minlength=len(profile.tokens))
+
+    return weights
+
+def reference_node(profile, ids, memory_limit=DEFAULT_MEMORY_LIMIT):
+    """ The most frequent label and the most frequent property among the distinct nodes ids (as max_labs_props with n=1) """
+    weights = token_weights(profile, ids, memory_limit)
+
+    freq_lab = ""
+    label_weights = np.where(profile.label_mask, weights, 0)
+    if label_weights.max(initial=0) > 0:
+        freq_lab = profile.tokens[int(np.argmax(label_weights))]
+
+    freq_prop = []
+    property_weights = np.where(profile.label_mask, 0, weights)
+    if property_weights.max(initial=0) > 0:
+        freq_prop.append(profile.tokens[int(np.argmax(property_weights))])
+
+    return freq_lab + " " + ' '.join(freq_prop)
+
+def iter_gmm_columnar(profile, memory_limit=DEFAULT_MEMORY_LIMIT):
+    """ iter_gmm on a ColumnarProfile : clusters are arrays of distinct node ids instead of sets of strings,
+    and the Gaussian Mixture Model is trained on at most max_points(memory_limit) points
+
+    Parameters
+    ----------
+    profile : ColumnarProfile
+        The profile to cluster
+    memory_limit : Int
+        Memory used at once by a step of the clustering, in bytes
+
+    Returns
+    -------
+    all_clusters : Python list of ColumnarCluster
+        Each element represents a different cluster
+    hierarchy_tree : Python list
+        The same hierarchy as iter_gmm's one (with ColumnarCluster instead of sets), that can be given to storing
+    """
+
+    # ignore all convergence warnings
+    warnings.filterwarnings("ignore")
+
+    all_clusters = []
+    hierarchy_tree = []
+
+    # digests of the clusters already found
+    seen = set()
+
+    for lab_set in profile.labs_sets:
+        ids = select_patterns(profile, lab_set, memory_limit)
+
+        with tracing.span("base type", labels=":".join(lab_set)):
+            hierarchy = rec_clustering_columnar(profile, ids, all_clusters, seen, [set(lab_set),None,None], memory_limit)
+        hierarchy_tree.append(hierarchy)
+
+    return all_clusters, hierarchy_tree
+
+def rec_clustering_columnar(profile, ids, all_clusters, seen, hierarchy, memory_limit):
+    """ rec_clustering on the distinct node ids of a ColumnarProfile
+
+    Returns
+    -------
+    hierarchy : Python list
+        The hierarchy given as a parameter with its subclusters
+    """
+    from sklearn.mixture import BayesianGaussianMixture
+
+    with tracing.span("split") as current:
+        counts = np.asarray(profile.counts[ids], dtype=np.int64)
+        total = int(counts.sum())
+        if current:
+            current.set(patterns=len(ids), weight=total)
+
+        # BayesianGaussianMixture cannot cluter one node
+        if total <= 1:
+            return hierarchy
+
+        ref_node = reference_node(profile, ids, memory_limit)
+
+        similarities = np.empty(len(ids))
+        for j, i in enumerate(ids):
+            similarities[j] = dice_coefficient(ref_node, profile.pattern(int(i)))
+        tracing.count("similarity_calls", len(ids))
+
+        # stratified sample of the occurrences when they do not fit in memory_limit
+        cap = max_points(memory_limit)
+        if total > cap:
+            counts = np.maximum(1, np.rint(counts*(cap/total))).astype(np.int64)
+        computed_measures = np.repeat(similarities, counts).reshape(-1, 1)
+
+        bgmm = BayesianGaussianMixture(n_components=2, tol=1, max_iter=10).fit(computed_measures)
+        tracing.count("bgmm_fits")
+        tracing.count("bgmm_iterations", bgmm.n_iter_)
+
+        # equal similarities have the same prediction, each one is predicted once
+        values, inverse = np.unique(similarities, return_inverse=True)
+        predictions = bgmm.predict(values.reshape(-1, 1))[inverse.reshape(-1)]
+
+        for side in (0, 1):
+            cluster_ids = ids[predictions == side]
+            if len(cluster_ids) == 0:
+                continue
+
+            digest = hashlib.sha1(cluster_ids.tobytes()).digest()
+            if digest in seen:
+                continue
+            seen.add(digest)
+
+            cluster = ColumnarCluster(profile, cluster_ids)
+            all_clusters.append(cluster)
+            hierarchy[side+1] = rec_clustering_columnar(profile, cluster_ids, all_clusters, seen, [cluster,None,None], memory_limit)
+
+    return hierarchy
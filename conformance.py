@@ -0,0 +1,169 @@
+""" Conformance of the nodes of a database to an inferred schema
+
+The nodes are read by ranges of ids : each range is a query of its own session, run by a pool of threads, which only
+reads the nodes of its range (one id seek per id). At most 2*workers ranges are fetched ahead of the one being
+checked, so the memory used does not depend on the size of the database.
+Each node is checked with the compiled schema of the schema service (see schema_service), once per shape of node
+(labels and properties) of a range. The violations are counted per base type : the nodes missing a mandatory
+property, having a label or a property their base type does not allow, or having no base type, with a uniform sample
+of the ids of the invalid nodes.
+"""
+
+##### Imports
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from termcolor import colored
+
+### File imports
+from property_stats import Reservoir
+from schema_service import CompiledSchema
+
+### Queries
+MAX_ID_QUERY = "MATCH (n) RETURN max(id(n)) AS high"
+
+# one id seek per id of the range, instead of a scan of all nodes filtered by id
+ID_RANGE_QUERY = "UNWIND range($low, $high-1) AS i MATCH (n) WHERE id(n) = i \
+            RETURN id(n) AS id, labels(n) AS labels, keys(n) AS keys"
+
+def fetch_range(driver, low, high, database=None):
+    """ The ids, labels and properties of the nodes whose id is in [low, high) """
+    with driver.session(database=database) as session:
+        return [(record["id"], record["labels"], record["keys"])
+                for record in session.run(ID_RANGE_QUERY, {"low": low, "high": high})]
+
+class TypeViolations:
+    """ The violations of the nodes of a base type
+
+    Parameters
+    ----------
+    samples : Int
+        Number of ids of invalid nodes kept
+    rng : random.Random object
+        Generator of the sample
+    """
+
+    def __init__(self, samples=5, rng=random):
+        self.nodes = 0
+        self.invalid = 0
+        self.missing_properties = {}
+        self.unknown_labels = {}
+        self.unknown_properties = {}
+        self.sample = Reservoir(samples, rng)
+
+    def add(self, result, ids):
+        """ Counts the nodes of ids, which all have the result of the classification result """
+        self.nodes += len(ids)
+        if result["valid"]:
+            return
+        self.invalid += len(ids)
+        for name in ("missing_properties", "unknown_labels", "unknown_properties"):
+            counts = getattr(self, name)
+            for token in result[name]:
+                counts[token] = counts.get(token, 0) + len(ids)
+        for i in ids:
+            self.sample.add(i)
+
+    def to_dict(self):
+        return {"nodes": self.nodes, "invalid": self.invalid, "missing_properties": self.missing_properties,
+                "unknown_labels": self.unknown_labels, "unknown_properties": self.unknown_properties,
+                "sample_ids": sorted(self.sample.sample)}
+
+def check_nodes(schema, rows, violations, samples=5, rng=random):
+    """ Checks the nodes of a range and adds their violations to violations
+
+    Parameters
+    ----------
+    schema : CompiledSchema
+        The schema the nodes are checked against
+    rows : Python list of tuples
+        The id, labels and properties of each node, as returned by fetch_range
+    violations : Python dict
+        The TypeViolations of each base type, by row id of the base type (None for the nodes without base type)
+    """
+    # nodes of the same shape are checked once
+    shapes = {}
+    for i, labels, keys in rows:
+        shapes.setdefault((tuple(sorted(labels)), tuple(sorted(keys))), []).append(i)
+
+    for (labels, keys), ids in shapes.items():
+        result = schema.classify_one(labels, keys)
+        base_type = result["base_type"]
+        if base_type not in violations:
+            violations[base_type] = TypeViolations(samples, rng)
+        violations[base_type].add(result, ids)
+
+def conformance_scan(driver, file="data.csv", database=None, batch_size=10000, workers=4, samples=5, seed=None):
+    """ Checks every node of a database against a schema file
+
+    Parameters
+    ----------
+    driver : GraphDatabase.driver object
+        Driver used to access the PG stored in a Neo4j database (shared by the threads)
+    file : String
+        Name of the schema file, as written by storing
+    database : String
+        Name of the database to query, None for the default database of the server
+    batch_size : Int
+        Number of ids of a range
+    workers : Int
+        Number of ranges read at the same time
+    samples : Int
+        Number of ids of invalid nodes kept per base type, 0 for none
+    seed : Int
+        Seed of the samples, None for a random one
+
+    Returns
+    -------
+    report : Python dict
+        nodes, invalid : the number of nodes checked and of invalid nodes
+        types : the violations of each base type (see TypeViolations.to_dict), with its labels,
+        by row id of the base type ('none' for the nodes without base type)
+        seconds, nodes_per_second : the time of the scan
+    """
+    t = time.perf_counter()
+    schema = CompiledSchema(file)
+    rng = random.Random(seed)
+
+    with driver.session(database=database) as session:
+        high = session.run(MAX_ID_QUERY).single()["high"]
+    ranges = [(low, low+batch_size) for low in range(0, high+1, batch_size)] if high is not None else []
+
+    print(colored("Checking the nodes of "+str(len(ranges))+" ranges of ids against "+file+":", "yellow"))
+    violations = {}
+    with ThreadPoolExecutor(workers) as threads:
+        # the ranges are checked in order, at most 2*workers of them are fetched ahead
+        pending = []
+        next_range = 0
+        for i in range(len(ranges)):
+            while next_range < len(ranges) and len(pending) < 2*workers:
+                pending.append(threads.submit(fetch_range, driver, *ranges[next_range], database))
+                next_range += 1
+            check_nodes(schema, pending.pop(0).result(), violations, samples, rng)
+    seconds = time.perf_counter() - t
+
+    names = {node.row_id: ":".join(node.labels) for node in schema.roots}
+    types = {}
+    for base_type, type_violations in violations.items():
+        types[base_type if base_type is not None else "none"] = dict(type_violations.to_dict(),
+                                                                     labels=names.get(base_type, ""))
+    nodes = sum(type_violations.nodes for type_violations in violations.values())
+    invalid = sum(type_violations.invalid for type_violations in violations.values())
+    print(colored("Done. "+str(invalid)+" of "+str(nodes)+" nodes are invalid.", "green"))
+
+    return {"nodes": nodes, "invalid": invalid, "types": types, "seconds": seconds,
+            "nodes_per_second": nodes/seconds if seconds > 0 else None}
+
+def print_report(report):
+    """ Prints a report returned by conformance_scan, the base types with the most invalid nodes first """
+    for base_type, row in sorted(report["types"].items(), key=lambda item: -item[1]["invalid"]):
+        if row["invalid"] == 0:
+            continue
+        print(base_type, row["labels"], row["invalid"], "of", row["nodes"], "invalid")
+        for name in ("missing_properties", "unknown_labels", "unknown_properties"):
+            if row[name] != {}:
+                print("   ", name+":", ", ".join(token+" ("+str(count)+")" for token, count in
+                                                sorted(row[name].items(), key=lambda item: -item[1])))
+        if row["sample_ids"] != []:
+            print("    sample ids:", ", ".join(str(i) for i in row["sample_ids"]))
+    print(report["invalid"], "of", report["nodes"], "nodes invalid,", int(report["nodes_per_second"] or 0), "nodes/s")
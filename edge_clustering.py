@@ -0,0 +1,189 @@
+""" Clustering of the relationship patterns into a hierarchy of edge types
+
+A relationship pattern is written as a node string whose labels are the type of the relationship and the base
+types (sets of labels) of its source and target nodes : 'type=TYPE src=Label1&Label2 tgt=Label3 prop1 prop2'.
+The type and the endpoints are prefixed so that they are never taken for a property key of the same name (a
+relationship type 'since' and a property 'since').
+The steps 2 and 3 of the nodes (iter_gmm, storing) are then used unchanged : there is one base edge type per
+relationship type, split by the properties and the endpoints of its relationships.
+"""
+
+##### Imports
+import time
+from termcolor import colored
+
+### File imports
+import tracing
+from GMM_clustering import iter_gmm
+from storing import storing
+
+### Query (the patterns are counted by the server in a single pass over the relationships)
+EDGE_PATTERNS_QUERY = "MATCH (n)-[r]->(m) \
+            RETURN type(r) AS type, keys(r) AS keys, labels(n) AS source, labels(m) AS target, count(*) AS count"
+
+def type_token(name):
+    """ Token of the type of a relationship : 'type=TYPE' """
+    return "type="+name
+
+def endpoint_token(prefix, labels):
+    """ Token of the base type of an endpoint : 'src=Label1&Label2', 'tgt=' for an unlabelled node """
+    return prefix+"="+"&".join(sorted(labels))
+
+def edge_tokens(edge):
+    """ Labels of a relationship pattern : its type and the tokens of its endpoints
+
+    Parameters
+    ----------
+    edge : Record
+        A record of EDGE_PATTERNS_QUERY
+
+    Returns
+    -------
+    labels : Python list
+        Its format is : ['type=TYPE', 'src=Label1&Label2', 'tgt=Label3']
+    """
+    return [type_token(edge["type"]), endpoint_token("src", edge["source"]), endpoint_token("tgt", edge["target"])]
+
+def edge_preprocessing(driver, database=None):
+    """ Queries a property graph to get the relationship patterns and their number of occurrences
+
+    Parameters
+    ----------
+    driver : GraphDatabase.driver object
+        Driver used to access the PG stored in a Neo4j database.
+    database : String
+        Name of the database to query, None for the default database of the server.
+
+    Returns
+    -------
+    amount_dict : Python dict
+        A dictionary with relationship strings as keys and the number of occurrences of the relationship as a value
+        Its format is : {'type=TYPE src=Label1 tgt=Label2 prop1 prop2': int, ...}
+    list_of_distinct_edges : Python list
+        A list of relationship strings
+        Its format is : ['type=TYPE1 src=Label1 tgt=Label2 prop1', 'type=TYPE2 src=Label1 tgt=Label1', ...]
+    distinct_tokens : Python list
+        The types and endpoint tokens, used as the labels of the relationship strings
+        Its format is : ['type=TYPE1', 'src=Label1', 'tgt=Label2', 'type=TYPE2', 'tgt=Label1', ...]
+    types_sets : Python list of list
+        The base edge types : one list per relationship type
+        Its format is : [['type=TYPE1'], ['type=TYPE2'], ...]
+    """
+    amount_dict = {}
+    list_of_distinct_edges = []
+    distinct_tokens = []
+    tokens_set = set()
+    types_sets = []
+
+    print(colored("Querying neo4j to get all distinct relationship patterns:", "yellow"))
+    with driver.session(database=database) as session:
+        for edge in session.run(EDGE_PATTERNS_QUERY):
+            labels = edge_tokens(edge)
+
+            for token in labels:
+                if token not in tokens_set:
+                    tokens_set.add(token)
+                    distinct_tokens.append(token)
+                    if token == labels[0]:
+                        types_sets.append([token])
+
+            edge_str = ' '.join(labels+sorted(edge["keys"]))
+            if edge_str in amount_dict:
+                amount_dict[edge_str] += edge["count"]
+            else:
+                list_of_distinct_edges.append(edge_str)
+                amount_dict[edge_str] = edge["count"]
+    print(colored("Done.", "green"))
+
+    return amount_dict,list_of_distinct_edges,distinct_tokens,types_sets
+
+def edge_preprocessing_columnar(driver, directory, database=None):
+    """ Same as edge_preprocessing, streaming the relationship patterns into a profile directory
+
+    The profile can be clustered under a memory limit with columnar_profile.iter_gmm_columnar.
+
+    Parameters
+    ----------
+    driver : GraphDatabase.driver object
+        Driver used to access the PG stored in a Neo4j database.
+    directory : String
+        Directory the profile is written into
+    database : String
+        Name of the database to query, None for the default database of the server.
+
+    Returns
+    -------
+    profile : ColumnarProfile
+        The profile written
+    """
+    from columnar_profile import ColumnarProfileWriter
+
+    writer = ColumnarProfileWriter(directory)
+    distinct_tokens = []
+    types_sets = []
+
+    print(colored("Querying neo4j to get all distinct relationship patterns:", "yellow"))
+    with driver.session(database=database) as session:
+        for edge in session.run(EDGE_PATTERNS_QUERY):
+            labels = edge_tokens(edge)
+            writer.add(labels, edge["keys"], edge["count"])
+
+            # types and endpoints are few
+            for token in labels:
+                if token not in distinct_tokens:
+                    distinct_tokens.append(token)
+                    if token == labels[0]:
+                        types_sets.append([token])
+    print(colored("Done.", "green"))
+
+    return writer.close(distinct_tokens, types_sets)
+
+def infer_edge_types(driver=None, profile=None, file="edges.csv", database=None, warm_start=False):
+    """ Infers the hierarchy of the edge types of a PG and writes it into a file
+
+    The file has the format of the nodes' schema : the labels column holds the type of the edge type and its
+    endpoints, optional endpoints and properties start with a question mark.
+
+    Parameters
+    ----------
+    driver : GraphDatabase.driver object
+        Driver used to access the PG stored in a Neo4j database (not needed when profile is given)
+    profile : Python tuple
+        amount_dict, list_of_distinct_edges, distinct_tokens, types_sets as returned by edge_preprocessing
+    file : String
+        Name of the file the edge types are written into
+    database : String
+        Name of the database to query, None for the default database of the server
+    warm_start : Boolean
+        Start the model of each subcluster from its parent's component (see iter_gmm)
+
+    Returns
+    -------
+    result : Python dict
+        file : the name of the edge types file
+        distinct_tokens, types_sets : as returned by edge_preprocessing
+        hierarchy_tree, all_clusters : as returned by iter_gmm
+        timings : the time spent in each step, in seconds
+    """
+    timings = {}
+
+    t = time.perf_counter()
+    if profile is None:
+        with tracing.span("edge preprocessing"):
+            profile = edge_preprocessing(driver, database)
+    timings["preprocessing"] = time.perf_counter() - t
+
+    amount_dict, list_of_distinct_edges, distinct_tokens, types_sets = profile
+
+    t = time.perf_counter()
+    with tracing.span("edge clustering"):
+        all_clusters, hierarchy_tree = iter_gmm(amount_dict, list_of_distinct_edges, distinct_tokens, types_sets, warm_start)
+    timings["clustering"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    with tracing.span("edge storing"):
+        file = storing(distinct_tokens, types_sets, hierarchy_tree, file)
+    timings["storing"] = time.perf_counter() - t
+
+    return {"file": file, "distinct_tokens": distinct_tokens, "types_sets": types_sets,
+            "hierarchy_tree": hierarchy_tree, "all_clusters": all_clusters, "timings": timings}
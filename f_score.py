@@ -1,7 +1,6 @@
 """ Compute the f-score for LDBC's database """
 
 ##### Imports
-from sklearn.metrics import f1_score
 import csv
 
 def construct(file,list_of_distinct_nodes,distinct_labels):
@@ -130,6 +129,8 @@ def compute_f_score(test, distinct_labels, file):
     f1_score : 
 
     """
+    from sklearn.metrics import f1_score
+
     list_of_distinct_nodes = list(set(test))
     ground_truth,predictions = construct(file,list_of_distinct_nodes,distinct_labels)
     return f1_score(ground_truth, predictions, average='micro')
\ No newline at end of file
@@ -0,0 +1,258 @@
+""" Step 2 with formal concept analysis : the subtypes of a base type are the closed sets of its patterns
+
+The patterns of a base type form a formal context : a pattern has the labels and properties of its node string and
+weighs its number of occurrences. A concept is a set of patterns (its extent) with the tokens they all have (its
+intent), the extent being every pattern having the intent. The concepts whose extent weighs at least min_support of
+the base type are enumerated with Close-by-One on bitsets : the extents and intents are Python ints, a concept is
+only kept when it is found from its canonical generator, so each one is computed once.
+
+The lattice is turned into the hierarchy of iter_gmm : the top concept (every pattern of the base type) is the only
+subtype of the base type, so that every pattern is in a type, and each other concept is put under its smallest strict
+superconcept.
+The extents of sibling concepts may overlap, the hierarchy is thus stored with storing(..., disjoint_subtypes=False).
+The result does not depend on any random draw.
+"""
+
+##### Imports
+from termcolor import colored
+
+### File imports
+import tracing
+from label_lattice import LabelLattice, SharedSubproblems
+
+class FormalContext:
+    """ The patterns of a base type and their tokens, as bitsets
+
+    Parameters
+    ----------
+    amount_dict : Python dict
+        A dictionary with node strings as keys and the number of occurrences of the node as a value
+        Its format is : {'Label1 Label2 Label3 prop1 prop2 prop3 ...': int, ...}
+    correct_nodes : Python list
+        The patterns of the base type
+        Its format is : ['Label1 prop1 prop2 prop3', 'Label1 prop1 prop2', 'Label1 prop1 prop2 prop4', ...]
+    """
+
+    def __init__(self, amount_dict, correct_nodes):
+        self.nodes = list(correct_nodes)
+        self.weights = [amount_dict[node] for node in self.nodes]
+        self.total = sum(self.weights)
+
+        self.tokens = sorted(set(token for node in self.nodes for token in node.split(" ")))
+        bits = {token: j for j, token in enumerate(self.tokens)}
+
+        # tokens of each pattern, and patterns of each token
+        self.rows = []
+        self.columns = [0]*len(self.tokens)
+        for i, node in enumerate(self.nodes):
+            row = 0
+            for token in node.split(" "):
+                row |= 1 << bits[token]
+                self.columns[bits[token]] |= 1 << i
+            self.rows.append(row)
+
+        self.all_tokens = (1 << len(self.tokens)) - 1
+        self.all_patterns = (1 << len(self.nodes)) - 1
+
+    def support(self, extent):
+        """ Number of occurrences of the patterns of an extent """
+        weight = 0
+        while extent:
+            low = extent & -extent
+            weight += self.weights[low.bit_length()-1]
+            extent ^= low
+        return weight
+
+    def intent(self, extent):
+        """ Tokens shared by all the patterns of an extent """
+        intent = self.all_tokens
+        while extent and intent:
+            low = extent & -extent
+            intent &= self.rows[low.bit_length()-1]
+            extent ^= low
+        return intent
+
+    def members(self, extent):
+        return set(self.nodes[i] for i in range(len(self.nodes)) if extent >> i & 1)
+
+def formal_concepts(context, min_support=0.0):
+    """ The concepts of a formal context whose extent weighs at least min_support of the context (Close-by-One)
+
+    Parameters
+    ----------
+    context : FormalContext
+        The patterns of a base type
+    min_support : Float
+        Minimum share of the occurrences of the base type in the extent of a concept
+
+    Returns
+    -------
+    concepts : Python list of tuples
+        The extent and the intent of each concept as bitsets, from the top concept (every pattern)
+        Its format is : [(extent, intent), ...]
+    """
+    if context.nodes == []:
+        return []
+
+    threshold = min_support*context.total
+    concepts = []
+
+    # the stack replaces the recursion : (extent, intent, first token that can be added)
+    top = context.all_patterns
+    stack = [(top, context.intent(top), 0)]
+    while stack:
+        extent, intent, start = stack.pop()
+        concepts.append((extent, intent))
+
+        children = []
+        for j in range(start, len(context.tokens)):
+            if intent >> j & 1:
+                continue
+
+            new_extent = extent & context.columns[j]
+            if new_extent == 0 or context.support(new_extent) < threshold:
+                continue
+
+            # canonicity test : the closure must not add a token before j
+            new_intent = context.intent(new_extent)
+            below = (1 << j) - 1
+            if new_intent & below != intent & below:
+                continue
+            children.append((new_extent, new_intent, j+1))
+
+        # children are visited in the order of their first token
+        stack.extend(reversed(children))
+
+    tracing.count("fca_concepts", len(concepts))
+    return concepts
+
+def concept_hierarchy(amount_dict, correct_nodes, lab_set, min_support=0.0):
+    """ The hierarchy of a base type from the lattice of its concepts
+
+    Parameters
+    ----------
+    amount_dict : Python dict
+        A dictionary with node strings as keys and the number of occurrences of the node as a value
+    correct_nodes : Python list
+        The patterns of the base type
+    lab_set : Python list
+        The labels of the base type
+    min_support : Float
+        Minimum share of the occurrences of the base type in a subtype
+
+    Returns
+    -------
+    hierarchy : Python list
+        [set(lab_set), top], each type being [extent, subtype1, subtype2, ...]
+    clusters : Python list of sets
+        The extents of the concepts
+    """
+    context = FormalContext(amount_dict, correct_nodes)
+    concepts = formal_concepts(context, min_support)
+
+    hierarchy = [set(lab_set)]
+    if concepts == []:
+        return hierarchy+[None, None], []
+
+    nodes = [[context.members(extent)] for extent, intent in concepts]
+    clusters = [node[0] for node in nodes]
+
+    # the smallest strict superconcept of each concept (extents are compared by inclusion)
+    sizes = [bin(extent).count("1") for extent, intent in concepts]
+    order = sorted(range(len(concepts)), key=lambda c: sizes[c])
+    for c in range(1, len(concepts)):
+        extent = concepts[c][0]
+        for other in order:
+            if sizes[other] > sizes[c] and concepts[other][0] & extent == extent:
+                nodes[other].append(nodes[c])
+                break
+
+    # a type without subtype has the shape [cluster, None, None] as in iter_gmm
+    for node in nodes:
+        if len(node) == 1:
+            node.extend([None, None])
+
+    return hierarchy+[nodes[0], None], clusters
+
+def concept_clustering(amount_dict, correct_nodes, lab_set, all_clusters, min_support=0.0, shared=None):
+    """ concept_hierarchy returning, as rec_clustering, all_clusters with the new clusters and the hierarchy
+
+    As in rec_clustering, a concept whose extent is already in all_clusters (found for another base type, by either
+    engine) is not a new type : it is removed from the hierarchy and its subconcepts take its place under its
+    superconcept, so that a type is only written once.
+
+    Parameters
+    ----------
+    amount_dict, correct_nodes, lab_set, min_support :
+        As given to concept_hierarchy
+    all_clusters : Python list of sets
+        The clusters already found
+    shared : SharedSubproblems
+        The index of all_clusters when iter_gmm shares subproblems, None otherwise
+
+    Returns
+    -------
+    all_clusters : The same all_clusters as in parameters but with new clusters added
+    hierarchy : Python list
+        As returned by concept_hierarchy, without the concepts already found
+    """
+    hierarchy, clusters = concept_hierarchy(amount_dict, correct_nodes, lab_set, min_support)
+
+    # the types are visited top-down, a concept being checked before its subconcepts as in rec_clustering
+    stack = [hierarchy]
+    while stack:
+        node = stack.pop()
+        kept = []
+        children = [child for child in node[1:] if child is not None]
+        while children:
+            child = children.pop(0)
+            if shared is not None:
+                new = shared.add_cluster(all_clusters, child[0]) is not None
+            else:
+                new = child[0] not in all_clusters
+                if new:
+                    all_clusters.append(child[0])
+
+            if new:
+                kept.append(child)
+                stack.append(child)
+            else:
+                # the subconcepts of a concept already found are put in its place
+                children[0:0] = [grandchild for grandchild in child[1:] if grandchild is not None]
+
+        # a type without subtype has the shape [cluster, None, None] and a base type [labels, top, None] at least
+        if node is hierarchy or kept == []:
+            kept += [None]*(2-len(kept))
+        node[1:] = kept
+    return all_clusters, hierarchy
+
+def iter_fca(amount_dict, list_of_distinct_nodes, distinct_labels, all_sets_labels, min_support=0.01):
+    """ iter_gmm with the concepts of each base type instead of the splits of Gaussian Mixture Models
+
+    Parameters
+    ----------
+    amount_dict, list_of_distinct_nodes, distinct_labels, all_sets_labels :
+        As given to iter_gmm
+    min_support : Float
+        Minimum share of the occurrences of a base type in one of its subtypes
+
+    Returns
+    -------
+    all_clusters, hierarchy_tree :
+        As returned by iter_gmm, to be stored with storing(..., disjoint_subtypes=False)
+    """
+    print(colored("Computing the concepts of each base type:", "yellow"))
+    lattice = LabelLattice(list_of_distinct_nodes, distinct_labels)
+
+    shared = SharedSubproblems(distinct_labels)
+
+    all_clusters = []
+    hierarchy_tree = []
+    for lab_set in all_sets_labels:
+        with tracing.span("base type", labels=":".join(lab_set)):
+            all_clusters, hierarchy = concept_clustering(amount_dict, lattice.members(lab_set), lab_set, all_clusters,
+                                                         min_support, shared)
+        hierarchy_tree.append(hierarchy)
+    print(colored("Done.", "green"))
+
+    return all_clusters, hierarchy_tree
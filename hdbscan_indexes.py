@@ -1,93 +1,210 @@
+""" Compare the inferred clustering with Hdbscan's one """
+
+##### Imports
 from rand_index import *
 from mutual_information import *
-import hdbscan
 from GMM_clustering import *
-from neo4j import GraphDatabase
 import csv
 
-def hdbscan_indexes(validate,distinct_labels,len_X):
+def count_occurrences(validate):
+    """ Counts the number of occurrences of each distinct node of a set
+
+    Parameters
+    ----------
+    validate : Python list or Python dict
+        A list of node strings (one element per node)
+        Its format is : ['Label1 Label2 prop1', 'Label1 Label3 prop2', 'Label1 Label2 prop1', ...]
+        or a dictionary with node strings as keys and their number of occurrences as values
 
-    list_of_distinct_nodes = list(set(validate))
+    Returns
+    -------
+    amount_dict : Python dict
+        A dictionary with node strings as keys and the number of occurrences of the node as a value
+        Its format is : {'Label1 Label2 Label3 prop1 prop2 prop3 ...': int, ...}
+    """
 
+    # the set is already deduplicated
+    if hasattr(validate, "items"):
+        return {node: amount for node, amount in validate.items() if amount > 0}
+
+    # a single pass over the set instead of a list.count() per distinct node
     amount_dict = {}
+    for node in validate:
+        amount_dict[node] = amount_dict.get(node, 0) + 1
+
+    return amount_dict
+
+def stratified_amounts(amount_dict, correct_nodes, max_points):
+    """ Caps the number of points given to a model that does not support sample weights
+
+    Each distinct node keeps at least one point, the others are shared proportionally to the occurrences of the nodes.
+
+    Parameters
+    ----------
+    amount_dict : Python dict
+        A dictionary with node strings as keys and the number of occurrences of the node as a value
+        Its format is : {'Label1 Label2 Label3 prop1 prop2 prop3 ...': int, ...}
+    correct_nodes : Python list
+        A list of node strings
+        Its format is : ['Label1 Label2 prop1', 'Label1 Label3 prop2', 'prop4 prop5', ...]
+    max_points : Int
+        Maximum number of points wanted (it can be exceeded when there are more distinct nodes than max_points)
+
+    Returns
+    -------
+    sample_dict : Python dict
+        A dictionary with node strings as keys and the number of points kept for this node as a value
+        Its format is : {'Label1 Label2 Label3 prop1 prop2 prop3 ...': int, ...}
+    """
+    total = 0
+    for node in correct_nodes:
+        total += amount_dict[node]
 
-    for node in list_of_distinct_nodes:
-        amount_dict[node] = validate.count(node)
+    # nothing to cap
+    if max_points is None or total <= max_points:
+        return {node: amount_dict[node] for node in correct_nodes}
 
-    correct_nodes = list_of_distinct_nodes
+    ratio = max_points / total
+
+    sample_dict = {}
+    for node in correct_nodes:
+        # every distinct node is kept at least once
+        sample_dict[node] = max(1, int(round(amount_dict[node] * ratio)))
+
+    return sample_dict
+
+def read_schema(file):
+    """ Reads a file written by storing once
+
+    Parameters
+    ----------
+    file : String
+        Name of the file with the clusters
+
+    Returns
+    -------
+    schema_rows : Python list of tuples
+        A list with, for each inferred type, its index, its number of labels and properties,
+        its mandatory labels and its mandatory properties
+        Its format is : [(0, 3, {'Label1'}, {'prop1'}), (1, 4, {'Label1'}, {'prop1', 'prop2'}), ...]
+    """
+    schema_rows = []
+
+    with open(file) as f:
+        reader = csv.reader(f, delimiter=',')
+        i = 0
+        for row in reader:
+            if i == 0:
+                i += 1
+            else:
+                cluster_labels = row[1].split(":")
+                cluster_props = row[2].split(":")
+                size = len(cluster_labels) + len(cluster_props)
+
+                # optional labels and properties are not needed to belong to the type
+                cluster_labels = set(x for x in cluster_labels if not x.startswith('?'))
+                cluster_props = set(x for x in cluster_props if not x.startswith('?'))
+
+                schema_rows.append((int(row[0])-1, size, cluster_labels, cluster_props))
+
+    return schema_rows
+
+def hdbscan_indexes(validate, distinct_labels, len_X, file="data.csv", max_points=100000):
+    """ Computes the Adjusted Rand Index and the Adjusted Mutual Information between the inferred types and Hdbscan's clusters
+
+    Parameters
+    ----------
+    validate : Python list or Python dict
+        A list of node strings representing all nodes in the validation set
+        Its format is : ['Label1 prop1 prop2 prop3', 'Label1 prop1 prop2', 'Label1 prop1 prop2', ...]
+        or a dictionary with node strings as keys and their number of occurrences as values
+    distinct_labels : Python list
+        A list of labels
+        Its format is : ['Label1', 'Label2', 'Label3', ...]
+    len_X : Int
+        Number of types written in the file
+    file : String
+        Name of the file with the clusters
+    max_points : Int
+        Hdbscan does not support sample weights, the validation set is thus reduced
+        to a stratified sample of at most (about) max_points points. None to keep every node.
+
+    Returns
+    -------
+    ARI : Float
+        Adjusted Rand Index between the two clusterings
+    EMI : Float
+        Adjusted Mutual Information between the two clusterings
+    """
+
+    amount_dict = count_occurrences(validate)
+
+    correct_nodes = list(amount_dict)
 
     ref_node = max_labs_props(amount_dict, correct_nodes, 1, distinct_labels)
 
     similarities_dict = compute_similarities(correct_nodes, ref_node)
 
-    X = to_format(similarities_dict, amount_dict, correct_nodes)
+    # only a stratified sample is clustered when there are too many nodes
+    sample_dict = stratified_amounts(amount_dict, correct_nodes, max_points)
 
-    all_nodes = []
+    X = to_format(similarities_dict, sample_dict, correct_nodes)
+
+    # index of the first point of each distinct node
+    first_point = {}
+    j = 0
     for node in correct_nodes:
-        amount = amount_dict[node]
-        amount_dict[node] = 1
-        for i in range(amount):
-            all_nodes.append(node)
+        first_point[node] = j
+        j += sample_dict[node]
+
+    import hdbscan
 
     print("hdbscan model:")
     predictions = hdbscan.HDBSCAN().fit_predict(X)
     print("done.")
 
-    #print(set(predictions))
-
     S = set(correct_nodes)
     X = [set() for _ in range(len_X)]
-    Y = [set() for _ in range(len(set(predictions)))]
     Z = {}
 
+    # the schema is only read once for every node
+    schema_rows = read_schema(file)
+    for row_id, size, cluster_labels, cluster_props in schema_rows:
+        Z[row_id] = size
+
+    # every label of the dataset as a set to avoid rebuilding it for each node
+    labels_set = set(distinct_labels)
+
+    Y_dict = {}
+
     for node in correct_nodes:
-        node_split = node.split(" ")
-        labels = list(set(distinct_labels) & set(node_split))
-        properties = list(set(node_split) - set(distinct_labels))
-
-        with open('data.csv') as f:
-            reader = csv.reader(f, delimiter=',')
-            i=0
-            for row in reader:
-                if i==0:
-                    i+=1
-                else:
-                    cluster_labels = row[1].split(":")
-                    Z[int(row[0])-1] = len(cluster_labels)
-                    cluster_labels = [x for x in cluster_labels if not x.startswith('?')]
-                    cluster_props = row[2].split(":")
-                    Z[int(row[0])-1] += len(cluster_props)
-                    cluster_props = [x for x in cluster_props if not x.startswith('?')]
-
-                    max_Z = 0
-                    check = False
-
-                    for l in range(len_X):
-                        if node in X[l]:
-                            max_X = Z[l]
-                            if max_Z < max_X:
-                                max_Z = max_X
-                            check = True
-
-                    # check if the node already exists in a cluster
-                    if check:
-                        # if it has the same labels, has common properties and is the more precise cluster then chose to add the node to this cluster
-                        if set(cluster_labels) == set(labels) and set(cluster_props).issubset(set(properties)) and max_Z == Z[int(row[0])-1]:
-                            for l in range(len_X):
-                                X[l].discard(node)
-                            X[int(row[0])-1].add(node)
-                    else:
-                        if set(cluster_labels) == set(labels) and set(cluster_props).issubset(set(properties)):
-                            for l in range(len_X):
-                                X[l].discard(node)
-                            X[int(row[0])-1].add(node)
-
-
-        Y[predictions[all_nodes.index(node)]].add(node)
+        node_split = set(node.split(" "))
+        labels = labels_set & node_split
+        properties = node_split - labels_set
+
+        # index of the type the node is currently in (None if it has none)
+        current = None
+
+        for row_id, size, cluster_labels, cluster_props in schema_rows:
+            if cluster_labels == labels and cluster_props.issubset(properties):
+                # check if the node already exists in a cluster
+                # if it does, only the more precise cluster is chosen
+                if current is None or Z[current] == size:
+                    current = row_id
+
+        if current is not None:
+            X[current].add(node)
+
+        # all points of a node share the same similarity and thus the same prediction
+        prediction = predictions[first_point[node]]
+        if prediction not in Y_dict:
+            Y_dict[prediction] = set()
+        Y_dict[prediction].add(node)
 
     X = list(filter(lambda a: a != set(), X))
+    Y = list(Y_dict.values())
 
     ARI = adjusted_random_index(S,X,Y)
     EMI = normalized_mutual_info(S,X,Y)
 
-    return ARI,EMI
\ No newline at end of file
+    return ARI,EMI
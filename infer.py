@@ -3,10 +3,10 @@
 ### Imports
 import csv
 
-### Neo4j imports
-from neo4j import GraphDatabase
+EDGES_QUERY = "MATCH (n)-[r]->(m) \
+                RETURN DISTINCT labels(n),keys(n),type(r),labels(m),keys(m)"
 
-def create_neo4j_graph(driver2, edges=True):
+def create_neo4j_graph(driver2, edges=True, driver=None, file=None):
     """ Create a Neo4j graph 
 
     Parameters
@@ -17,6 +17,10 @@ def create_neo4j_graph(driver2, edges=True):
         If edges is set at True by default.
         When edges is at True, add all edges to the Neo4j graph.
         When edges is at False, only add edges SUBTYPE_OF.
+    driver : GraphDatabase.driver object
+        Driver of the database the graph is created in, asked for when None (a ProfilingDriver to profile the export)
+    file : String
+        Name of the schema file, asked for when None
 
     Returns
     -------
@@ -25,9 +29,7 @@ def create_neo4j_graph(driver2, edges=True):
 
     if edges:
         with driver2.session() as session:
-            query = "MATCH (n)-[r]->(m) \
-                RETURN DISTINCT labels(n),keys(n),type(r),labels(m),keys(m)"
-            edge_types = session.run(query)
+            edge_types = session.run(EDGES_QUERY)
 
             all_labels_n = []
             all_keys_n = []
@@ -44,11 +46,15 @@ def create_neo4j_graph(driver2, edges=True):
 
         print("Arêtes récupérées !")
 
-    uri = input("Neo4j bolt address: ")
-    user = input("Neo4j username: ")
-    passwd = input('Neo4j password: ')
-    file = input('Create the Neo4j graph from which file ? : ')
-    driver = GraphDatabase.driver(uri, auth=(user, passwd), encrypted=False)
+    if driver is None:
+        from neo4j import GraphDatabase
+
+        uri = input("Neo4j bolt address: ")
+        user = input("Neo4j username: ")
+        passwd = input('Neo4j password: ')
+        driver = GraphDatabase.driver(uri, auth=(user, passwd), encrypted=False)
+    if file is None:
+        file = input('Create the Neo4j graph from which file ? : ')
 
     with driver.session() as session:
         with open(file) as csv_file:
@@ -0,0 +1,180 @@
+""" Subproblems of step 2 shared between overlapping label sets
+
+A pattern labelled {A,B} is a member of the base types [A], [B] and [A,B]. The label sets of the patterns are
+ordered by containment in a LabelLattice, so that the members of a base type are gathered from the lattice nodes
+above it instead of testing every pattern against every label set.
+While clustering, a SharedSubproblems object keeps what does not depend on the base type being clustered :
+- the similarity of a pattern to a reference node,
+- the tokens of each pattern, from which the reference node of a cluster is found,
+- the split of a set of patterns, so that a set met again (two base types with the same members) is not
+  clustered a second time,
+- a hash of every cluster found, so that a new cluster is compared to all_clusters at once.
+"""
+
+##### Imports
+import heapq
+
+### File imports
+import tracing
+
+class LabelLattice:
+    """ The label sets of the patterns, ordered by containment
+
+    Parameters
+    ----------
+    list_of_distinct_nodes : Python list
+        A list of node strings
+        Its format is : ['Label1 Label2 prop1', 'Label1 Label3 prop2', 'prop4 prop5', ...]
+    distinct_labels : Python list
+        A list of labels
+        Its format is : ['Label1', 'Label2', 'Label3', ...]
+    """
+
+    def __init__(self, list_of_distinct_nodes, distinct_labels):
+        self.nodes = list_of_distinct_nodes
+        labels_set = set(distinct_labels)
+
+        # indexes of the patterns of each label set, in the order of list_of_distinct_nodes
+        self.groups = {}
+        for i, node in enumerate(list_of_distinct_nodes):
+            key = frozenset(token for token in node.split(" ") if token in labels_set)
+            self.groups.setdefault(key, []).append(i)
+
+        # covers of each label set : the smallest label sets strictly containing it
+        keys = sorted(self.groups, key=len)
+        self.covers = {}
+        for key in keys:
+            above = [other for other in keys if len(other) > len(key) and key < other]
+            self.covers[key] = [other for other in above if not any(middle < other for middle in above if middle != other)]
+
+        # label sets above each label set (itself included), computed once from its covers
+        self.upsets = {}
+
+    def upset(self, key):
+        """ The label sets of patterns containing key, key included """
+        upset = self.upsets.get(key)
+        if upset is None:
+            upset = {key}
+            for cover in self.covers[key]:
+                upset |= self.upset(cover)
+            self.upsets[key] = upset
+        return upset
+
+    def members(self, lab_set):
+        """ The patterns of a base type, in the order of list_of_distinct_nodes
+
+        Parameters
+        ----------
+        lab_set : Python list
+            The labels of the base type, [] for the unlabelled patterns
+
+        Returns
+        -------
+        correct_nodes : Python list
+            The patterns having every label of lab_set (no label at all when lab_set is empty)
+        """
+        key = frozenset(lab_set)
+        if key == frozenset():
+            return [self.nodes[i] for i in self.groups.get(key, [])]
+
+        # the smallest label sets of patterns containing lab_set, and every label set above them
+        keys = set()
+        for group in self.groups:
+            if key <= group and group not in keys:
+                keys |= self.upset(group)
+
+        return [self.nodes[i] for i in heapq.merge(*(self.groups[group] for group in keys))]
+
+class SharedSubproblems:
+    """ What is computed once while clustering all the base types (see the module docstring)
+
+    Parameters
+    ----------
+    distinct_labels : Python list
+        A list of labels
+        Its format is : ['Label1', 'Label2', 'Label3', ...]
+    all_clusters : Python list of sets
+        The clusters already found
+    """
+
+    def __init__(self, distinct_labels, all_clusters=()):
+        self.labels_set = set(distinct_labels)
+
+        # similarity of a pattern to a reference node
+        self.similarities = {}
+
+        # labels and properties of a pattern
+        self.tokens = {}
+
+        # split of a set of patterns : the two clusters and the components of the model
+        self.splits = {}
+
+        # clusters of all_clusters
+        self.seen = set(frozenset(cluster) for cluster in all_clusters)
+
+    def node_tokens(self, node):
+        tokens = self.tokens.get(node)
+        if tokens is None:
+            tokens = self.tokens[node] = node.split(' ')
+        return tokens
+
+    def reference_node(self, amount_dict, correct_nodes):
+        """ The most frequent label and the most frequent property of a set of patterns,
+        as max_labs_props with n=1 (ties are broken in the same order) """
+        labs = {}
+        props = {}
+        for node in correct_nodes:
+            amount = amount_dict[node]
+            for word in self.node_tokens(node):
+                counts = labs if word in self.labels_set else props
+                counts[word] = counts.get(word, 0) + amount
+
+        freq_lab = max(labs, key=labs.get) if labs else ""
+        freq_prop = [max(props, key=props.get)] if props else []
+        return freq_lab + " " + ' '.join(freq_prop)
+
+    def compute_similarities(self, correct_nodes, ref_node):
+        """ compute_similarities, each pair of a reference node and a pattern being computed once """
+        from GMM_clustering import dice_coefficient
+
+        similarities_dict = {}
+        computed = 0
+        for node in correct_nodes:
+            similarity = self.similarities.get((ref_node, node))
+            if similarity is None:
+                similarity = self.similarities[(ref_node, node)] = dice_coefficient(ref_node, node)
+                computed += 1
+            similarities_dict[node] = similarity
+
+        tracing.count("similarity_calls", computed)
+        tracing.count("shared_similarities", len(correct_nodes)-computed)
+        return similarities_dict
+
+    def split(self, correct_nodes):
+        """ The split of a set of patterns if it was already computed, None otherwise """
+        split = self.splits.get(frozenset(correct_nodes))
+        if split is not None:
+            tracing.count("shared_splits")
+        return split
+
+    def store_split(self, correct_nodes, clusters, components):
+        self.splits[frozenset(correct_nodes)] = (clusters, components)
+
+    def add_cluster(self, all_clusters, cluster):
+        """ Adds a cluster to all_clusters
+
+        Returns
+        -------
+        cluster : Python set
+            The cluster, None if it is empty or was already found
+        """
+        if cluster == set():
+            return None
+
+        key = frozenset(cluster)
+        if key in self.seen:
+            return None
+        self.seen.add(key)
+
+        all_clusters.append(cluster)
+        return cluster
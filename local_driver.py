@@ -0,0 +1,456 @@
+""" Local stand-in for the Neo4j driver, answering the queries of the pipeline from an in-memory graph """
+
+##### Imports
+import asyncio
+import re
+import uuid
+import threading
+import time
+
+class LocalGraph:
+    """ An in-memory property graph
+
+    Parameters
+    ----------
+    nodes : Python list of tuples
+        The labels and properties of each node, a node's id is its index in the list
+        Its format is : [(['Label1', 'Label2'], {'prop1': value1, 'prop2': value2}), (['Label3'], {}), ...]
+    relationships : Python list of tuples
+        The source node id, the type, the properties and the target node id of each relationship
+        Its format is : [(0, 'TYPE1', {'prop1': value1}, 2), ...]
+    """
+
+    def __init__(self, nodes=None, relationships=None):
+        self.nodes = nodes if nodes is not None else []
+        self.relationships = relationships if relationships is not None else []
+
+        # write queries received, with their parameters
+        self.writes = []
+
+        # store id and id of the last committed transaction (each write query is a transaction)
+        self.store_id = uuid.uuid4().hex
+        self.last_tx = 0
+        self.lock = threading.Lock()
+
+        # version of the server answering, and the procedures it has (to answer as an older server)
+        self.version = "5.13.0"
+        self.procedures = {"db.info", "db.labels", "db.schema.nodeTypeProperties", "dbms.components", "dbms.queryJmx"}
+
+    @classmethod
+    def from_profile(cls, amount_dict, distinct_labels):
+        """ Builds a graph with amount_dict[node] nodes for each node string (properties are set to 1)
+
+        Parameters
+        ----------
+        amount_dict : Python dict
+            A dictionary with node strings as keys and the number of occurrences of the node as a value
+            Its format is : {'Label1 Label2 Label3 prop1 prop2 prop3 ...': int, ...}
+        distinct_labels : Python list
+            A list of labels
+            Its format is : ['Label1', 'Label2', 'Label3', ...]
+
+        Returns
+        -------
+        graph : LocalGraph
+        """
+        labels_set = set(distinct_labels)
+        nodes = []
+        for node, amount in amount_dict.items():
+            tokens = node.split(" ") if node != "" else []
+            labels = [token for token in tokens if token in labels_set]
+            properties = {token: 1 for token in tokens if token not in labels_set}
+            for i in range(amount):
+                nodes.append((labels, properties))
+        return cls(nodes)
+
+class LocalRecord:
+    """ A record with the same accessors as a neo4j.Record """
+
+    def __init__(self, data):
+        self._data = data
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return list(self._data.values())[key]
+        return self._data[key]
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def keys(self):
+        return list(self._data.keys())
+
+    def values(self):
+        return list(self._data.values())
+
+    def data(self):
+        return dict(self._data)
+
+    def __repr__(self):
+        return "<LocalRecord "+repr(self._data)+">"
+
+class LocalSummary:
+    """ A result summary with the timing attributes of a neo4j.ResultSummary (in ms) """
+
+    def __init__(self, query, parameters, available_after, consumed_after, profile=None):
+        self.query = query
+        self.parameters = parameters
+        self.result_available_after = available_after
+        self.result_consumed_after = consumed_after
+        self.profile = profile
+        self.plan = profile
+
+class LocalResult:
+    """ The records of a query, consumed by iteration like a neo4j.Result """
+
+    def __init__(self, query, parameters, rows, available_after, profile=None):
+        self._query = query
+        self._parameters = parameters
+        self._rows = rows
+        self._available_after = available_after
+        self._profile = profile
+        self._start = time.perf_counter()
+        self._summary = None
+
+    def __iter__(self):
+        for row in self._rows:
+            yield LocalRecord(row)
+
+    def data(self):
+        return [dict(row) for row in self._rows]
+
+    def single(self):
+        return LocalRecord(self._rows[0]) if self._rows != [] else None
+
+    def consume(self):
+        if self._summary is None:
+            consumed_after = int((time.perf_counter()-self._start)*1000)
+            self._summary = LocalSummary(self._query, self._parameters, self._available_after, consumed_after,
+                                         self._profile)
+        return self._summary
+
+class LocalSession:
+    """ A session of a LocalDriver """
+
+    def __init__(self, driver, database=None):
+        self.driver = driver
+        self.database = database
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def run(self, query, parameters=None, **kwparameters):
+        parameters = dict(parameters or {}, **kwparameters)
+        start = time.perf_counter()
+
+        # a profiled query gets a plan of one operator, reading every node of the graph
+        profiled = query.lstrip()[:8].upper() == "PROFILE "
+        rows = self.driver.execute(query.lstrip()[8:] if profiled else query, parameters)
+        profile = None
+        if profiled:
+            profile = {"operatorType": "ProduceResults@local", "dbHits": len(self.driver.graph.nodes), "rows": len(rows),
+                       "children": []}
+        return LocalResult(query, parameters, rows, int((time.perf_counter()-start)*1000), profile)
+
+    def close(self):
+        pass
+
+class LocalDriver:
+    """ A synchronous stand-in for neo4j.GraphDatabase.driver
+
+    Parameters
+    ----------
+    graph : LocalGraph
+        The graph queried
+    latency : Float
+        Time in seconds added to each query (network and server time)
+    """
+
+    def __init__(self, graph, latency=0.0):
+        self.graph = graph
+        self.latency = latency
+
+        # number of queries running at the same time, to check bounded concurrency
+        self.active = 0
+        self.max_active = 0
+        self.queries = 0
+        self.lock = threading.Lock()
+
+    def session(self, database=None, **config):
+        return LocalSession(self, database)
+
+    def execute(self, query, parameters):
+        with self.lock:
+            self.queries += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            return execute_query(self.graph, query, parameters)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    def close(self):
+        pass
+
+class AsyncLocalResult:
+    """ The records of a query, consumed by asynchronous iteration like a neo4j.AsyncResult """
+
+    def __init__(self, result):
+        self._result = result
+
+    def __aiter__(self):
+        return self._records()
+
+    async def _records(self):
+        for record in self._result:
+            yield record
+
+    async def data(self):
+        return self._result.data()
+
+    async def single(self):
+        return self._result.single()
+
+    async def consume(self):
+        return self._result.consume()
+
+class AsyncLocalSession:
+    """ A session of an AsyncLocalDriver """
+
+    def __init__(self, driver, database=None):
+        self.driver = driver
+        self.database = database
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+        return False
+
+    async def run(self, query, parameters=None, **kwparameters):
+        parameters = dict(parameters or {}, **kwparameters)
+        driver = self.driver
+        start = time.perf_counter()
+
+        driver.active += 1
+        driver.max_active = max(driver.max_active, driver.active)
+        driver.queries += 1
+        try:
+            if driver.latency:
+                await asyncio.sleep(driver.latency)
+            rows = execute_query(driver.graph, query, parameters)
+        finally:
+            driver.active -= 1
+
+        return AsyncLocalResult(LocalResult(query, parameters, rows, int((time.perf_counter()-start)*1000)))
+
+    async def close(self):
+        pass
+
+class AsyncLocalDriver:
+    """ An asynchronous stand-in for neo4j.AsyncGraphDatabase.driver
+
+    Parameters
+    ----------
+    graph : LocalGraph
+        The graph queried
+    latency : Float
+        Time in seconds added to each query (network and server time), awaited so queries can overlap
+    """
+
+    def __init__(self, graph, latency=0.0):
+        self.graph = graph
+        self.latency = latency
+        self.active = 0
+        self.max_active = 0
+        self.queries = 0
+
+    def session(self, database=None, **config):
+        return AsyncLocalSession(self, database)
+
+    async def close(self):
+        pass
+
+##### Query handlers
+
+def parse_labels(text):
+    """ Reads the labels of a node pattern such as :`Label1`:`Label2` """
+    return [label.replace("``", "`") for label in re.findall(r":`((?:[^`]|``)*)`", text)]
+
+def labels_query(graph, match, parameters):
+    distinct_labels = []
+    for labels, properties in graph.nodes:
+        for label in labels:
+            if label not in distinct_labels:
+                distinct_labels.append(label)
+    return [{"lab": label} for label in distinct_labels]
+
+def label_sets_query(graph, match, parameters):
+    labs_sets = []
+    for labels, properties in graph.nodes:
+        if list(labels) not in labs_sets:
+            labs_sets.append(list(labels))
+    return [{"LABELS(n)": labels} for labels in labs_sets]
+
+def patterns_query(graph, match, parameters):
+    counts = {}
+    for labels, properties in graph.nodes:
+        pattern = (tuple(labels), tuple(properties))
+        counts[pattern] = counts.get(pattern, 0) + 1
+    return [{"labels(n)": list(labels), "keys(n)": list(keys), "COUNT(n)": count}
+            for (labels, keys), count in counts.items()]
+
+def nodes_query(graph, match, parameters):
+    return [{"labels": list(labels), "properties": dict(properties)} for labels, properties in graph.nodes]
+
+def label_set_patterns_query(graph, match, parameters):
+    lab_set = set(parse_labels(match.group(1)))
+    size = int(match.group(2))
+    counts = {}
+    for labels, properties in graph.nodes:
+        if len(labels) == size and lab_set.issubset(labels):
+            keys = tuple(properties)
+            counts[keys] = counts.get(keys, 0) + 1
+    return [{"keys": list(keys), "count": count} for keys, count in counts.items()]
+
+def edge_patterns_query(graph, match, parameters):
+    edges = []
+    for source, rel_type, properties, target in graph.relationships:
+        row = {"labels(n)": list(graph.nodes[source][0]), "keys(n)": list(graph.nodes[source][1]),
+               "type(r)": rel_type,
+               "labels(m)": list(graph.nodes[target][0]), "keys(m)": list(graph.nodes[target][1])}
+        if row not in edges:
+            edges.append(row)
+    return edges
+
+def edge_type_patterns_query(graph, match, parameters):
+    counts = {}
+    for source, rel_type, properties, target in graph.relationships:
+        pattern = (rel_type, tuple(properties), tuple(graph.nodes[source][0]), tuple(graph.nodes[target][0]))
+        counts[pattern] = counts.get(pattern, 0) + 1
+    return [{"type": rel_type, "keys": list(keys), "source": list(source), "target": list(target), "count": count}
+            for (rel_type, keys, source, target), count in counts.items()]
+
+def store_id_query(graph, match, parameters):
+    return [{"id": graph.store_id}]
+
+def last_tx_query(graph, match, parameters):
+    if "dbms.queryJmx" not in graph.procedures:
+        raise ValueError("There is no procedure dbms.queryJmx")
+    return [{"name": "org.neo4j:instance=kernel#0,name=Transactions", "tx": graph.last_tx}]
+
+def node_count_query(graph, match, parameters):
+    return [{"count": len(graph.nodes)}]
+
+def relationship_count_query(graph, match, parameters):
+    return [{"count": len(graph.relationships)}]
+
+def max_id_query(graph, match, parameters):
+    return [{"high": len(graph.nodes)-1 if graph.nodes else None}]
+
+def id_range_query(graph, match, parameters):
+    low, high = max(parameters["low"], 0), min(parameters["high"], len(graph.nodes))
+    return [{"id": i, "labels": list(graph.nodes[i][0]), "keys": list(graph.nodes[i][1])} for i in range(low, high)]
+
+def components_query(graph, match, parameters):
+    return [{"name": "Neo4j Kernel", "versions": [graph.version], "edition": "community"}]
+
+def show_procedures_query(graph, match, parameters):
+    if tuple(int(part) for part in graph.version.split(".")[:2]) < (4, 3):
+        raise ValueError("SHOW PROCEDURES is not supported by Neo4j "+graph.version)
+    return [{"name": name} for name in sorted(graph.procedures)]
+
+def dbms_procedures_query(graph, match, parameters):
+    if int(graph.version.split(".")[0]) >= 5:
+        raise ValueError("dbms.procedures() was removed in Neo4j 5")
+    return [{"name": name} for name in sorted(graph.procedures)]
+
+def db_labels_query(graph, match, parameters):
+    if "db.labels" not in graph.procedures:
+        raise ValueError("There is no procedure db.labels")
+    return [{"label": row["lab"]} for row in labels_query(graph, match, parameters)]
+
+def label_count_query(graph, match, parameters):
+    label = parse_labels(match.group(1))[0]
+    return [{"count": sum(1 for labels, properties in graph.nodes if label in labels)}]
+
+def node_type_properties_query(graph, match, parameters):
+    if "db.schema.nodeTypeProperties" not in graph.procedures:
+        raise ValueError("There is no procedure db.schema.nodeTypeProperties")
+    types = {}
+    for labels, properties in graph.nodes:
+        counts = types.setdefault(tuple(sorted(labels)), [0, {}])
+        counts[0] += 1
+        for key in properties:
+            counts[1][key] = counts[1].get(key, 0) + 1
+    rows = []
+    for labels, (total, keys) in types.items():
+        if keys == {}:
+            rows.append({"nodeLabels": list(labels), "propertyName": None, "mandatory": False})
+        for key, count in keys.items():
+            rows.append({"nodeLabels": list(labels), "propertyName": key, "mandatory": count == total})
+    return rows
+
+def write_query(graph, match, parameters):
+    with graph.lock:
+        graph.writes.append((match.string, parameters))
+        graph.last_tx += 1
+    return []
+
+### Handlers tried in order, on the query with collapsed whitespaces
+HANDLERS = [
+    (r"MATCH\(n\) WITH LABELS\(n\) AS labs UNWIND labs AS lab RETURN DISTINCT lab", labels_query),
+    (r"MATCH\(n\) RETURN DISTINCT LABELS\(n\)", label_sets_query),
+    (r"MATCH\(n\) RETURN DISTINCT labels\(n\), keys\(n\), COUNT\(n\)", patterns_query),
+    (r"MATCH\(n\) RETURN labels\(n\) AS labels, properties\(n\) AS properties", nodes_query),
+    (r"MATCH \(n((?::`(?:[^`]|``)*`)*)\) WHERE size\(labels\(n\)\) = (\d+) RETURN keys\(n\) AS keys, count\(n\) AS count", label_set_patterns_query),
+    (r"MATCH \(n\)-\[r\]->\(m\) RETURN DISTINCT labels\(n\),keys\(n\),type\(r\),labels\(m\),keys\(m\)", edge_patterns_query),
+    (r"MATCH \(n\)-\[r\]->\(m\) RETURN type\(r\) AS type, keys\(r\) AS keys, labels\(n\) AS source, labels\(m\) AS target, count\(\*\) AS count", edge_type_patterns_query),
+    (r"CALL db\.info\(\) YIELD id RETURN id", store_id_query),
+    (r"CALL dbms\.queryJmx\('org\.neo4j:\*'\) YIELD name, attributes WHERE name CONTAINS 'name=Transactions' RETURN name, attributes\.LastCommittedTxId\.value AS tx", last_tx_query),
+    (r"MATCH \(n\) RETURN count\(n\) AS count", node_count_query),
+    (r"MATCH \(n(:`(?:[^`]|``)*`)\) RETURN count\(n\) AS count", label_count_query),
+    (r"MATCH \(n\) RETURN max\(id\(n\)\) AS high", max_id_query),
+    (r"UNWIND range\(\$low, \$high-1\) AS i MATCH \(n\) WHERE id\(n\) = i RETURN id\(n\) AS id, labels\(n\) AS labels, keys\(n\) AS keys", id_range_query),
+    (r"CALL dbms\.components\(\) YIELD name, versions, edition RETURN name, versions, edition", components_query),
+    (r"SHOW PROCEDURES YIELD name RETURN name", show_procedures_query),
+    (r"CALL dbms\.procedures\(\) YIELD name RETURN name", dbms_procedures_query),
+    (r"CALL db\.labels\(\) YIELD label RETURN label", db_labels_query),
+    (r"CALL db\.schema\.nodeTypeProperties\(\) YIELD nodeLabels, propertyName, mandatory RETURN nodeLabels, propertyName, mandatory", node_type_properties_query),
+    (r"MATCH \(\)-\[r\]->\(\) RETURN count\(r\) AS count", relationship_count_query),
+    (r".*\bCREATE\b.*", write_query),
+]
+
+COMPILED_HANDLERS = [(re.compile(pattern, re.DOTALL), handler) for pattern, handler in HANDLERS]
+
+def execute_query(graph, query, parameters):
+    """ Answers a query of the pipeline from a LocalGraph
+
+    Parameters
+    ----------
+    graph : LocalGraph
+        The graph queried
+    query : String
+        A Cypher query issued by the pipeline
+    parameters : Python dict
+        The parameters of the query
+
+    Returns
+    -------
+    rows : Python list of dict
+        The records of the result
+    """
+    normalized = " ".join(query.split())
+    for pattern, handler in COMPILED_HANDLERS:
+        match = pattern.fullmatch(normalized)
+        if match is not None:
+            return handler(graph, match, parameters)
+    raise ValueError("The local driver cannot answer the query: "+normalized)
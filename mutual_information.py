@@ -1,7 +1,6 @@
 """ Computation of the Adjusted Mutual Information """
 
 ##### Imports
-import numpy as np
 import math
 
 def mutual_info(S,U,V):
@@ -34,6 +33,8 @@ def mutual_info(S,U,V):
 
 	"""
 
+	import numpy as np
+
 	M = np.empty((len(U), len(V)))
 	N = len(S)
 
@@ -97,6 +98,8 @@ def normalized_mutual_info(S,U,V):
 
 	MI,HU,HV = mutual_info(S,U,V)
 
+	import numpy as np
+
 	R = len(U)
 	C = len(V)
 
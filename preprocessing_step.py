@@ -1,15 +1,52 @@
 """ Step 1 : Preprocessing data """
 
 ##### Imports
+import random
 from termcolor import colored
 
-def preprocessing(driver):
+### File imports
+from property_stats import KeyStats
+
+### Queries
+LABELS_QUERY = "MATCH(n) WITH LABELS(n) AS labs \
+            UNWIND labs AS lab \
+            RETURN DISTINCT lab"
+
+LABEL_SETS_QUERY = "MATCH(n) \
+            RETURN DISTINCT LABELS(n)"
+
+PATTERNS_QUERY = "MATCH(n) \
+            RETURN DISTINCT labels(n), keys(n), COUNT(n)"
+
+NODES_QUERY = "MATCH(n) \
+            RETURN labels(n) AS labels, properties(n) AS properties"
+
+def label_set_query(lab_set):
+    """ Builds a query counting the nodes of each set of properties among the nodes with exactly the labels of lab_set
+
+    Parameters
+    ----------
+    lab_set : Python list
+        A list of labels, empty for unlabelled nodes
+        Its format is : ['Label1', 'Label2']
+
+    Returns
+    -------
+    query : String
+        A query returning the columns keys and count
+    """
+    labels = "".join(":`"+label.replace("`","``")+"`" for label in lab_set)
+    return "MATCH (n"+labels+") WHERE size(labels(n)) = "+str(len(lab_set))+" RETURN keys(n) AS keys, count(n) AS count"
+
+def preprocessing(driver, database=None):
     """  Queries a property graph using the driver to get all needed labels',properties' and nodes' information
 
     Parameters
     ----------
     driver : GraphDatabase.driver object
         Driver used to access the PG stored in a Neo4j database.
+    database : String
+        Name of the database to query, None for the default database of the server.
 
     Returns
     -------
@@ -28,12 +65,8 @@ def preprocessing(driver):
     """
     
     print(colored("Querying neo4j to get all distinct labels:", "yellow"))
-    with driver.session() as session:
-        all_labels = session.run(
-            "MATCH(n) WITH LABELS(n) AS labs \
-            UNWIND labs AS lab \
-            RETURN DISTINCT lab"
-            )
+    with driver.session(database=database) as session:
+        all_labels = session.run(LABELS_QUERY)
 
         distinct_labels = []
         for labs in all_labels:
@@ -41,10 +74,7 @@ def preprocessing(driver):
         print(colored("Done.", "green"))
 
         print(colored("Querying neo4j to get all distinct sets of labels:", "yellow"))
-        labels_sets = session.run(
-            "MATCH(n) \
-            RETURN DISTINCT LABELS(n)"
-            )
+        labels_sets = session.run(LABEL_SETS_QUERY)
 
         labs_sets = []
         for labels_set in labels_sets:
@@ -53,10 +83,7 @@ def preprocessing(driver):
 
         print(colored("Querying neo4j to get all distinct sets of labels and props:", "yellow"))
         #get all nodes' labels and properties' names
-        distinct_nodes = session.run(
-            "MATCH(n) \
-            RETURN DISTINCT labels(n), keys(n), COUNT(n)"
-            )
+        distinct_nodes = session.run(PATTERNS_QUERY)
 
         # Storing the number of repetitions of the node
         amount_dict = {}
@@ -73,7 +100,7 @@ def preprocessing(driver):
 
             labels_properties = labels+properties
             labels_properties_str = ' '.join(labels_properties)
-            if labels_properties_str in list_of_distinct_nodes:
+            if labels_properties_str in amount_dict:
                 amount_dict[labels_properties_str] += node["COUNT(n)"]
             else:
                 list_of_distinct_nodes.append(labels_properties_str) 
@@ -83,3 +110,69 @@ def preprocessing(driver):
 
 
     return amount_dict,list_of_distinct_nodes,distinct_labels,labs_sets
+
+def preprocessing_with_stats(driver, database=None, reservoir_size=10, precision=10, seed=0):
+    """ Same as preprocessing, but also collects statistics on the values of each property of each node string
+
+    The labels, the sets of labels and the patterns are all read from a single scan of the nodes.
+
+    Parameters
+    ----------
+    driver : GraphDatabase.driver object
+        Driver used to access the PG stored in a Neo4j database.
+    database : String
+        Name of the database to query, None for the default database of the server.
+    reservoir_size : Int
+        Number of sample values kept for each property of each node string
+    precision : Int
+        Precision of the HyperLogLog estimating the number of distinct values
+    seed : Int
+        Seed of the reservoir samples
+
+    Returns
+    -------
+    amount_dict, list_of_distinct_nodes, distinct_labels, labs_sets :
+        As returned by preprocessing
+    key_stats : Python dict
+        The statistics of each property of each node string
+        Its format is : {'Label1 prop1 prop2': {'prop1': KeyStats, 'prop2': KeyStats}, ...}
+    """
+    rng = random.Random(seed)
+
+    distinct_labels = []
+    labels_set = set()
+    labs_sets = []
+    seen_labs_sets = set()
+    amount_dict = {}
+    list_of_distinct_nodes = []
+    key_stats = {}
+
+    print(colored("Querying neo4j to scan all nodes' labels and properties:", "yellow"))
+    with driver.session(database=database) as session:
+        for node in session.run(NODES_QUERY):
+            labels = node["labels"]
+            properties = node["properties"]
+
+            labs = tuple(labels)
+            if labs not in seen_labs_sets:
+                seen_labs_sets.add(labs)
+                labs_sets.append(list(labels))
+                for label in labels:
+                    if label not in labels_set:
+                        labels_set.add(label)
+                        distinct_labels.append(label)
+
+            labels_properties_str = ' '.join(sorted(labels)+sorted(properties))
+            if labels_properties_str in amount_dict:
+                amount_dict[labels_properties_str] += 1
+            else:
+                list_of_distinct_nodes.append(labels_properties_str)
+                amount_dict[labels_properties_str] = 1
+                key_stats[labels_properties_str] = {key: KeyStats(reservoir_size, precision, rng) for key in properties}
+
+            stats = key_stats[labels_properties_str]
+            for key, value in properties.items():
+                stats[key].add(value)
+    print(colored("Done.", "green"))
+
+    return amount_dict,list_of_distinct_nodes,distinct_labels,labs_sets,key_stats
@@ -0,0 +1,211 @@
+""" Cache of the output of step 1, reused while the database does not change
+
+A profile is stored with a fingerprint of the database taken when it was computed. The fingerprint only reads
+metadata : the store id, the id of the last committed transaction and the numbers of nodes and relationships
+(answered by the count store). A later run takes the fingerprint again and reuses the profile when it matches.
+When the server does not give the id of the last transaction (JMX disabled, or Neo4j 5 which has no
+dbms.queryJmx), a change that keeps the numbers of nodes and relationships (a SET or a REMOVE of properties) is not
+detected : such a profile is only reused with a finite max_age, which bounds how long it is reused.
+"""
+
+##### Imports
+import hashlib
+import os
+import pickle
+import time
+from termcolor import colored
+
+### Queries of the fingerprint
+STORE_ID_QUERY = "CALL db.info() YIELD id RETURN id"
+
+LAST_TX_QUERY = "CALL dbms.queryJmx('org.neo4j:*') YIELD name, attributes \
+            WHERE name CONTAINS 'name=Transactions' \
+            RETURN name, attributes.LastCommittedTxId.value AS tx"
+
+NODE_COUNT_QUERY = "MATCH (n) RETURN count(n) AS count"
+
+RELATIONSHIP_COUNT_QUERY = "MATCH ()-[r]->() RETURN count(r) AS count"
+
+def database_fingerprint(driver, database=None):
+    """ Takes a cheap fingerprint of a database
+
+    Each part of the fingerprint is None when the server cannot give it (older versions, procedures not allowed).
+
+    Parameters
+    ----------
+    driver : GraphDatabase.driver object
+        Driver used to access the PG stored in a Neo4j database.
+    database : String
+        Name of the database, None for the default database of the server.
+
+    Returns
+    -------
+    fingerprint : Python dict
+        store_id, last_tx, nodes and relationships
+    """
+    fingerprint = {}
+    with driver.session(database=database) as session:
+        try:
+            fingerprint["store_id"] = session.run(STORE_ID_QUERY).single()["id"]
+        except Exception:
+            fingerprint["store_id"] = None
+
+        try:
+            transactions = [(record["name"], record["tx"]) for record in session.run(LAST_TX_QUERY)]
+            if database is not None:
+                transactions = [(name, tx) for name, tx in transactions if "database="+database in name]
+            fingerprint["last_tx"] = ",".join(str(tx) for name, tx in sorted(transactions)) if transactions != [] else None
+        except Exception:
+            fingerprint["last_tx"] = None
+
+        try:
+            fingerprint["nodes"] = session.run(NODE_COUNT_QUERY).single()["count"]
+        except Exception:
+            fingerprint["nodes"] = None
+
+        try:
+            fingerprint["relationships"] = session.run(RELATIONSHIP_COUNT_QUERY).single()["count"]
+        except Exception:
+            fingerprint["relationships"] = None
+
+    return fingerprint
+
+class ProfileCache:
+    """ Profiles of databases stored in a directory, one file per database
+
+    Parameters
+    ----------
+    directory : String
+        Directory of the cache
+    max_age : Float
+        Age in seconds after which a profile is computed again even if the fingerprint matches, None to never expire
+        (a profile whose fingerprint has no id of the last transaction is then never reused)
+    """
+
+    def __init__(self, directory=".pg_cache", max_age=None):
+        self.directory = directory
+        self.max_age = max_age
+
+    def path(self, key):
+        """ File of the profile of a database, key naming the database (e.g. its uri and name) """
+        return os.path.join(self.directory, hashlib.sha1(key.encode("utf-8")).hexdigest()+".pickle")
+
+    def load(self, key, fingerprint):
+        """ The profile stored for a database
+
+        Parameters
+        ----------
+        key : String
+            Name of the database in the cache
+        fingerprint : Python dict
+            Fingerprint of the database now
+
+        Returns
+        -------
+        profile : Python tuple
+            The stored profile, None if there is none, if it expired, if the database changed or if a change
+            cannot be detected (no id of the last transaction) and there is no max_age
+        """
+        if fingerprint.get("last_tx") is None and self.max_age is None:
+            return None
+
+        try:
+            with open(self.path(key), "rb") as f:
+                entry = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+        if entry["key"] != key or entry["fingerprint"] != fingerprint:
+            return None
+        if self.max_age is not None and time.time() - entry["created"] > self.max_age:
+            return None
+        return entry["profile"]
+
+    def store(self, key, fingerprint, profile):
+        """ Stores the profile of a database with its fingerprint """
+        os.makedirs(self.directory, exist_ok=True)
+
+        # the file is replaced at once so that a concurrent run never reads half a profile
+        path = self.path(key)
+        temporary = path+".tmp"+str(os.getpid())
+        with open(temporary, "wb") as f:
+            pickle.dump({"key": key, "fingerprint": fingerprint, "created": time.time(), "profile": profile}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+
+    def invalidate(self, key=None):
+        """ Removes the profile of a database, or of every database when key is None
+
+        Returns
+        -------
+        removed : Int
+            Number of profiles removed
+        """
+        if key is not None:
+            paths = [self.path(key)]
+        elif os.path.isdir(self.directory):
+            paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".pickle")]
+        else:
+            paths = []
+
+        removed = 0
+        for path in paths:
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+def cached_preprocessing(driver, key, database=None, cache=None, refresh=False, property_stats=False):
+    """ Step 1, skipped when the cache has the profile of the database as it is now
+
+    Parameters
+    ----------
+    driver : GraphDatabase.driver object
+        Driver used to access the PG stored in a Neo4j database.
+    key : String
+        Name of the database in the cache (e.g. its uri and name)
+    database : String
+        Name of the database to query, None for the default database of the server.
+    cache : ProfileCache
+        The cache, the default one (.pg_cache without max age) when None
+    refresh : Boolean
+        Compute the profile again even if the cache has it
+    property_stats : Boolean
+        Use preprocessing_with_stats instead of preprocessing (both profiles are cached separately)
+
+    Returns
+    -------
+    profile : Python tuple
+        As returned by preprocessing (or preprocessing_with_stats)
+    """
+    from preprocessing_step import preprocessing, preprocessing_with_stats
+
+    if cache is None:
+        cache = ProfileCache()
+
+    if property_stats:
+        key = key+"#property_stats"
+
+    fingerprint = database_fingerprint(driver, database)
+    if fingerprint["last_tx"] is None:
+        if cache.max_age is None:
+            print(colored("The server does not give the id of its last transaction : without a max age, the cached "
+                          "profile is not reused.", "yellow"))
+        else:
+            print(colored("The server does not give the id of its last transaction : a change of the properties of "
+                          "the nodes is only detected once the cached profile is "+str(cache.max_age)+" s old.", "yellow"))
+
+    if not refresh:
+        profile = cache.load(key, fingerprint)
+        if profile is not None:
+            print(colored("The database did not change since its profile was cached.", "green"))
+            return profile
+
+    if property_stats:
+        profile = preprocessing_with_stats(driver, database)
+    else:
+        profile = preprocessing(driver, database)
+    cache.store(key, fingerprint, profile)
+    return profile
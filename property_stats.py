@@ -0,0 +1,302 @@
+""" Datatypes and bounded-memory value statistics of the properties, collected while profiling """
+
+##### Imports
+import hashlib
+import math
+import random
+
+### Names of the Cypher types of the values returned by the driver
+DATATYPES = {bool: "Boolean", int: "Integer", float: "Float", str: "String",
+             bytes: "ByteArray", bytearray: "ByteArray", list: "List", dict: "Map"}
+
+### Types whose values are not ordered (no min and max)
+UNORDERED_DATATYPES = {"Boolean", "ByteArray", "List", "Map", "Point", "Duration"}
+
+def datatype(value):
+    """ Name of the Cypher type of a property value
+
+    Parameters
+    ----------
+    value : Object
+        A property value as returned by the driver
+
+    Returns
+    -------
+    name : String
+        'Integer', 'Float', 'String', 'Boolean', 'List', 'Date', 'DateTime', 'Point', ...
+    """
+    name = DATATYPES.get(type(value))
+    if name is not None:
+        return name
+
+    # temporal and spatial types of the driver (neo4j.time.Date, neo4j.spatial.CartesianPoint, ...)
+    name = type(value).__name__
+    if name.endswith("Point"):
+        return "Point"
+    return name
+
+def value_hash(value):
+    """ 64 bits hash of a value, stable across processes (unlike hash()) """
+    digest = hashlib.blake2b(repr(value).encode("utf-8", "surrogatepass"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+class HyperLogLog:
+    """ Estimates the number of distinct values of a stream in a bounded memory
+
+    The first values are kept exactly, the 2**precision registers are only allocated beyond exact_limit distinct values.
+
+    Parameters
+    ----------
+    precision : Int
+        Number of bits used to choose a register, the relative error is about 1.04/sqrt(2**precision)
+    exact_limit : Int
+        Number of distinct hashes kept before switching to the registers
+    """
+
+    def __init__(self, precision=10, exact_limit=32):
+        self.precision = precision
+        self.exact_limit = exact_limit
+        self.hashes = set()
+        self.registers = None
+
+    def add(self, value):
+        self.add_hash(value_hash(value))
+
+    def add_hash(self, h):
+        if self.registers is None:
+            self.hashes.add(h)
+            if len(self.hashes) > self.exact_limit:
+                self.to_registers()
+            return
+
+        width = 64 - self.precision
+        index = h >> width
+        rank = width - (h & ((1 << width) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def to_registers(self):
+        self.registers = bytearray(1 << self.precision)
+        hashes = self.hashes
+        self.hashes = set()
+        for h in hashes:
+            self.add_hash(h)
+
+    def merge(self, other):
+        """ Adds the values seen by another HyperLogLog of the same precision """
+        if other.registers is None:
+            for h in other.hashes:
+                self.add_hash(h)
+            return self
+
+        if self.registers is None:
+            self.to_registers()
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def estimate(self):
+        """ Estimated number of distinct values """
+        if self.registers is None:
+            return len(self.hashes)
+
+        m = len(self.registers)
+        alpha = 0.7213/(1+1.079/m)
+        estimate = alpha*m*m/sum(2.0**-register for register in self.registers)
+
+        # linear counting is more precise for small cardinalities
+        zeros = self.registers.count(0)
+        if estimate <= 2.5*m and zeros > 0:
+            estimate = m*math.log(m/zeros)
+
+        return int(round(estimate))
+
+class Reservoir:
+    """ A uniform sample of at most size values of a stream (algorithm R)
+
+    Parameters
+    ----------
+    size : Int
+        Maximum number of values kept
+    rng : random.Random object
+        Generator shared by the reservoirs of a profile (one generator per reservoir would be too heavy)
+    """
+
+    def __init__(self, size=10, rng=random):
+        self.size = size
+        self.rng = rng
+        self.seen = 0
+        self.sample = []
+
+    def add(self, value):
+        self.seen += 1
+        if len(self.sample) < self.size:
+            self.sample.append(value)
+        else:
+            j = self.rng.randrange(self.seen)
+            if j < self.size:
+                self.sample[j] = value
+
+    def merge(self, other):
+        """ Merges the sample of another stream, each value is taken from a stream proportionally to its length """
+        left = list(self.sample)
+        right = list(other.sample)
+        left_seen = self.seen
+        right_seen = other.seen
+
+        sample = []
+        while len(sample) < self.size and (left or right):
+            if right == [] or (left != [] and self.rng.random()*(left_seen+right_seen) < left_seen):
+                sample.append(left.pop(self.rng.randrange(len(left))))
+                left_seen -= 1
+            else:
+                sample.append(right.pop(self.rng.randrange(len(right))))
+                right_seen -= 1
+
+        self.sample = sample
+        self.seen += other.seen
+        return self
+
+class KeyStats:
+    """ Statistics of the values of a property
+
+    Parameters
+    ----------
+    reservoir_size : Int
+        Number of sample values kept
+    precision : Int
+        Precision of the distinct values estimate
+    rng : random.Random object
+        Generator of the reservoir
+    """
+
+    def __init__(self, reservoir_size=10, precision=10, rng=random):
+        self.count = 0
+        self.nulls = 0
+        self.datatypes = {}
+        self.ranges = {}
+        self.distinct = HyperLogLog(precision)
+        self.reservoir = Reservoir(reservoir_size, rng)
+
+    def add(self, value):
+        self.count += 1
+        if value is None:
+            self.nulls += 1
+            return
+
+        name = datatype(value)
+        self.datatypes[name] = self.datatypes.get(name, 0) + 1
+
+        if name not in UNORDERED_DATATYPES:
+            self.update_range(name, value, value)
+
+        self.distinct.add(value)
+        self.reservoir.add(value)
+
+    def update_range(self, name, minimum, maximum):
+        if name not in self.ranges:
+            self.ranges[name] = [minimum, maximum]
+            return
+
+        bounds = self.ranges[name]
+        try:
+            if minimum < bounds[0]:
+                bounds[0] = minimum
+            if maximum > bounds[1]:
+                bounds[1] = maximum
+        except TypeError:
+            # values of a same type that cannot be compared (e.g. dates with and without timezone)
+            pass
+
+    def merge(self, other):
+        """ Adds the statistics of the same property in other nodes """
+        self.count += other.count
+        self.nulls += other.nulls
+        for name, amount in other.datatypes.items():
+            self.datatypes[name] = self.datatypes.get(name, 0) + amount
+        for name, (minimum, maximum) in other.ranges.items():
+            self.update_range(name, minimum, maximum)
+        self.distinct.merge(other.distinct)
+        self.reservoir.merge(other.reservoir)
+        return self
+
+    def copy(self):
+        stats = KeyStats(self.reservoir.size, self.distinct.precision, self.reservoir.rng)
+        return stats.merge(self)
+
+    def datatype_names(self):
+        """ The datatypes of the property, the most frequent first """
+        return sorted(self.datatypes, key=lambda name: (-self.datatypes[name], name))
+
+    def describe(self, total=None):
+        """ Summary of the statistics
+
+        Parameters
+        ----------
+        total : Int
+            Number of nodes of the type, to count the nodes without the property as nulls
+
+        Returns
+        -------
+        description : Python dict
+            datatypes : histogram of the datatypes
+            null_rate : fraction of the nodes whose value is missing
+            min, max : bounds of the values of each ordered datatype
+            distinct : estimated number of distinct values
+            sample : sample values
+        """
+        if total is None:
+            total = self.count
+        missing = self.nulls + total - self.count
+        return {"datatypes": dict(self.datatypes),
+                "null_rate": missing/total if total > 0 else 0.0,
+                "min": {name: bounds[0] for name, bounds in self.ranges.items()},
+                "max": {name: bounds[1] for name, bounds in self.ranges.items()},
+                "distinct": self.distinct.estimate(),
+                "sample": list(self.reservoir.sample)}
+
+def merge_key_stats(key_stats, nodes):
+    """ Merges the statistics of the properties of several node strings (e.g. the nodes of a cluster)
+
+    Parameters
+    ----------
+    key_stats : Python dict
+        The statistics of each property of each node string, as returned by preprocessing_with_stats
+        Its format is : {'Label1 prop1 prop2': {'prop1': KeyStats, 'prop2': KeyStats}, ...}
+    nodes : Iterable
+        Node strings
+
+    Returns
+    -------
+    merged : Python dict
+        A dictionary with properties as keys and their merged KeyStats as values
+    """
+    merged = {}
+    for node in nodes:
+        for key, stats in key_stats.get(node, {}).items():
+            if key in merged:
+                merged[key].merge(stats)
+            else:
+                merged[key] = stats.copy()
+    return merged
+
+def type_statistics(key_stats, amount_dict, nodes):
+    """ Describes the properties of a type
+
+    Parameters
+    ----------
+    key_stats : Python dict
+        The statistics of each property of each node string, as returned by preprocessing_with_stats
+    amount_dict : Python dict
+        A dictionary with node strings as keys and the number of occurrences of the node as a value
+    nodes : Iterable
+        Node strings of the type
+
+    Returns
+    -------
+    statistics : Python dict
+        A dictionary with properties as keys and KeyStats.describe() as values,
+        the nodes of the type without a property count as nulls
+    """
+    nodes = list(nodes)
+    total = sum(amount_dict.get(node, 0) for node in nodes)
+    return {key: stats.describe(total) for key, stats in sorted(merge_key_stats(key_stats, nodes).items())}
@@ -0,0 +1,212 @@
+""" Profiling of the Cypher queries issued by the pipeline
+
+A ProfilingDriver wraps the driver given to preprocessing, infer_schema, create_neo4j_graph or any helper running its
+queries through driver.session().run(). Each query is timed on the client side, from run() until its last record is
+consumed, and the result summary of the driver gives the time the server took until the first record was available
+and until the last one was consumed. With plans=True the queries are run with PROFILE and the db hits and rows of
+their plan are added up.
+The queries are grouped by template : the string and number literals, the backquoted names and the labels and
+relationship types of the patterns are replaced by '?', so that the label-scoped queries of step 1 or the CREATE
+queries of the export are reported once.
+The time not spent by the server (client time minus server time) is spent in the network and in Python.
+"""
+
+##### Imports
+import re
+import threading
+import time
+
+### Patterns replaced by '?' in a template
+TEMPLATE_PATTERNS = [
+    (re.compile(r"'(?:[^'\\]|\\.)*'"), "'?'"),
+    (re.compile(r'"(?:[^"\\]|\\.)*"'), '"?"'),
+    (re.compile(r"`(?:[^`]|``)*`"), "`?`"),
+    (re.compile(r"(?<![\w$])\d+(?:\.\d+)?"), "?"),
+    (re.compile(r"([(\[]\w*)((?::\w+)+)"), r"\1:?"),
+]
+
+def query_template(query):
+    """ The template of a query : its literals, names, labels and relationship types replaced by '?' """
+    template = " ".join(query.split())
+    for pattern, replacement in TEMPLATE_PATTERNS:
+        template = pattern.sub(replacement, template)
+    return template
+
+def plan_totals(plan):
+    """ Sum of the db hits and of the rows of the operators of a profiled plan (summary.profile, a dict) """
+    if plan is None:
+        return 0, 0
+    db_hits = plan.get("dbHits", 0) or 0
+    rows = plan.get("rows", 0) or 0
+    for child in plan.get("children", []) or []:
+        child_hits, child_rows = plan_totals(child)
+        db_hits += child_hits
+        rows += child_rows
+    return db_hits, rows
+
+class QueryStats:
+    """ The statistics of the queries of each template, shared by the sessions of a ProfilingDriver """
+
+    COLUMNS = ["calls", "records", "client_s", "available_after_ms", "consumed_after_ms", "db_hits", "rows", "errors"]
+
+    def __init__(self):
+        self.templates = {}
+        self.lock = threading.Lock()
+
+    def add(self, template, **values):
+        with self.lock:
+            row = self.templates.get(template)
+            if row is None:
+                row = self.templates[template] = dict.fromkeys(self.COLUMNS, 0)
+            row["calls"] += 1
+            for name, value in values.items():
+                row[name] += value or 0
+
+    def report(self):
+        """ The statistics of each template, the slowest on the client side first
+
+        Returns
+        -------
+        rows : Python list of dict
+            template, the columns of COLUMNS, server_s (time spent by the server) and other_s (time spent in the
+            network and in Python)
+        """
+        rows = []
+        with self.lock:
+            for template, row in self.templates.items():
+                row = dict(row, template=template)
+                row["server_s"] = (row["available_after_ms"] + row["consumed_after_ms"])/1000
+                row["other_s"] = max(row["client_s"] - row["server_s"], 0.0)
+                rows.append(row)
+        return sorted(rows, key=lambda row: -row["client_s"])
+
+    def print_report(self, n=20):
+        """ Prints the n templates with the most client time """
+        print("calls  records  client_s  server_s  other_s  db_hits  template")
+        for row in self.report()[:n]:
+            template = row["template"] if len(row["template"]) <= 100 else row["template"][:97]+"..."
+            print(str(row["calls"]).rjust(5), str(row["records"]).rjust(8), ("%.3f" % row["client_s"]).rjust(9),
+                  ("%.3f" % row["server_s"]).rjust(9), ("%.3f" % row["other_s"]).rjust(8), str(row["db_hits"]).rjust(8),
+                  " "+template)
+
+class ProfilingResult:
+    """ A result whose records are counted, its statistics are recorded once it is consumed """
+
+    def __init__(self, session, result, template, start):
+        self.session = session
+        self.result = result
+        self.template = template
+        self.start = start
+        self.records = 0
+        self.done = False
+
+    def __iter__(self):
+        try:
+            for record in self.result:
+                self.records += 1
+                yield record
+        finally:
+            self.finish()
+
+    def single(self, *args, **kwargs):
+        record = self.result.single(*args, **kwargs)
+        self.records += record is not None
+        self.finish()
+        return record
+
+    def data(self, *args, **kwargs):
+        data = self.result.data(*args, **kwargs)
+        self.records += len(data)
+        self.finish()
+        return data
+
+    def consume(self):
+        return self.finish()
+
+    def __getattr__(self, name):
+        return getattr(self.result, name)
+
+    def finish(self):
+        """ Consumes the rest of the result and records its statistics (once) """
+        summary = self.result.consume()
+        if self.done:
+            return summary
+        self.done = True
+
+        client_s = time.perf_counter() - self.start
+        db_hits, rows = plan_totals(getattr(summary, "profile", None))
+        self.session.driver.stats.add(self.template, records=self.records, client_s=client_s,
+                                      available_after_ms=getattr(summary, "result_available_after", 0),
+                                      consumed_after_ms=getattr(summary, "result_consumed_after", 0),
+                                      db_hits=db_hits, rows=rows)
+        return summary
+
+class ProfilingSession:
+    """ A session of a ProfilingDriver """
+
+    def __init__(self, driver, session):
+        self.driver = driver
+        self.session = session
+        self.last = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def run(self, query, parameters=None, **kwparameters):
+        # the driver consumes the previous result of a session when it runs the next query
+        if self.last is not None:
+            self.last.finish()
+
+        template = query_template(query)
+        if self.driver.plans and query.lstrip()[:8].upper() not in ("PROFILE ", "EXPLAIN "):
+            query = "PROFILE "+query
+
+        start = time.perf_counter()
+        try:
+            result = self.session.run(query, parameters, **kwparameters)
+        except Exception:
+            self.driver.stats.add(template, errors=1, client_s=time.perf_counter()-start)
+            raise
+        self.last = ProfilingResult(self, result, template, start)
+        return self.last
+
+    def close(self):
+        if self.last is not None:
+            self.last.finish()
+            self.last = None
+        self.session.close()
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+class ProfilingDriver:
+    """ A driver whose queries are profiled
+
+    Parameters
+    ----------
+    driver : GraphDatabase.driver object
+        The driver wrapped
+    plans : Boolean
+        Run the queries with PROFILE to get the db hits and rows of their plans
+        (PROFILE runs the query : the writes of a profiled write query are made)
+    stats : QueryStats
+        The statistics to add the queries to, a new one by default (to share it between two drivers)
+    """
+
+    def __init__(self, driver, plans=False, stats=None):
+        self.driver = driver
+        self.plans = plans
+        self.stats = stats if stats is not None else QueryStats()
+
+    def session(self, *args, **kwargs):
+        return ProfilingSession(self, self.driver.session(*args, **kwargs))
+
+    def close(self):
+        self.driver.close()
+
+    def __getattr__(self, name):
+        return getattr(self.driver, name)
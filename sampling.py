@@ -2,6 +2,7 @@
 
 ##### Imports
 import random
+import time
 from termcolor import colored
 
 def sampling(amount_dict,list_of_distinct_nodes, training_percentage):
@@ -61,10 +62,244 @@ def sampling(amount_dict,list_of_distinct_nodes, training_percentage):
 		print(colored("Unvalid training percentage, should be 80, 70 or 50.", "red"))
 
 	# training set with unique nodes
-	list_of_distinct_nodes = list(set(train))
+	list_of_distinct_nodes = list(dict.fromkeys(train))
 
 	# number of occurrences of the nodes in the training set
 	for node in list_of_distinct_nodes:
 	    amount_dict[node] = train.count(node)
 
-	return amount_dict,list_of_distinct_nodes,validate,test
\ No newline at end of file
+	return amount_dict,list_of_distinct_nodes,validate,test
+
+def nested_samples(amount_dict, list_of_distinct_nodes, fractions, seed=None):
+	""" Nested weighted samples of the nodes : each occurrence of a node is kept with the probability of the fraction,
+	and every occurrence of a sample is in the next ones
+
+	Parameters
+	----------
+	amount_dict : Python dict
+		A dictionary with node strings as keys and the number of occurrences of the node as a value
+		Its format is : {'Label1 Label2 Label3 prop1 prop2 prop3 ...': int, ...}
+	list_of_distinct_nodes : Python list
+		A list of node strings
+		Its format is : ['Label1 Label2 prop1', 'Label1 Label3 prop2', 'prop4 prop5', ...]
+	fractions : Python list
+		Increasing fractions of the occurrences, between 0 and 1
+		Its format is : [0.01, 0.02, 0.05, ...]
+	seed : Int
+		Seed of the samples, None to draw it from random
+
+	Returns
+	-------
+	samples : Python generator
+		The fraction, the number of occurrences and the distinct nodes of each sample
+		Its format is : (0.01, {'Label1 prop1': int, ...}, ['Label1 prop1', ...]), ...
+	"""
+	import numpy as np
+
+	rng = np.random.default_rng(seed if seed is not None else random.getrandbits(64))
+	counts = np.array([amount_dict[node] for node in list_of_distinct_nodes], dtype=np.int64)
+	taken = np.zeros(len(counts), dtype=np.int64)
+
+	# the occurrences not taken yet are kept with the probability to reach the next fraction (binomial thinning)
+	previous = 0.0
+	for fraction in fractions:
+		if fraction >= 1.0:
+			taken = counts.copy()
+		elif previous < 1.0:
+			taken = taken + rng.binomial(counts-taken, (fraction-previous)/(1.0-previous))
+		previous = fraction
+
+		sample_nodes = [node for node, k in zip(list_of_distinct_nodes, taken) if k > 0]
+		sample_dict = {node: int(k) for node, k in zip(list_of_distinct_nodes, taken) if k > 0}
+		yield fraction, sample_dict, sample_nodes
+
+def type_signatures(hierarchy_tree):
+	""" The signatures of the subtypes of each base type : the tokens all their members have and the tokens some
+	members have
+
+	Parameters
+	----------
+	hierarchy_tree : Python list
+		The hierarchy of each base type, as returned by iter_gmm
+
+	Returns
+	-------
+	signatures : Python dict
+		The signatures of the subtypes of each base type, by labels of the base type
+		Its format is : {('Label1',): [({'Label1', 'prop1'}, {'Label1', 'prop1', 'prop2'}), ...], ...}
+	"""
+	signatures = {}
+	for hierarchy in hierarchy_tree:
+		types = signatures.setdefault(tuple(sorted(hierarchy[0])), [])
+		stack = [child for child in hierarchy[1:] if child is not None]
+		while stack:
+			node = stack.pop()
+			tokens = [set(pattern.split(" ")) for pattern in node[0]]
+			if tokens != []:
+				types.append((set.intersection(*tokens), set.union(*tokens)))
+			stack.extend(child for child in node[1:] if child is not None)
+	return signatures
+
+def jaccard_similarity(a, b):
+	""" Jaccard index of two sets (1.0 for two empty sets) """
+	if not a and not b:
+		return 1.0
+	return len(a & b)/len(a | b)
+
+def hierarchy_similarity(a, b):
+	""" Similarity of two hierarchies from their type signatures, between 0 and 1
+
+	Each subtype is matched with the most similar subtype of the same base type in the other hierarchy (the mean of
+	the Jaccard indexes of their mandatory and of their optional tokens), the similarity is the mean of the best
+	matches of the subtypes of both hierarchies. Two runs of the clustering rarely cut a base type exactly at the same
+	place, this measure does not drop to 0 for a type whose members moved slightly.
+
+	Parameters
+	----------
+	a, b : Python dict
+		Type signatures, as returned by type_signatures
+
+	Returns
+	-------
+	similarity : Float
+	"""
+	scores = []
+	for first, second in ((a, b), (b, a)):
+		for base_type, types in first.items():
+			others = second.get(base_type, [])
+			for inter, union in types:
+				scores.append(max((jaccard_similarity(inter, other_inter)+jaccard_similarity(union, other_union))/2
+				                  for other_inter, other_union in others) if others else 0.0)
+	return sum(scores)/len(scores) if scores else 1.0
+
+def place_patterns(hierarchy_tree, patterns, distinct_labels):
+	""" Adds patterns that were not clustered to the hierarchies of their base types
+
+	In each base type whose labels a pattern has (no label at all for the unlabelled base type), the pattern goes down
+	to the subtype it conforms to (its tokens contain the mandatory tokens of the subtype and are among its tokens),
+	the most similar one when several do, and stops at the last subtype it conforms to. Under the base type, where
+	a pattern has to be placed in a subtype, it goes to the most similar subtype when it conforms to none.
+	The subtypes are summarized from their members when stored, so a placed pattern is valid against the schema.
+
+	Parameters
+	----------
+	hierarchy_tree : Python list
+		The hierarchy of each base type, as returned by iter_gmm, whose clusters are extended in place
+	patterns : Python list
+		The node strings to place
+		Its format is : ['Label1 Label2 prop1', 'Label1 Label3 prop2', 'prop4 prop5', ...]
+	distinct_labels : Python list
+		A list of labels
+		Its format is : ['Label1', 'Label2', 'Label3', ...]
+
+	Returns
+	-------
+	uncovered : Python list
+		The patterns whose base types have no subtype (they are in no type of the schema)
+	"""
+	labels_set = set(distinct_labels)
+
+	# signatures of the clusters as they were clustered, by id of hierarchy node
+	signatures = {}
+	def signature(node):
+		if id(node) not in signatures:
+			tokens = [set(pattern.split(" ")) for pattern in node[0]]
+			signatures[id(node)] = (set.intersection(*tokens), set.union(*tokens)) if tokens != [] else (set(), set())
+		return signatures[id(node)]
+
+	def score(tokens, node):
+		inter, union = signature(node)
+		return inter <= tokens <= union, (jaccard_similarity(inter, tokens)+jaccard_similarity(union, tokens))/2
+
+	uncovered = []
+	for pattern in patterns:
+		tokens = set(pattern.split(" "))
+		labels = tokens & labels_set
+		placed = False
+		for hierarchy in hierarchy_tree:
+			if not (hierarchy[0] <= labels if hierarchy[0] else labels == set()):
+				continue
+			children = [child for child in hierarchy[1:] if child is not None]
+			if children == []:
+				continue
+
+			# the first subtype is the most similar one, whether the pattern conforms to it or not
+			node = max(children, key=lambda child: score(tokens, child))
+			while True:
+				node[0].add(pattern)
+				conforming = [(similarity, i) for i, (conforms, similarity) in
+				              ((i, score(tokens, child)) for i, child in enumerate(node[1:], 1) if child is not None) if conforms]
+				if conforming == []:
+					break
+				node = node[max(conforming)[1]]
+			placed = True
+		if not placed:
+			uncovered.append(pattern)
+	return uncovered
+
+def progressive_sampling(amount_dict, list_of_distinct_nodes, distinct_labels, labs_sets,
+                         fractions=(0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0), tolerance=0.95, patience=1, seed=None,
+                         **options):
+	""" Clusters growing nested samples of the nodes until the hierarchy stops changing
+
+	Each round clusters a larger sample with iter_gmm and compares its types with the ones of the previous round
+	(see hierarchy_similarity). The rounds stop once the similarity is at least tolerance patience times in a row,
+	or when the last fraction is reached. The patterns that are in no sample are then placed in the hierarchy
+	(see place_patterns), so that the schema covers every pattern whose base type has subtypes.
+
+	Parameters
+	----------
+	amount_dict, list_of_distinct_nodes, distinct_labels, labs_sets :
+		As returned by preprocessing (or by sampling for the training set)
+	fractions : Python tuple
+		Increasing fractions of the occurrences of the nodes in the samples
+	tolerance : Float
+		Similarity between the types of two rounds from which the hierarchy is considered stable
+	patience : Int
+		Number of stable rounds in a row needed to stop
+	seed : Int
+		Seed of the samples, None to draw it from random
+	options :
+		Other parameters of iter_gmm (warm_start, share, fca_threshold, min_support, batch_threshold)
+
+	Returns
+	-------
+	amount_dict, list_of_distinct_nodes : The sample of the last round
+	all_clusters, hierarchy_tree : As returned by iter_gmm for the sample of the last round, with the patterns of
+		no sample placed in the clusters
+	rounds : Python list of dict
+		fraction, occurrences, patterns, types, similarity (with the previous round) and seconds of each round,
+		and for the last round placed_patterns and placed_occurrences (the patterns of no sample placed in the
+		hierarchy) and uncovered_patterns and uncovered_occurrences (the ones in no type)
+	"""
+	from GMM_clustering import iter_gmm
+
+	rounds = []
+	previous = None
+	stable = 0
+	for fraction, sample_dict, sample_nodes in nested_samples(amount_dict, list_of_distinct_nodes, fractions, seed):
+		t = time.perf_counter()
+		all_clusters, hierarchy_tree = iter_gmm(sample_dict, sample_nodes, distinct_labels, labs_sets, **options)
+		signatures = type_signatures(hierarchy_tree)
+
+		similarity = hierarchy_similarity(signatures, previous) if previous is not None else None
+		rounds.append({"fraction": fraction, "occurrences": sum(sample_dict.values()), "patterns": len(sample_nodes),
+		               "types": sum(len(types) for types in signatures.values()), "similarity": similarity, "seconds": time.perf_counter()-t})
+		print(colored("Sample of "+str(fraction*100)+"% : "+str(len(sample_nodes))+" patterns, "+str(rounds[-1]["types"])+
+		              " types"+("" if similarity is None else ", similarity "+str(round(similarity, 3)))+".", "green"))
+
+		stable = stable+1 if similarity is not None and similarity >= tolerance else 0
+		previous = signatures
+		if stable >= patience:
+			break
+
+	missing = [node for node in list_of_distinct_nodes if node not in sample_dict]
+	uncovered = place_patterns(hierarchy_tree, missing, distinct_labels)
+	rounds[-1].update(placed_patterns=len(missing)-len(uncovered),
+	                  placed_occurrences=sum(amount_dict[node] for node in missing)-sum(amount_dict[node] for node in uncovered),
+	                  uncovered_patterns=len(uncovered), uncovered_occurrences=sum(amount_dict[node] for node in uncovered))
+	if uncovered != []:
+		print(colored(str(len(uncovered))+" patterns ("+str(rounds[-1]["uncovered_occurrences"])+
+		              " occurrences) of no sample are in no type.", "yellow"))
+
+	return sample_dict, sample_nodes, all_clusters, hierarchy_tree, rounds
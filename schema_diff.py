@@ -0,0 +1,268 @@
+""" Content hashes of the inferred hierarchy and diff of two schema files
+
+Each type of a schema file gets :
+- an identity : a hash of its signature (labels, properties and datatypes), which does not depend on the T1, T2...
+  names that change from one run to another,
+- a Merkle hash : a hash of its signature and of the Merkle hashes of its subtypes.
+Two schemas are compared from their roots : identical subtrees have the same Merkle hash and are skipped, so the
+time spent comparing depends on the changed subtrees only.
+"""
+
+##### Imports
+import csv
+import hashlib
+
+class SchemaNode:
+    """ A type of a schema file
+
+    Parameters
+    ----------
+    row : Python list
+        The row of the type in the schema file
+    """
+
+    def __init__(self, row):
+        self.row_id = row[0]
+        self.name = row[4]
+        self.parent_id = row[3]
+        self.is_basetype = row[5] == "yes"
+
+        # the order of the labels and properties of a type does not matter
+        self.labels = sorted(token for token in row[1].split(":") if token != "")
+        self.properties = sorted(token for token in row[2].split(":") if token != "")
+
+        # datatypes of the properties (see property_stats), in the order of the properties column
+        self.datatypes = {}
+        if len(row) > 6 and row[6] != "":
+            for prop, types in zip(row[2].split(":"), row[6].split(":")):
+                self.datatypes[prop] = types
+
+        self.signature = ":".join(self.labels)+"|"+":".join(self.properties)+"|"+ \
+                         ":".join(prop+"="+self.datatypes[prop] for prop in sorted(self.datatypes))
+        self.identity = digest(self.signature)
+        self.hash = None
+        self.parent = None
+        self.children = []
+
+    def tokens(self):
+        """ Labels and properties of the type, without the optional marks """
+        return set(token.lstrip("?") for token in self.labels+self.properties)
+
+    def mandatory_labels(self):
+        return set(label for label in self.labels if not label.startswith("?"))
+
+    def path(self):
+        """ Identities of the ancestors of the type, from its base type """
+        path = []
+        node = self.parent
+        while node is not None:
+            path.append(node.identity)
+            node = node.parent
+        return path[::-1]
+
+    def describe(self):
+        return {"id": self.identity, "type": self.name, "labels": ":".join(self.labels),
+                "properties": ":".join(self.properties), "path": self.path()}
+
+    def subtree(self):
+        """ The type and all its subtypes """
+        nodes = [self]
+        for child in self.children:
+            nodes.extend(child.subtree())
+        return nodes
+
+def digest(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+def merkle_hash(node):
+    """ Computes the Merkle hashes of a node and of its subtree (the order of the children does not matter) """
+    for child in node.children:
+        merkle_hash(child)
+    node.hash = digest(node.signature+"/"+",".join(sorted(child.hash for child in node.children)))
+    return node.hash
+
+def read_hierarchy(file):
+    """ Reads a schema file written by storing into a hashed hierarchy
+
+    Parameters
+    ----------
+    file : String
+        Name of the schema file
+
+    Returns
+    -------
+    roots : Python list
+        The base types (and the types whose supertype is missing in the file) as SchemaNode objects
+    root_hash : String
+        The Merkle hash of the whole schema
+    """
+    nodes = {}
+    order = []
+    with open(file) as f:
+        reader = csv.reader(f, delimiter=',')
+        next(reader, None)
+        for row in reader:
+            if row == []:
+                continue
+            node = SchemaNode(row)
+            nodes[node.row_id] = node
+            order.append(node)
+
+    roots = []
+    for node in order:
+        parent = None if node.is_basetype else nodes.get(node.parent_id)
+        if parent is None:
+            roots.append(node)
+        else:
+            node.parent = parent
+            parent.children.append(node)
+
+    for root in roots:
+        merkle_hash(root)
+
+    # identities are unique within a schema : a repeated signature gets a suffix derived from the identity of its
+    # supertype and from the Merkle hash of its subtree, which do not depend on the order of the file
+    repeated = {}
+    for node in order:
+        repeated[node.identity] = repeated.get(node.identity, 0)+1
+    seen = set()
+    level = roots
+    while level:
+        for node in sorted(level, key=lambda node: node.hash):
+            if repeated[node.identity] > 1:
+                parent = node.parent.identity if node.parent is not None else ""
+                identity = node.identity+"-"+digest(parent+"/"+node.hash)[:8]
+
+                # the same type with the same subtree twice under the same supertype : both are alike
+                count = 1
+                while (identity if count == 1 else identity+"-"+str(count)) in seen:
+                    count += 1
+                node.identity = identity if count == 1 else identity+"-"+str(count)
+            seen.add(node.identity)
+        level = [child for node in level for child in node.children]
+
+    root_hash = digest(",".join(sorted(root.hash for root in roots)))
+
+    return roots, root_hash
+
+def schema_hash(file):
+    """ Merkle hash of a schema file, equal for two files describing the same hierarchy """
+    return read_hierarchy(file)[1]
+
+def jaccard(a, b):
+    if a == set() and b == set():
+        return 1.0
+    return len(a & b)/len(a | b)
+
+def match_children(before, after, diff, min_similarity):
+    """ Matches two lists of sibling types and recurses into the pairs whose subtrees differ
+
+    Parameters
+    ----------
+    before, after : Python list
+        Sibling SchemaNode objects of the old and of the new schema
+    diff : Python dict
+        The diff being built (see diff_schemas)
+    min_similarity : Float
+        Minimum Jaccard similarity of the labels and properties of two types to consider that one was changed into the other
+    """
+
+    # identical subtrees are skipped
+    by_hash = {}
+    for node in after:
+        by_hash.setdefault(node.hash, []).append(node)
+    left = []
+    for node in before:
+        same = by_hash.get(node.hash)
+        if same:
+            same.pop()
+            diff["unchanged"] += len(node.subtree())
+        else:
+            left.append(node)
+    right = [node for nodes in by_hash.values() for node in nodes]
+
+    # the same type, with changes in its subtypes
+    by_identity = {}
+    for node in right:
+        by_identity.setdefault(node.identity, []).append(node)
+    pairs = []
+    unmatched = []
+    for node in left:
+        same = by_identity.get(node.identity)
+        if same:
+            pairs.append((node, same.pop(), False))
+        else:
+            unmatched.append(node)
+    right = [node for nodes in by_identity.values() for node in nodes]
+
+    # a type whose labels or properties changed : the most similar type with the same mandatory labels
+    removed = []
+    for node in unmatched:
+        best = None
+        best_similarity = min_similarity
+        for candidate in right:
+            if candidate.mandatory_labels() != node.mandatory_labels():
+                continue
+            similarity = jaccard(node.tokens(), candidate.tokens())
+            if similarity >= best_similarity:
+                best, best_similarity = candidate, similarity
+        if best is None:
+            removed.append(node)
+        else:
+            right.remove(best)
+            pairs.append((node, best, True))
+
+    for node in removed:
+        diff["removed"].extend(n.describe() for n in node.subtree())
+    for node in right:
+        diff["added"].extend(n.describe() for n in node.subtree())
+
+    for old, new, changed in pairs:
+        if changed:
+            diff["changed"].append({"id": old.identity, "new_id": new.identity, "type": old.name, "new_type": new.name,
+                                    "before": old.describe(), "after": new.describe()})
+        else:
+            diff["unchanged"] += 1
+        match_children(old.children, new.children, diff, min_similarity)
+
+def diff_schemas(old_file, new_file, min_similarity=0.5):
+    """ Compares two schema files
+
+    Parameters
+    ----------
+    old_file, new_file : String
+        Names of the schema files written by storing
+    min_similarity : Float
+        Minimum Jaccard similarity of the labels and properties of two types to report one as a change of the other
+        (instead of a removed and an added type)
+
+    Returns
+    -------
+    diff : Python dict
+        added, removed : descriptions of the added and removed types (id, type, labels, properties, path of ids)
+        changed : the types whose labels or properties changed, with their description before and after
+        unchanged : number of types found in both schemas
+        old_hash, new_hash : Merkle hashes of the schemas
+    """
+    old_roots, old_hash = read_hierarchy(old_file)
+    new_roots, new_hash = read_hierarchy(new_file)
+
+    diff = {"added": [], "removed": [], "changed": [], "unchanged": 0, "old_hash": old_hash, "new_hash": new_hash}
+    if old_hash == new_hash:
+        diff["unchanged"] = sum(len(root.subtree()) for root in old_roots)
+        return diff
+
+    match_children(old_roots, new_roots, diff, min_similarity)
+    return diff
+
+def print_diff(diff):
+    """ Prints a diff returned by diff_schemas """
+    for description in diff["removed"]:
+        print("- "+description["id"]+" "+description["labels"]+" "+description["properties"])
+    for description in diff["added"]:
+        print("+ "+description["id"]+" "+description["labels"]+" "+description["properties"])
+    for change in diff["changed"]:
+        before, after = change["before"], change["after"]
+        print("~ "+change["id"]+" "+before["labels"]+" "+before["properties"]+" -> "+after["labels"]+" "+after["properties"])
+    print(len(diff["removed"]), "removed,", len(diff["added"]), "added,", len(diff["changed"]), "changed,",
+          diff["unchanged"], "unchanged")
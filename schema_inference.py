@@ -0,0 +1,128 @@
+""" Library entry point : steps 1 to 3 without prompts """
+
+##### Imports
+import random
+import time
+
+### File imports (each step imports its heavy dependencies when it runs)
+import tracing
+from preprocessing_step import preprocessing, preprocessing_with_stats
+from profile_cache import cached_preprocessing
+from server_metadata import metadata_preprocessing
+from sampling import sampling, progressive_sampling
+from GMM_clustering import iter_gmm
+from storing import storing
+
+def infer_schema(driver=None, profile=None, training_percentage=None, file="data.csv", database=None, seed=None,
+                 warm_start=False, property_stats=False, cache=None, cache_key=None, fca_threshold=None, min_support=0.01,
+                 metadata=False, batch_threshold=None, progressive=False, tolerance=0.95, share=False):
+    """ Infers the schema of a PG and writes it into a file
+
+    Parameters
+    ----------
+    driver : GraphDatabase.driver object
+        Driver used to access the PG stored in a Neo4j database (not needed when profile is given)
+    profile : Python tuple
+        amount_dict, list_of_distinct_nodes, distinct_labels, labs_sets as returned by preprocessing
+        (and key_stats as returned by preprocessing_with_stats), to skip step 1
+    training_percentage : Int
+        80, 70 or 50 to cluster a training set as cluster_script does, None to cluster all nodes
+    file : String
+        Name of the file the schema is written into
+    database : String
+        Name of the database to query, None for the default database of the server
+    seed : Int
+        Seed of the sampling and of the clustering, None for a random one
+    warm_start : Boolean
+        Start the model of each subcluster from its parent's component (see iter_gmm)
+    property_stats : Boolean
+        Collect statistics on the property values while profiling and write the datatypes of the properties
+        of each type into the file
+    cache : ProfileCache
+        Cache of the profiles, step 1 is skipped when it has the profile of the database as it is now
+    cache_key : String
+        Name of the database in the cache (its uri and name for instance), the name of the database by default
+    fca_threshold : Int
+        Cluster the base types with at most fca_threshold distinct nodes with their formal concepts (see iter_gmm)
+    min_support : Float
+        Minimum share of the occurrences of a base type in one of its concepts
+    metadata : Boolean
+        Read the labels, their counts and the sets of labels from the metadata of the server instead of scanning the
+        nodes (see metadata_preprocessing), when the profile is neither cached nor collected with property_stats
+    batch_threshold : Int
+        Build the hierarchies level by level, fitting together the splits of at most batch_threshold distinct nodes
+        (see iter_gmm)
+    progressive : Boolean
+        Cluster growing samples of the nodes (of the training set with training_percentage) until the hierarchy
+        stops changing (see progressive_sampling), instead of all of them
+    tolerance : Float
+        Similarity between the hierarchies of two samples from which progressive stops
+    share : Boolean
+        Share the similarities, reference nodes and splits between overlapping base types (see iter_gmm)
+
+    Returns
+    -------
+    result : Python dict
+        file : the name of the schema file
+        distinct_labels, labs_sets : as returned by preprocessing
+        hierarchy_tree, all_clusters : as returned by iter_gmm
+        validate, test : the validation and test sets (None without sampling)
+        key_stats : the statistics of the properties of each node string (None without property_stats)
+        rounds : the samples clustered by progressive_sampling, with the patterns of no sample placed in the hierarchy
+        and the ones left in no type counted in the last round (None without progressive)
+        timings : the time spent in each step, in seconds
+    """
+    if seed is not None:
+        # the Bayesian mixtures of step 2 draw from the global generator of numpy
+        import numpy as np
+        random.seed(seed)
+        np.random.seed(seed)
+
+    timings = {}
+
+    t = time.perf_counter()
+    if profile is None:
+        with tracing.span("preprocessing"):
+            if cache is not None:
+                key = cache_key if cache_key is not None else str(database)
+                profile = cached_preprocessing(driver, key, database, cache, property_stats=property_stats)
+            elif property_stats:
+                profile = preprocessing_with_stats(driver, database)
+            elif metadata:
+                profile = metadata_preprocessing(driver, database)
+            else:
+                profile = preprocessing(driver, database)
+    timings["preprocessing"] = time.perf_counter() - t
+
+    amount_dict, list_of_distinct_nodes, distinct_labels, labs_sets = profile[:4]
+    key_stats = profile[4] if len(profile) > 4 else None
+    validate = test = None
+
+    t = time.perf_counter()
+    if training_percentage is not None:
+        with tracing.span("sampling"):
+            amount_dict, list_of_distinct_nodes, validate, test = sampling(dict(amount_dict), list_of_distinct_nodes, training_percentage)
+    timings["sampling"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    rounds = None
+    with tracing.span("clustering"):
+        if progressive:
+            amount_dict, list_of_distinct_nodes, all_clusters, hierarchy_tree, rounds = progressive_sampling(
+                amount_dict, list_of_distinct_nodes, distinct_labels, labs_sets, tolerance=tolerance, seed=seed,
+                warm_start=warm_start, share=share, fca_threshold=fca_threshold, min_support=min_support,
+                batch_threshold=batch_threshold)
+        else:
+            all_clusters, hierarchy_tree = iter_gmm(amount_dict, list_of_distinct_nodes, distinct_labels, labs_sets, warm_start,
+                                                    share=share, fca_threshold=fca_threshold, min_support=min_support,
+                                                    batch_threshold=batch_threshold)
+    timings["clustering"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    with tracing.span("storing"):
+        file = storing(distinct_labels, labs_sets, hierarchy_tree, file, key_stats, disjoint_subtypes=fca_threshold is None)
+    timings["storing"] = time.perf_counter() - t
+
+    return {"file": file, "distinct_labels": distinct_labels, "labs_sets": labs_sets,
+            "hierarchy_tree": hierarchy_tree, "all_clusters": all_clusters,
+            "validate": validate, "test": test, "key_stats": key_stats, "rounds": rounds, "timings": timings}
@@ -0,0 +1,384 @@
+""" Schema service : classifies and validates nodes against a schema file kept in memory
+
+The schema file written by storing is compiled once into bitsets : each type gets the bitset of its mandatory labels
+and properties and the bitset of every label and property it allows (its subtypes' included). A node is classified
+by going down from its base type to the deepest type it conforms to, the base type being the one with the most
+labels among the ones whose mandatory labels the node has. A node conforms to a type when it has all its mandatory
+labels and properties and no label or property the type does not allow. The properties of a base type row are the
+ones shared by the first member of each of its subtypes (see storing) : the mandatory properties of a base type are
+the ones mandatory in all its subtypes instead.
+A node is valid when it conforms to its base type.
+The results are cached by set of labels and properties, the nodes of a database having few distinct shapes.
+
+SchemaService answers batches of nodes over HTTP (POST /classify, POST /validate, GET /health) or over a Unix socket
+(one json request per line). It reloads the schema when its file changes : the new file is compiled once it has not
+changed for one reload interval, the requests are served by the previous schema until then.
+"""
+
+##### Imports
+import json
+import os
+import threading
+from termcolor import colored
+
+### File imports
+from schema_diff import read_hierarchy
+
+class CompiledSchema:
+    """ The types of a schema file as bitsets
+
+    Parameters
+    ----------
+    file : String
+        Name of the schema file, as written by storing
+    cache_size : Int
+        Number of distinct shapes of nodes whose results are kept
+    """
+
+    def __init__(self, file, cache_size=100000):
+        self.file = file
+        self.cache_size = cache_size
+        self.roots, self.hash = read_hierarchy(file)
+
+        # bit of each label and property : a label and a property may have the same name
+        self.bits = {}
+        self.tokens = []
+        self.label_mask = 0
+        self.types = []
+        for root in self.roots:
+            for node in root.subtree():
+                self.types.append(node)
+                for token in node.labels:
+                    self.bit("label", token.lstrip("?"))
+                for token in node.properties:
+                    self.bit("property", token.lstrip("?"))
+
+        for node in self.types:
+            properties = [] if node.is_basetype else node.properties
+            node.mandatory = self.mask([label for label in node.labels if not label.startswith("?")],
+                                       [prop for prop in properties if not prop.startswith("?")])
+            node.mandatory_labels = node.mandatory & self.label_mask
+        for node in self.types:
+            if node.is_basetype and node.children != []:
+                shared = -1
+                for child in node.children:
+                    shared &= child.mandatory
+                node.mandatory |= shared & ~self.label_mask
+        for root in self.roots:
+            self.allowed(root)
+
+        # children tried first : the ones with the most mandatory labels and properties
+        for node in self.types:
+            node.children.sort(key=lambda child: -bin(child.mandatory).count("1"))
+
+        self.results = {}
+        self.lock = threading.Lock()
+
+    def bit(self, kind, token):
+        key = (kind, token)
+        if key not in self.bits:
+            self.bits[key] = len(self.bits)
+            self.tokens.append(token)
+            if kind == "label":
+                self.label_mask |= 1 << self.bits[key]
+        return self.bits[key]
+
+    def mask(self, labels, keys):
+        """ Bitset of a set of labels and properties, the ones missing in the schema are left out """
+        mask = 0
+        for kind, tokens in (("label", labels), ("property", keys)):
+            for token in tokens:
+                bit = self.bits.get((kind, token))
+                if bit is not None:
+                    mask |= 1 << bit
+        return mask
+
+    def allowed(self, node):
+        """ Sets node.allowed : the labels and properties of the type and of its subtypes """
+        node.allowed = self.mask([label.lstrip("?") for label in node.labels], [prop.lstrip("?") for prop in node.properties])
+        for child in node.children:
+            node.allowed |= self.allowed(child)
+        return node.allowed
+
+    def allows(self, node, kind, token):
+        """ Whether a type or one of its subtypes has a label or a property """
+        bit = self.bits.get((kind, token))
+        return bit is not None and node.allowed >> bit & 1 == 1
+
+    def conforms(self, node, mask):
+        return node.mandatory & mask == node.mandatory and mask & ~node.allowed == 0
+
+    def names(self, mask):
+        """ Sorted tokens of a bitset """
+        return sorted(self.tokens[i] for i, bit in enumerate(bin(mask)[:1:-1]) if bit == "1")
+
+    def base_type(self, mask):
+        """ The base type of a node : the most labels among the types whose mandatory labels it has """
+        best = None
+        for root in self.roots:
+            if root.mandatory_labels & mask == root.mandatory_labels:
+                # a type the node conforms to is preferred
+                rank = (self.conforms(root, mask), bin(root.mandatory_labels).count("1"))
+                if best is None or rank > best[0]:
+                    best = (rank, root)
+        return best[1] if best is not None else None
+
+    def classify_one(self, labels, keys):
+        """ The type of a node, and the result of its validation
+
+        Parameters
+        ----------
+        labels : Python list
+            The labels of the node
+        keys : Python list
+            The properties of the node
+
+        Returns
+        -------
+        result : Python dict
+            id, type : row id and name of the deepest type the node conforms to (None if it conforms to no type)
+            base_type : row id of its base type (None if no base type has its labels)
+            path : row ids from the base type to the type
+            valid : whether the node conforms to its base type
+            unknown_labels, unknown_properties : the labels and properties its base type does not allow
+            missing_properties : the mandatory properties of its base type it does not have
+        """
+        key = (frozenset(labels), frozenset(keys))
+        result = self.results.get(key)
+        if result is not None:
+            return result
+
+        mask = self.mask(labels, keys)
+        root = self.base_type(mask)
+
+        result = {"id": None, "type": None, "base_type": None, "path": [], "valid": False,
+                  "unknown_labels": sorted(labels), "unknown_properties": sorted(keys), "missing_properties": []}
+        if root is not None:
+            result["base_type"] = root.row_id
+            result["unknown_labels"] = [label for label in sorted(labels) if not self.allows(root, "label", label)]
+            result["unknown_properties"] = [prop for prop in sorted(keys) if not self.allows(root, "property", prop)]
+            unknown = len(set(labels)) + len(set(keys)) != bin(mask).count("1")
+
+            # down from the base type, to the deepest type the node conforms to
+            node = root
+            path = []
+            if self.conforms(root, mask) and not unknown:
+                path.append(root)
+                while True:
+                    for child in node.children:
+                        if self.conforms(child, mask):
+                            node = child
+                            path.append(child)
+                            break
+                    else:
+                        break
+
+            if path != []:
+                result["id"], result["type"] = node.row_id, node.name
+                result["path"] = [step.row_id for step in path]
+            result["valid"] = path != []
+            result["missing_properties"] = self.names(root.mandatory & ~mask & ~self.label_mask)
+
+        with self.lock:
+            if len(self.results) >= self.cache_size:
+                self.results.clear()
+            self.results[key] = result
+        return result
+
+    def classify(self, nodes):
+        """ classify_one for a batch of nodes
+
+        Parameters
+        ----------
+        nodes : Python list of dicts
+            Its format is : [{'labels': ['Label1', 'Label2'], 'keys': ['prop1', 'prop2']}, ...]
+
+        Returns
+        -------
+        results : Python list of dicts
+            The result of each node, as returned by classify_one
+        """
+        return [self.classify_one(node.get("labels", []), node.get("keys", [])) for node in nodes]
+
+def file_stamp(file):
+    """ Modification time and size of a file, None if it does not exist """
+    try:
+        stat = os.stat(file)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+class SchemaService:
+    """ A compiled schema, reloaded when its file changes
+
+    Parameters
+    ----------
+    file : String
+        Name of the schema file, as written by storing
+    reload_interval : Float
+        Seconds between two checks of the file, None to never reload it
+    cache_size : Int
+        Number of distinct shapes of nodes whose results are kept
+    """
+
+    def __init__(self, file, reload_interval=1.0, cache_size=100000):
+        self.file = file
+        self.reload_interval = reload_interval
+        self.cache_size = cache_size
+        self.stamp = file_stamp(file)
+        self.schema = CompiledSchema(file, cache_size)
+        self.reloads = 0
+
+        # stamp of the file seen at the previous check, the file is reloaded once it stops changing
+        self.seen = self.stamp
+        self.stopped = threading.Event()
+        self.watcher = None
+
+    def check(self):
+        """ Reloads the schema if its file changed and did not change since the previous check
+
+        Returns
+        -------
+        reloaded : Boolean
+        """
+        stamp = file_stamp(self.file)
+        stable = stamp == self.seen
+        self.seen = stamp
+        if stamp is None or stamp == self.stamp or not stable:
+            return False
+
+        try:
+            schema = CompiledSchema(self.file, self.cache_size)
+        except (OSError, ValueError, IndexError) as e:
+            print(colored("Could not reload "+self.file+": "+str(e), "red"))
+            return False
+
+        # the requests running keep the schema they started with
+        self.schema = schema
+        self.stamp = stamp
+        self.reloads += 1
+        print(colored("Reloaded "+self.file+" ("+str(len(schema.types))+" types).", "green"))
+        return True
+
+    def watch(self):
+        while not self.stopped.wait(self.reload_interval):
+            self.check()
+
+    def start(self):
+        if self.reload_interval is not None and self.watcher is None:
+            self.watcher = threading.Thread(target=self.watch, daemon=True)
+            self.watcher.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def health(self):
+        schema = self.schema
+        return {"file": self.file, "hash": schema.hash, "types": len(schema.types), "reloads": self.reloads,
+                "cached": len(schema.results)}
+
+    def handle(self, request):
+        """ Answers a request : {'op': 'classify' or 'validate' or 'health', 'nodes': [...]}
+
+        validate returns the same results as classify, the server only differs by the route
+        """
+        op = request.get("op", "classify")
+        if op == "health":
+            return self.health()
+        if op not in ("classify", "validate"):
+            raise ValueError("Unknown operation "+str(op))
+        results = self.schema.classify(request.get("nodes", []))
+        if op == "validate":
+            results = [{name: result[name] for name in ("id", "base_type", "valid", "unknown_labels",
+                                                        "unknown_properties", "missing_properties")}
+                       for result in results]
+        return {"results": results}
+
+def http_server(service, host="127.0.0.1", port=7475):
+    """ An HTTP server answering POST /classify, POST /validate (body : {'nodes': [...]}) and GET /health """
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def reply(self, code, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self.reply(200, service.health())
+            else:
+                self.reply(404, {"error": "unknown path "+self.path})
+
+        def do_POST(self):
+            op = self.path.strip("/")
+            if op not in ("classify", "validate"):
+                self.reply(404, {"error": "unknown path "+self.path})
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                request["op"] = op
+                self.reply(200, service.handle(request))
+            except (ValueError, AttributeError, TypeError) as e:
+                self.reply(400, {"error": str(e)})
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+def unix_server(service, path):
+    """ A server answering one json request per line on a Unix socket (see SchemaService.handle) """
+    import socketserver
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                if line.strip() == b"":
+                    continue
+                try:
+                    response = service.handle(json.loads(line))
+                except (ValueError, AttributeError, TypeError) as e:
+                    response = {"error": str(e)}
+                self.wfile.write(json.dumps(response).encode("utf-8")+b"\n")
+                self.wfile.flush()
+
+    if os.path.exists(path):
+        os.remove(path)
+    server = socketserver.ThreadingUnixStreamServer(path, Handler)
+    server.daemon_threads = True
+    return server
+
+def serve(file, host="127.0.0.1", port=7475, socket_path=None, reload_interval=1.0):
+    """ Serves a schema file until interrupted
+
+    Parameters
+    ----------
+    file : String
+        Name of the schema file, as written by storing
+    host, port :
+        Address of the HTTP server
+    socket_path : String
+        Path of a Unix socket to serve instead of HTTP
+    reload_interval : Float
+        Seconds between two checks of the file, None to never reload it
+    """
+    service = SchemaService(file, reload_interval).start()
+    server = unix_server(service, socket_path) if socket_path is not None else http_server(service, host, port)
+    address = socket_path if socket_path is not None else "http://"+host+":"+str(server.server_address[1])
+    print(colored("Serving "+file+" on "+address+" ("+str(len(service.schema.types))+" types).", "green"))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
@@ -0,0 +1,217 @@
+""" Step 1 from the metadata of the server : labels, label counts and node types instead of full scans
+
+The labels come from db.labels() and the count store (MATCH (n:Label) RETURN count(n) does not read any node), the
+sets of labels from db.schema.nodeTypeProperties(). The patterns of each set of labels are then counted by a
+label-scoped query, except for a set made of a single label found in no other set whose properties are all mandatory :
+its only pattern and its count are known from the metadata. The unlabelled nodes are only scanned when the count store
+says there are some.
+What the server cannot give (procedure missing or not allowed) is read by the scans of preprocessing instead.
+A probe of the version and of the procedures of the server tells what can be used, from Neo4j 3.5 to 5.x.
+"""
+
+##### Imports
+from termcolor import colored
+
+### File imports
+from preprocessing_step import LABELS_QUERY, LABEL_SETS_QUERY, label_set_query
+
+### Queries of the probe
+COMPONENTS_QUERY = "CALL dbms.components() YIELD name, versions, edition RETURN name, versions, edition"
+
+# dbms.procedures() was removed in Neo4j 5, SHOW PROCEDURES exists since Neo4j 4.3
+PROCEDURES_QUERIES = ["SHOW PROCEDURES YIELD name RETURN name",
+                      "CALL dbms.procedures() YIELD name RETURN name"]
+
+### Queries of the metadata
+DB_LABELS_QUERY = "CALL db.labels() YIELD label RETURN label"
+
+NODE_TYPE_PROPERTIES_QUERY = "CALL db.schema.nodeTypeProperties() YIELD nodeLabels, propertyName, mandatory \
+            RETURN nodeLabels, propertyName, mandatory"
+
+NODE_COUNT_QUERY = "MATCH (n) RETURN count(n) AS count"
+
+### First version of the server with each procedure, when the procedures cannot be listed
+MINIMUM_VERSIONS = {"db.labels": (3, 0), "db.schema.nodeTypeProperties": (3, 5)}
+
+def label_count_query(label):
+    """ Builds a query answered by the count store : the number of nodes with a label """
+    return "MATCH (n:`"+label.replace("`","``")+"`) RETURN count(n) AS count"
+
+def parse_version(text):
+    """ Reads a version such as '4.4.12' or '5.13.0-aura' into a tuple of ints """
+    numbers = []
+    for part in text.split("-")[0].split("."):
+        if not part.isdigit():
+            break
+        numbers.append(int(part))
+    return tuple(numbers)
+
+def probe_capabilities(driver, database=None):
+    """ Finds what the server can tell about the graph without scanning it
+
+    Each query of the probe runs in its own session, a failure (procedure missing or not allowed) does not stop the
+    probe.
+
+    Parameters
+    ----------
+    driver : GraphDatabase.driver object
+        Driver used to access the PG stored in a Neo4j database.
+    database : String
+        Name of the database, None for the default database of the server.
+
+    Returns
+    -------
+    capabilities : Python dict
+        version : the version of the server as a tuple of ints (None if unknown)
+        edition : community or enterprise (None if unknown)
+        procedures : the names of the procedures the user can call (None if they cannot be listed)
+        db_labels, node_type_properties : whether db.labels() and db.schema.nodeTypeProperties() can be used
+    """
+    capabilities = {"version": None, "edition": None, "procedures": None}
+
+    try:
+        with driver.session(database=database) as session:
+            for record in session.run(COMPONENTS_QUERY):
+                if record["name"] == "Neo4j Kernel":
+                    capabilities["version"] = parse_version(record["versions"][0])
+                    capabilities["edition"] = record["edition"]
+    except Exception:
+        pass
+
+    for query in PROCEDURES_QUERIES:
+        try:
+            with driver.session(database=database) as session:
+                capabilities["procedures"] = set(record["name"] for record in session.run(query))
+            break
+        except Exception:
+            continue
+
+    for key, procedure in (("db_labels", "db.labels"), ("node_type_properties", "db.schema.nodeTypeProperties")):
+        if capabilities["procedures"] is not None:
+            capabilities[key] = procedure in capabilities["procedures"]
+        else:
+            # without the list of procedures, the version tells whether they exist
+            version = capabilities["version"]
+            capabilities[key] = version is not None and version >= MINIMUM_VERSIONS[procedure]
+
+    return capabilities
+
+def run_or_none(driver, query, database=None):
+    """ The records of a query, None if the server refuses it """
+    try:
+        with driver.session(database=database) as session:
+            return list(session.run(query))
+    except Exception:
+        return None
+
+def metadata_preprocessing(driver, database=None, capabilities=None):
+    """ preprocessing reading the metadata of the server where it can, and scanning only what it cannot give
+
+    Parameters
+    ----------
+    driver : GraphDatabase.driver object
+        Driver used to access the PG stored in a Neo4j database.
+    database : String
+        Name of the database to query, None for the default database of the server.
+    capabilities : Python dict
+        As returned by probe_capabilities, the server is probed when None
+
+    Returns
+    -------
+    amount_dict, list_of_distinct_nodes, distinct_labels, labs_sets :
+        As returned by preprocessing
+    """
+    if capabilities is None:
+        capabilities = probe_capabilities(driver, database)
+
+    print(colored("Querying neo4j to get all distinct labels and their counts:", "yellow"))
+    labels = None
+    if capabilities["db_labels"]:
+        records = run_or_none(driver, DB_LABELS_QUERY, database)
+        if records is not None:
+            labels = [record["label"] for record in records]
+    if labels is None:
+        with driver.session(database=database) as session:
+            labels = [record["lab"] for record in session.run(LABELS_QUERY)]
+
+    # db.labels() also returns the labels of deleted nodes : the count store tells which ones are used
+    label_counts = {}
+    with driver.session(database=database) as session:
+        for label in labels:
+            label_counts[label] = session.run(label_count_query(label)).single()["count"]
+        total = session.run(NODE_COUNT_QUERY).single()["count"]
+    distinct_labels = [label for label in labels if label_counts[label] > 0]
+    print(colored("Done.", "green"))
+
+    print(colored("Querying neo4j to get all distinct sets of labels:", "yellow"))
+    properties = None
+    if capabilities["node_type_properties"]:
+        records = run_or_none(driver, NODE_TYPE_PROPERTIES_QUERY, database)
+        if records is not None:
+            # properties of each set of labels, and whether each one is mandatory
+            properties = {}
+            for record in records:
+                lab_set = tuple(sorted(record["nodeLabels"] or []))
+                props = properties.setdefault(lab_set, {})
+                if record["propertyName"] is not None:
+                    props[record["propertyName"]] = bool(record["mandatory"])
+            labs_sets = [list(lab_set) for lab_set in properties]
+    if properties is None:
+        with driver.session(database=database) as session:
+            labs_sets = [record["LABELS(n)"] for record in session.run(LABEL_SETS_QUERY)]
+    print(colored("Done.", "green"))
+
+    print(colored("Querying neo4j to get the sets of props of each set of labels:", "yellow"))
+    scanned_sets = []
+    for lab_set in labs_sets:
+        if sorted(lab_set) not in scanned_sets:
+            scanned_sets.append(sorted(lab_set))
+
+    # number of sets of labels each label is in
+    occurrences = {}
+    for lab_set in scanned_sets:
+        for label in lab_set:
+            occurrences[label] = occurrences.get(label, 0) + 1
+
+    amount_dict = {}
+    list_of_distinct_nodes = []
+    labelled = 0
+    known = 0
+
+    def add(labels_properties_str, count):
+        if labels_properties_str in amount_dict:
+            amount_dict[labels_properties_str] += count
+        else:
+            list_of_distinct_nodes.append(labels_properties_str)
+            amount_dict[labels_properties_str] = count
+
+    with driver.session(database=database) as session:
+        for lab_set in scanned_sets:
+            if lab_set == []:
+                continue
+
+            # a single label in no other set, with mandatory properties only : one pattern counted by the count store
+            props = properties.get(tuple(lab_set)) if properties is not None else None
+            if len(lab_set) == 1 and occurrences[lab_set[0]] == 1 and props is not None and all(props.values()):
+                count = label_counts.get(lab_set[0], 0)
+                if count > 0:
+                    add(' '.join(lab_set+sorted(props)), count)
+                labelled += count
+                known += 1
+                continue
+
+            for record in session.run(label_set_query(lab_set)):
+                add(' '.join(lab_set+sorted(record["keys"])), record["count"])
+                labelled += record["count"]
+
+        # the unlabelled nodes are the ones the label sets do not count
+        if total > labelled:
+            for record in session.run(label_set_query([])):
+                add(' '.join(sorted(record["keys"])), record["count"])
+            if [] not in labs_sets:
+                labs_sets.append([])
+        elif [] in labs_sets:
+            labs_sets.remove([])
+    print(colored("Done. "+str(known)+" of "+str(len(scanned_sets))+" sets of labels read from the metadata.", "green"))
+
+    return amount_dict,list_of_distinct_nodes,distinct_labels,labs_sets
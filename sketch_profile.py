@@ -0,0 +1,369 @@
+""" A mergeable profile in a bounded memory, for graphs scanned in several parts
+
+Each part of a graph (a shard of a fabric database, a JSONL export...) is profiled independently into a
+SketchProfile, and the sketches are merged in any order. The merged sketch gives a profile that iter_gmm uses unchanged.
+
+A sketch keeps :
+- the most frequent patterns with their counts (SpaceSaving, with a bounded table),
+- a Count-Min sketch of the counts of every pattern, to bound the counts of the table and estimate the tail,
+- HyperLogLogs of the number of distinct patterns, overall and with each label and each property,
+- the exact number of nodes with each label and property, and the sets of labels (they are few).
+"""
+
+##### Imports
+import base64
+import hashlib
+import heapq
+import json
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from termcolor import colored
+
+### File imports
+from property_stats import HyperLogLog
+
+class SketchProfile:
+    """ Profile of a graph (or of a part of a graph) in a bounded memory
+
+    Parameters
+    ----------
+    capacity : Int
+        Number of patterns kept with their counts, the patterns seen less often are only counted in the Count-Min sketch
+    width, depth : Int
+        Size of the Count-Min sketch : the count of a pattern is overestimated by at most 2.7*nodes/width
+        with probability 1-exp(-depth)
+    precision : Int
+        Precision of the HyperLogLogs
+    """
+
+    def __init__(self, capacity=100000, width=1 << 16, depth=4, precision=10):
+        self.capacity = capacity
+        self.width = width
+        self.depth = depth
+        self.precision = precision
+
+        # SpaceSaving table : pattern string -> [count, overestimation]
+        self.table = {}
+        # min-heap of (count, pattern) to find the least counted pattern, with outdated entries skipped
+        self.heap = []
+        self.sketch = [array("q", bytes(8*width)) for _ in range(depth)]
+        self.patterns = HyperLogLog(precision)
+        self.label_patterns = {}
+        self.key_patterns = {}
+
+        self.nodes = 0
+        self.label_counts = {}
+        self.key_counts = {}
+        self.labs_sets = []
+
+    def add(self, labels, keys, count=1):
+        """ Counts count nodes with these labels and properties """
+        labels = sorted(labels)
+        keys = sorted(keys)
+        node = ' '.join(labels+keys)
+
+        if labels not in self.labs_sets:
+            self.labs_sets.append(labels)
+        self.nodes += count
+        for label in labels:
+            self.label_counts[label] = self.label_counts.get(label, 0) + count
+        for key in keys:
+            self.key_counts[key] = self.key_counts.get(key, 0) + count
+
+        h = pattern_hash(node)
+        self.patterns.add_hash(h >> 64)
+        for label in labels:
+            self.cardinality(self.label_patterns, label).add_hash(h >> 64)
+        for key in keys:
+            self.cardinality(self.key_patterns, key).add_hash(h >> 64)
+
+        for row, column in enumerate(self.columns(h)):
+            self.sketch[row][column] += count
+
+        self.count(node, count)
+
+    def cardinality(self, sketches, name):
+        if name not in sketches:
+            sketches[name] = HyperLogLog(self.precision)
+        return sketches[name]
+
+    def columns(self, h):
+        """ Column of a pattern in each row of the Count-Min sketch (double hashing) """
+        h1 = h & 0xFFFFFFFFFFFFFFFF
+        h2 = (h >> 64) | 1
+        return [(h1 + row*h2) % self.width for row in range(self.depth)]
+
+    def count(self, node, count):
+        """ SpaceSaving update : the least counted pattern is replaced when the table is full """
+        entry = self.table.get(node)
+        if entry is not None:
+            entry[0] += count
+        elif len(self.table) < self.capacity:
+            entry = self.table[node] = [count, 0]
+        else:
+            # the new pattern may have been counted up to the count of the pattern it replaces
+            minimum = self.pop_smallest()
+            entry = self.table[node] = [minimum+count, minimum]
+
+        heapq.heappush(self.heap, (entry[0], node))
+        if len(self.heap) > 4*self.capacity:
+            self.heap = [(entry[0], pattern) for pattern, entry in self.table.items()]
+            heapq.heapify(self.heap)
+
+    def pop_smallest(self):
+        """ Removes the least counted pattern from the table and returns its count """
+        while True:
+            count, node = heapq.heappop(self.heap)
+            entry = self.table.get(node)
+            if entry is not None and entry[0] == count:
+                del self.table[node]
+                return count
+
+    def estimate(self, node):
+        """ Upper bound of the number of nodes of a pattern """
+        h = pattern_hash(node)
+        estimate = min(self.sketch[row][column] for row, column in enumerate(self.columns(h)))
+        entry = self.table.get(node)
+        if entry is not None:
+            estimate = min(estimate, entry[0])
+        return estimate
+
+    def merge(self, other):
+        """ Adds the nodes profiled by another sketch of the same size
+
+        Parameters
+        ----------
+        other : SketchProfile
+
+        Returns
+        -------
+        self : SketchProfile
+        """
+        if (self.width, self.depth, self.precision) != (other.width, other.depth, other.precision):
+            raise ValueError("Sketches of different sizes cannot be merged")
+
+        # a pattern missing from a full table may have been counted up to its smallest count
+        floor = min((entry[0] for entry in self.table.values()), default=0) if len(self.table) >= self.capacity else 0
+        other_floor = min((entry[0] for entry in other.table.values()), default=0) if len(other.table) >= other.capacity else 0
+
+        table = {}
+        for node, (count, error) in self.table.items():
+            if node not in other.table:
+                count, error = count+other_floor, error+other_floor
+            table[node] = [count, error]
+        for node, (count, error) in other.table.items():
+            if node in table:
+                table[node][0] += count
+                table[node][1] += error
+            else:
+                table[node] = [count+floor, error+floor]
+
+        # the merged table keeps the most frequent patterns
+        capacity = min(self.capacity, other.capacity)
+        if len(table) > capacity:
+            kept = sorted(table, key=lambda pattern: table[pattern][0], reverse=True)[:capacity]
+            table = {node: table[node] for node in kept}
+        self.table = table
+        self.capacity = capacity
+        self.heap = [(entry[0], node) for node, entry in table.items()]
+        heapq.heapify(self.heap)
+
+        for row in range(self.depth):
+            self.sketch[row] = array("q", map(int.__add__, self.sketch[row], other.sketch[row]))
+
+        self.patterns.merge(other.patterns)
+        for sketches, others in ((self.label_patterns, other.label_patterns), (self.key_patterns, other.key_patterns)):
+            for name, sketch in others.items():
+                self.cardinality(sketches, name).merge(sketch)
+
+        self.nodes += other.nodes
+        for counts, others in ((self.label_counts, other.label_counts), (self.key_counts, other.key_counts)):
+            for name, amount in others.items():
+                counts[name] = counts.get(name, 0) + amount
+        for labels in other.labs_sets:
+            if labels not in self.labs_sets:
+                self.labs_sets.append(labels)
+
+        return self
+
+    def to_profile(self, min_count=1):
+        """ The profile of the patterns of the table, as returned by preprocessing
+
+        Parameters
+        ----------
+        min_count : Int
+            Patterns counted less often are left out
+
+        Returns
+        -------
+        amount_dict, list_of_distinct_nodes, distinct_labels, labs_sets :
+            As returned by preprocessing, the counts being the tightest upper bound of the table and the Count-Min sketch
+        """
+        amount_dict = {}
+        list_of_distinct_nodes = []
+        for node in sorted(self.table, key=lambda pattern: self.table[pattern][0], reverse=True):
+            count = self.estimate(node)
+            if count >= min_count:
+                list_of_distinct_nodes.append(node)
+                amount_dict[node] = count
+
+        distinct_labels = sorted(self.label_counts)
+        labs_sets = [list(labels) for labels in self.labs_sets]
+
+        return amount_dict, list_of_distinct_nodes, distinct_labels, labs_sets
+
+    def summary(self):
+        """ Number of nodes and estimated number of distinct patterns, overall and for each label and property """
+        return {"nodes": self.nodes, "patterns": self.patterns.estimate(), "kept_patterns": len(self.table),
+                "labels": {label: {"nodes": self.label_counts[label], "patterns": self.label_patterns[label].estimate()}
+                           for label in sorted(self.label_counts)},
+                "properties": {key: {"nodes": self.key_counts[key], "patterns": self.key_patterns[key].estimate()}
+                               for key in sorted(self.key_counts)}}
+
+    def save(self, file):
+        """ Writes the sketch into a json file """
+        def hll(sketch):
+            if sketch.registers is None:
+                return {"hashes": sorted(sketch.hashes)}
+            return {"registers": base64.b64encode(bytes(sketch.registers)).decode("ascii")}
+
+        data = {"capacity": self.capacity, "width": self.width, "depth": self.depth, "precision": self.precision,
+                "table": self.table, "sketch": [base64.b64encode(row.tobytes()).decode("ascii") for row in self.sketch],
+                "patterns": hll(self.patterns),
+                "label_patterns": {name: hll(sketch) for name, sketch in self.label_patterns.items()},
+                "key_patterns": {name: hll(sketch) for name, sketch in self.key_patterns.items()},
+                "nodes": self.nodes, "label_counts": self.label_counts, "key_counts": self.key_counts,
+                "labs_sets": self.labs_sets}
+        with open(file, "w") as f:
+            json.dump(data, f)
+        return file
+
+    @classmethod
+    def load(cls, file):
+        """ Reads a sketch written by save """
+        with open(file) as f:
+            data = json.load(f)
+
+        sketch = cls(data["capacity"], data["width"], data["depth"], data["precision"])
+
+        def hll(saved):
+            result = HyperLogLog(sketch.precision)
+            if "registers" in saved:
+                result.registers = bytearray(base64.b64decode(saved["registers"]))
+            else:
+                result.hashes = set(saved["hashes"])
+            return result
+
+        sketch.table = data["table"]
+        sketch.heap = [(entry[0], node) for node, entry in sketch.table.items()]
+        heapq.heapify(sketch.heap)
+        sketch.sketch = [array("q", base64.b64decode(row)) for row in data["sketch"]]
+        sketch.patterns = hll(data["patterns"])
+        sketch.label_patterns = {name: hll(saved) for name, saved in data["label_patterns"].items()}
+        sketch.key_patterns = {name: hll(saved) for name, saved in data["key_patterns"].items()}
+        sketch.nodes = data["nodes"]
+        sketch.label_counts = data["label_counts"]
+        sketch.key_counts = data["key_counts"]
+        sketch.labs_sets = data["labs_sets"]
+        return sketch
+
+def pattern_hash(node):
+    """ 128 bits hash of a pattern string, stable across processes """
+    return int.from_bytes(hashlib.blake2b(node.encode("utf-8"), digest_size=16).digest(), "big")
+
+def merge_sketches(sketches):
+    """ Merges sketches of the parts of a graph (in any order) """
+    merged = None
+    for sketch in sketches:
+        merged = sketch if merged is None else merged.merge(sketch)
+    return merged
+
+def sketch_driver(driver, database=None, **params):
+    """ Profiles a Neo4j database (or a shard of a fabric database) into a sketch
+
+    Parameters
+    ----------
+    driver : GraphDatabase.driver object
+        Driver used to access the PG stored in a Neo4j database.
+    database : String
+        Name of the database to query, None for the default database of the server.
+    params :
+        Sizes of the sketch (see SketchProfile)
+
+    Returns
+    -------
+    sketch : SketchProfile
+    """
+    from preprocessing_step import PATTERNS_QUERY
+
+    sketch = SketchProfile(**params)
+    print(colored("Querying neo4j to get all distinct sets of labels and props:", "yellow"))
+    with driver.session(database=database) as session:
+        for node in session.run(PATTERNS_QUERY):
+            sketch.add(node["labels(n)"], node["keys(n)"], node["COUNT(n)"])
+    print(colored("Done.", "green"))
+    return sketch
+
+def sketch_jsonl(file, **params):
+    """ Profiles a JSONL export (one node or relationship per line, as written by apoc.export.json) into a sketch
+
+    Parameters
+    ----------
+    file : String
+        Name of the JSONL file, relationships are skipped
+    params :
+        Sizes of the sketch (see SketchProfile)
+
+    Returns
+    -------
+    sketch : SketchProfile
+    """
+    sketch = SketchProfile(**params)
+
+    # the nodes of a pattern are counted before being added to the sketch
+    counts = {}
+    with open(file) as f:
+        for line in f:
+            if line.strip() == "":
+                continue
+            item = json.loads(line)
+            if item.get("type", "node") != "node":
+                continue
+            pattern = (tuple(sorted(item.get("labels", []))), tuple(sorted(item.get("properties", {}))))
+            counts[pattern] = counts.get(pattern, 0) + 1
+
+            # bounded memory : the pending counts are flushed into the sketch
+            if len(counts) >= sketch.capacity:
+                for (labels, keys), count in counts.items():
+                    sketch.add(labels, keys, count)
+                counts = {}
+
+    for (labels, keys), count in counts.items():
+        sketch.add(labels, keys, count)
+    return sketch
+
+def load_or_sketch(file, params):
+    """ Reads a saved sketch (.json) or profiles a JSONL export """
+    if file.endswith(".jsonl"):
+        return sketch_jsonl(file, **params)
+    return SketchProfile.load(file)
+
+def sketch_files(files, workers=None, **params):
+    """ Profiles several JSONL exports (or saved sketches) in parallel processes and merges their sketches
+
+    Parameters
+    ----------
+    files : Python list
+        Names of .jsonl exports or of sketches written by SketchProfile.save
+    workers : Int
+        Number of processes, one per processor by default
+    params :
+        Sizes of the sketches (see SketchProfile)
+
+    Returns
+    -------
+    sketch : SketchProfile
+        The merged sketch
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return merge_sketches(executor.map(load_or_sketch, files, [params]*len(files)))
@@ -3,99 +3,333 @@
 ##### Imports
 import csv
 
-def storing(distinct_labels,labs_sets,hierarchy_tree):
-    """ Write clusters into a file
+### Header of the schema file
+HEADER = ['id', 'labels', 'properties', 'subtypeof', 'type', 'is_basetype']
+
+class SchemaWriter:
+    """ Writes the types of the hierarchy trees of base types into a file, one base type after another
+
+    The labels and properties of a type are summarized once per hierarchy node, bottom-up : the intersection and the
+    union of the bitsets of the tokens of its members, and its number of members, are combined from its subtypes'
+    summaries (the subtypes of a type being disjoint subsets of its members, as made by rec_clustering).
+    Only the members that are in no subtype are read again.
 
     Parameters
     ----------
+    file : String
+        Name of the file to write clusters into.
     distinct_labels : Python list
         A list of labels
         Its format is : ['Label1', 'Label2', 'Label3', ...]
-    labs_sets : Python list of list
-        A list of all labels sets
-        Its format is : [['Label 1','Label2'],['Label1'],['Label3'],...]
-    all_clusters : Python list of sets
-        Each set of this list represents a different cluster,
-        they may contain one element or more,
-        an element is a string node that was clustered in this cluster
-        Its format is : [{'Label1 prop1', 'Label1', 'Label1 prop1 prop2'}, {'Label3', 'Label3 prop1 prop4'}, ...] 
-
-    Returns
-    -------
-    file : String
-        Name of the file clusters were written into.
-
+    key_stats : Python dict
+        The statistics of the properties returned by preprocessing_with_stats,
+        to add the datatypes of the properties of each type in a last column
+    buffer_rows : Int
+        Number of rows written to the file at once
+    disjoint_subtypes : Boolean
+        When disjoint_subtypes is at False, the subtypes of a type may share members (see fca) :
+        the members that are in no subtype are always found from the members of the subtypes
     """
 
-    header = ['id', 'labels', 'properties', 'subtypeof', 'type', 'is_basetype']
-
-    data = []
-
-    run_clusters = []
-
-    i=1
-
-    with open("data.csv","w") as f:
-        writer = csv.writer(f)
-        writer.writerow(header)
-
-        # iterate through each basic type clusters
-        for basic_type in hierarchy_tree:
-            parent_id = i
-
-            # line id
-            data_line = [str(parent_id)]
-            
-            labels = list(basic_type[0])
-
-            # labels
-            data_line.append(":".join(labels))
-
-            i+=1
-
-            lcluster = basic_type[1]
-            rcluster = basic_type[2]
-
-            k = 2
-            properties = ""
-
-            if lcluster is not None and rcluster is not None:
-                lset = set(list(lcluster[0])[0].split())
-                rset = set(list(rcluster[0])[0].split())
-                inter = lset.intersection(rset)
-                inter_list_props = []
-                for elt in inter:
-                    if elt not in distinct_labels:
-                        inter_list_props.append(elt)
-
-                properties = ":".join(sorted(inter_list_props))
-
-            if properties != "":
-
-                # intersection of properties
-                data_line.append(properties)
-
-                # no supertypes for base types
-                data_line.append("")
-
-                # the name of the infered type
-                data_line.append("T1")
-
-                # is a base type
-                data_line.append("yes")
-
-                writer.writerow(data_line)
-
-            # search for subtypes
-            if lcluster is not None:
-                i,k = rec_storing(distinct_labels,labs_sets, writer, lcluster, i, parent_id, run_clusters, k)
-            if rcluster is not None:
-                i,k = rec_storing(distinct_labels,labs_sets, writer, rcluster, i, parent_id, run_clusters, k)
-
-    return "data.csv"
-
-
-def rec_storing(distinct_labels,labs_sets,writer,hierarchy_tree, i, parent_id, run_clusters, k):
+    def __init__(self, file, distinct_labels, key_stats=None, buffer_rows=10000, disjoint_subtypes=True):
+        self.file = file
+        self.labels_set = set(distinct_labels)
+        self.key_stats = key_stats
+        self.buffer_rows = buffer_rows
+        self.disjoint_subtypes = disjoint_subtypes
+
+        # bit of each token, and the bits of the labels
+        self.bits = {}
+        self.tokens = []
+        self.label_mask = 0
+        self.masks = {}
+
+        # signatures of the subtypes already written
+        self.run_clusters = set()
+
+        # id of the next row
+        self.i = 1
+
+        self.rows = []
+        self.f = open(file, "w")
+        self.writer = csv.writer(self.f)
+
+        header = list(HEADER)
+        if key_stats is not None:
+            header.append('datatypes')
+        self.writer.writerow(header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.buffer_rows:
+            self.flush()
+
+    def flush(self):
+        self.writer.writerows(self.rows)
+        self.rows = []
+
+    def close(self):
+        if self.f is not None:
+            self.flush()
+            self.f.close()
+            self.f = None
+        return self.file
+
+    def mask(self, node):
+        """ Bitset of the tokens of a node string """
+        mask = self.masks.get(node)
+        if mask is None:
+            mask = 0
+            for token in node.split(" "):
+                bit = self.bits.get(token)
+                if bit is None:
+                    bit = self.bits[token] = len(self.tokens)
+                    self.tokens.append(token)
+                    if token in self.labels_set:
+                        self.label_mask |= 1 << bit
+                mask |= 1 << bit
+            self.masks[node] = mask
+        return mask
+
+    def names(self, mask):
+        """ Sorted tokens of a bitset """
+        bits = bin(mask)[:1:-1]
+        return sorted(self.tokens[i] for i, bit in enumerate(bits) if bit == "1")
+
+    def split_names(self, inter, union):
+        """ Sorted mandatory labels, optional labels, mandatory properties and optional properties of a summary """
+        always = bin(inter)[:1:-1]
+        always_labels, optional_labels, always_properties, optional_properties = [], [], [], []
+        for i, bit in enumerate(bin(union)[:1:-1]):
+            if bit == "1":
+                token = self.tokens[i]
+                mandatory = always[i:i+1] == "1"
+                if token in self.labels_set:
+                    (always_labels if mandatory else optional_labels).append(token)
+                else:
+                    (always_properties if mandatory else optional_properties).append(token)
+        return sorted(always_labels), sorted(optional_labels), sorted(always_properties), sorted(optional_properties)
+
+    def add_datatypes(self, datatypes, node):
+        """ Adds the datatype histograms of the properties of a node string to datatypes """
+        for key, stats in self.key_stats.get(node, {}).items():
+            histogram = datatypes.setdefault(key, {})
+            for name, amount in stats.datatypes.items():
+                histogram[name] = histogram.get(name, 0) + amount
+
+    def summarize(self, hierarchy, summaries):
+        """ Computes the summaries of a hierarchy node and of its subtypes
+
+        The hierarchy is walked in post-order with an explicit stack, so that its depth is not bounded by the
+        recursion limit.
+
+        Parameters
+        ----------
+        hierarchy : Python list
+            A node of the hierarchy : [cluster, subtype1, subtype2, ...]
+        summaries : Python dict
+            The summaries computed, by id of hierarchy node
+
+        Returns
+        -------
+        summary : Python tuple
+            The bitsets of the tokens of all members and of some members, the number of members and
+            the datatype histograms of the properties (None without key_stats)
+        """
+        stack = [(hierarchy, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if id(node) in summaries:
+                continue
+            children = [child for child in node[1:] if child is not None]
+
+            # a node is summarized once the summaries of its subtypes are computed
+            if not expanded:
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(children))
+                continue
+
+            inter = -1
+            union = 0
+            weight = 0
+            datatypes = {} if self.key_stats is not None else None
+
+            for child in children:
+                child_inter, child_union, child_weight, child_datatypes = summaries[id(child)]
+                inter &= child_inter
+                union |= child_union
+                weight += child_weight
+                if datatypes is not None:
+                    for key, histogram in child_datatypes.items():
+                        merged = datatypes.setdefault(key, {})
+                        for name, amount in histogram.items():
+                            merged[name] = merged.get(name, 0) + amount
+
+            # members that are in no subtype
+            if weight < len(node[0]) or not self.disjoint_subtypes:
+                covered = set()
+                for child in children:
+                    covered.update(child[0])
+                for member in node[0]:
+                    if member not in covered:
+                        mask = self.mask(member)
+                        inter &= mask
+                        union |= mask
+                        weight += 1
+                        if datatypes is not None:
+                            self.add_datatypes(datatypes, member)
+
+            if weight == 0:
+                inter = 0
+
+            # members shared by several subtypes are counted once
+            if not self.disjoint_subtypes:
+                weight = len(node[0])
+                if datatypes is not None:
+                    datatypes = {}
+                    for member in node[0]:
+                        self.add_datatypes(datatypes, member)
+
+            summaries[id(node)] = (inter, union, weight, datatypes)
+
+        return summaries[id(hierarchy)]
+
+    def datatypes_column(self, properties, datatypes):
+        """ Datatypes of the properties of a type, in the order of its properties column
+
+        Parameters
+        ----------
+        properties : String
+            The properties column of the type
+            Its format is : 'prop1:prop2:?prop3'
+        datatypes : Python dict
+            The datatype histogram of each property of the type
+
+        Returns
+        -------
+        datatypes : String
+            The datatypes of each property separated by ':', the most frequent first, several datatypes of a property
+            are separated by '|'
+            Its format is : 'Integer:String:Float|Integer'
+        """
+        if properties == "":
+            return ""
+
+        column = []
+        for prop in properties.split(":"):
+            histogram = datatypes.get(prop.lstrip("?"), {})
+            column.append("|".join(sorted(histogram, key=lambda name: (-histogram[name], name))))
+        return ":".join(column)
+
+    def write_base_type(self, basic_type):
+        """ Writes a base type and its subtypes
+
+        Parameters
+        ----------
+        basic_type : Python list
+            The hierarchy of a base type as returned by iter_gmm : [labels, subtype1, subtype2, ...]
+        """
+        parent_id = self.i
+        self.i += 1
+
+        summaries = {}
+        children = [child for child in basic_type[1:] if child is not None]
+        for child in children:
+            self.summarize(child, summaries)
+
+        properties = ""
+
+        # the properties of the base type are the ones shared by the first node (in sorted order) of each of its subtypes
+        if len(children) > 1 and len(children) == len(basic_type)-1:
+            inter = -1
+            for child in children:
+                inter &= self.mask(min(child[0]))
+            properties = ":".join(self.names(inter & ~self.label_mask))
+
+        if properties != "":
+            # labels, intersection of properties, no supertypes, name and is a base type
+            data_line = [str(parent_id), ":".join(sorted(basic_type[0])), properties, "", "T1", "yes"]
+
+            if self.key_stats is not None:
+                datatypes = {}
+                for child in children:
+                    for key, histogram in summaries[id(child)][3].items():
+                        merged = datatypes.setdefault(key, {})
+                        for name, amount in histogram.items():
+                            merged[name] = merged.get(name, 0) + amount
+                data_line.append(self.datatypes_column(properties, datatypes))
+
+            self.write(data_line)
+
+        # search for subtypes
+        k = 2
+        for child in children:
+            k = self.write_subtype(child, parent_id, k, summaries)
+
+    def write_subtype(self, hierarchy, parent_id, k, summaries):
+        """ Writes a subtype and its own subtypes, in pre-order with an explicit stack
+
+        Parameters
+        ----------
+        hierarchy : Python list
+            A node of the hierarchy : [cluster, subtype1, subtype2, ...]
+        parent_id : Int
+            Row id of the supertype
+        k : Int
+            Number of the next type name of the base type
+        summaries : Python dict
+            The summaries of the hierarchy nodes, by id
+
+        Returns
+        -------
+        k : Int
+            Number of the next type name of the base type
+        """
+        stack = [(hierarchy, parent_id)]
+        while stack:
+            node, parent_id = stack.pop()
+            inter, union, weight, datatypes = summaries[id(node)]
+
+            always_labels, optional_labels, always_properties, optional_properties = self.split_names(inter, union)
+
+            # add a question mark for optionnal labels and properties
+            if optional_labels != []:
+                labels = ":".join(always_labels)+":?"+":?".join(optional_labels)
+            else:
+                labels = ":".join(always_labels)
+
+            if optional_properties != []:
+                properties = ":".join(always_properties)+":?"+":?".join(optional_properties)
+            else:
+                properties = ":".join(always_properties)
+
+            # if the formed cluster already exists, its subtypes are not written either
+            if (labels, properties) in self.run_clusters:
+                continue
+            self.run_clusters.add((labels, properties))
+
+            # line id, labels, properties, parent line id, type name, is not a base type
+            data_line = [str(self.i), labels, properties, str(parent_id), "T"+str(k), "no"]
+            if self.key_stats is not None:
+                data_line.append(self.datatypes_column(properties, datatypes))
+            self.write(data_line)
+
+            new_parent_id = self.i
+            k += 1
+            self.i += 1
+
+            # search for more subtypes, the first one being written first
+            stack.extend((child, new_parent_id) for child in reversed(node[1:]) if child is not None)
+
+        return k
+
+def storing(distinct_labels,labs_sets,hierarchy_tree,file="data.csv",key_stats=None,disjoint_subtypes=True):
     """ Write clusters into a file
 
     Parameters
@@ -106,11 +340,15 @@ def rec_storing(distinct_labels,labs_sets,writer,hierarchy_tree, i, parent_id, r
     labs_sets : Python list of list
         A list of all labels sets
         Its format is : [['Label 1','Label2'],['Label1'],['Label3'],...]
-    all_clusters : Python list of sets
-        Each set of this list represents a different cluster,
-        they may contain one element or more,
-        an element is a string node that was clustered in this cluster
-        Its format is : [{'Label1 prop1', 'Label1', 'Label1 prop1 prop2'}, {'Label3', 'Label3 prop1 prop4'}, ...] 
+    hierarchy_tree : Python list
+        The hierarchy of each base type, as returned by iter_gmm
+    file : String
+        Name of the file to write clusters into.
+    key_stats : Python dict
+        The statistics of the properties returned by preprocessing_with_stats,
+        to add the datatypes of the properties of each type in a last column
+    disjoint_subtypes : Boolean
+        False when the subtypes of a type may share members (hierarchies of fca)
 
     Returns
     -------
@@ -118,92 +356,9 @@ def rec_storing(distinct_labels,labs_sets,writer,hierarchy_tree, i, parent_id, r
         Name of the file clusters were written into.
 
     """
-    all_labels = set()
-    all_properties = set()
-    always_labels = set()
-    always_properties = set()
-
-    j = 0
-
-    # iterate through each node that forms the cluster
-    for node in hierarchy_tree[0]:
-        props_labs = node.split(" ")
-
-        cur_labels = set()
-        cur_properties = set()
-
-        # search for labels and properties in this subtype
-        if j == 0:
-            for prop_lab in props_labs:
-                if prop_lab in distinct_labels:
-                    all_labels.add(prop_lab)
-                    always_labels.add(prop_lab)
-                    cur_labels.add(prop_lab)
-                else:
-                    all_properties.add(prop_lab)
-                    always_properties.add(prop_lab)
-                    cur_properties.add(prop_lab)
-            j+=1
-        else:
-            for prop_lab in props_labs:
-                if prop_lab in distinct_labels:
-                    all_labels.add(prop_lab)
-                    cur_labels.add(prop_lab)
-                else:
-                    all_properties.add(prop_lab)
-                    cur_properties.add(prop_lab)
-
-        always_labels = always_labels.intersection(cur_labels)
-        always_properties = always_properties.intersection(cur_properties)
-
-    # identify optionnal labels and properties with the always_labels et and always_properties
-    optional_labels = all_labels-always_labels
-    optional_properties = all_properties-always_properties
-
-    # add a question mark for optionnal labels and properties
-    if optional_labels != set():
-        labels = ":".join(sorted(list(always_labels)))+":?"+":?".join(sorted(list(optional_labels)))
-    else:
-        labels = ":".join(sorted(list(always_labels)))
-
-    if optional_properties != set():
-        properties = ":".join(sorted(list(always_properties)))+":?"+":?".join(sorted(list(optional_properties)))
-    else:
-        properties = ":".join(sorted(list(always_properties)))
-
-    # if the formed cluster does not exist
-    if labels+properties not in run_clusters:
-
-        # line id
-        data_line = [str(i)]
-
-        data_line.append(labels)
-
-        data_line.append(properties)
-
-        # parent line id
-        data_line.append(str(parent_id))
-
-        # type name
-        data_line.append("T"+str(k))
-
-        # is not a base type
-        data_line.append("no")
-
-        writer.writerow(data_line)
-
-        run_clusters.append(labels+properties)
-
-        new_parent_id = i
-
-        k+=1
-
-        i+=1
-
-        # search for more subtypes
-        if hierarchy_tree[1] is not None:
-            i,k = rec_storing(distinct_labels,labs_sets, writer, hierarchy_tree[1], i, new_parent_id, run_clusters, k)
-        if hierarchy_tree[2] is not None:
-            i,k = rec_storing(distinct_labels,labs_sets, writer, hierarchy_tree[2], i, new_parent_id, run_clusters, k)
+    with SchemaWriter(file, distinct_labels, key_stats, disjoint_subtypes=disjoint_subtypes) as writer:
+        # iterate through each basic type clusters
+        for basic_type in hierarchy_tree:
+            writer.write_base_type(basic_type)
 
-    return i,k
+    return file
@@ -0,0 +1,249 @@
+""" Steps 1 to 3 as a pipeline : base types are clustered as soon as their patterns are fetched
+
+The sets of labels are read first (two cheap queries), then the patterns of each set of labels are counted by a
+label-scoped query (label_set_query) in a thread pool. The members of a base type are the patterns of every set of
+labels containing it : once the scans of all these sets are done, the base type is clustered in a process pool while
+the other sets are still being scanned. Each finished hierarchy goes to the writer, which writes the base types in the
+order of labs_sets so that the file does not depend on the order in which the scans and the clusterings end.
+
+There is no sampling : every node of the database is clustered.
+Each base type is clustered on its own, with its own seed and its own all_clusters : a cluster already found under
+another base type is kept again (iter_gmm keeps it under the first base type only), so the schema can have more
+types than the one of infer_schema for the same graph, and it is not the same file for the same seed.
+"""
+
+##### Imports
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from termcolor import colored
+
+### File imports
+import tracing
+from preprocessing_step import LABELS_QUERY, LABEL_SETS_QUERY, label_set_query
+from storing import SchemaWriter
+
+def scan_label_set(driver, lab_set, database=None):
+    """ Counts the nodes of each set of properties among the nodes with exactly the labels of lab_set
+
+    Parameters
+    ----------
+    driver : GraphDatabase.driver object
+        Driver used to access the PG stored in a Neo4j database.
+    lab_set : Python list
+        Sorted labels, empty for unlabelled nodes
+    database : String
+        Name of the database to query, None for the default database of the server.
+
+    Returns
+    -------
+    patterns : Python list of tuples
+        The node strings of lab_set and their number of occurrences
+        Its format is : [('Label1 Label2 prop1', int), ('Label1 Label2 prop1 prop2', int), ...]
+    """
+    with tracing.span("scan", labels=":".join(lab_set)):
+        with driver.session(database=database) as session:
+            return [(' '.join(lab_set+sorted(record["keys"])), record["count"])
+                    for record in session.run(label_set_query(lab_set))]
+
+def cluster_base_type(amount_dict, correct_nodes, distinct_labels, lab_set, warm_start=False, seed=None):
+    """ Step 2 for one base type, run in a worker process
+
+    Parameters
+    ----------
+    amount_dict : Python dict
+        The number of occurrences of the members of the base type
+    correct_nodes : Python list
+        The members of the base type
+    distinct_labels : Python list
+        A list of labels
+    lab_set : Python list
+        The labels of the base type
+    warm_start : Boolean
+        Start the model of each subcluster from its parent's component (see iter_gmm)
+    seed : Int
+        Seed of the clustering, None for a random one
+
+    Returns
+    -------
+    hierarchy : Python list
+        The hierarchy of the base type, as in the hierarchy_tree returned by iter_gmm
+    all_clusters : Python list of sets
+        The clusters of the base type
+    """
+    from GMM_clustering import iter_gmm
+
+    if seed is not None:
+        # the Gaussian Mixture Models draw from numpy's generator
+        import numpy as np
+        random.seed(seed)
+        np.random.seed(seed)
+
+    all_clusters, hierarchy_tree = iter_gmm(amount_dict, correct_nodes, distinct_labels, [lab_set], warm_start)
+    return hierarchy_tree[0], all_clusters
+
+class OrderedWriter:
+    """ Writes the hierarchies of the base types in the order of their index, as soon as they and all the previous ones
+    are finished
+
+    Parameters
+    ----------
+    writer : SchemaWriter
+        The writer of the schema file
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.waiting = {}
+        self.next = 0
+
+    def add(self, index, hierarchy):
+        """ Gives the hierarchy of the base type index, writes the base types that can be written
+
+        Returns
+        -------
+        written : Int
+            Number of base types written
+        """
+        self.waiting[index] = hierarchy
+        written = 0
+        while self.next in self.waiting:
+            self.writer.write_base_type(self.waiting.pop(self.next))
+            self.writer.flush()
+            self.next += 1
+            written += 1
+        return written
+
+def streaming_inference(driver, file="data.csv", database=None, scan_workers=4, cluster_workers=None, warm_start=False,
+                        seed=None):
+    """ Infers the schema of a PG and writes it into a file, the scans, the clusterings and the writes overlapping
+
+    Parameters
+    ----------
+    driver : GraphDatabase.driver object
+        Driver used to access the PG stored in a Neo4j database (shared by the scanning threads)
+    file : String
+        Name of the file the schema is written into
+    database : String
+        Name of the database to query, None for the default database of the server
+    scan_workers : Int
+        Number of sets of labels scanned at the same time
+    cluster_workers : Int
+        Number of processes clustering, the number of cpus by default, 0 to cluster in the calling thread
+    warm_start : Boolean
+        Start the model of each subcluster from its parent's component (see iter_gmm)
+    seed : Int
+        Seed of the clustering (the base type i uses seed+i), None for a random one
+
+    Returns
+    -------
+    result : Python dict
+        file : the name of the schema file
+        amount_dict, list_of_distinct_nodes, distinct_labels, labs_sets : the profile, as returned by preprocessing
+        hierarchy_tree, all_clusters : as returned by iter_gmm (equal clusters of different base types are kept)
+        timings : the time until the last scan, until the first base type is written and until the end, in seconds
+    """
+    t = time.perf_counter()
+    timings = {}
+
+    print(colored("Querying neo4j to get all distinct labels and sets of labels:", "yellow"))
+    with driver.session(database=database) as session:
+        distinct_labels = [record["lab"] for record in session.run(LABELS_QUERY)]
+        labs_sets = [record["LABELS(n)"] for record in session.run(LABEL_SETS_QUERY)]
+    print(colored("Done.", "green"))
+
+    # a set of labels is scanned once even if it was returned in different orders
+    scanned_sets = []
+    for lab_set in labs_sets:
+        if sorted(lab_set) not in scanned_sets:
+            scanned_sets.append(sorted(lab_set))
+
+    # scans each base type needs : the sets of labels containing it (only the unlabelled nodes for [])
+    needed = []
+    waiting_for = [[] for lab_set in scanned_sets]
+    for b, lab_set in enumerate(labs_sets):
+        needed.append([s for s, scanned in enumerate(scanned_sets)
+                       if (lab_set == [] and scanned == []) or (lab_set != [] and set(lab_set) <= set(scanned))])
+        for s in needed[b]:
+            waiting_for[s].append(b)
+    remaining = [set(scans) for scans in needed]
+
+    patterns = [None]*len(scanned_sets)
+    hierarchy_tree = [None]*len(labs_sets)
+    all_clusters = []
+
+    def members(b):
+        """ amount_dict and correct_nodes of the base type b, in the order of the scanned sets """
+        amount_dict = {}
+        correct_nodes = []
+        for s in needed[b]:
+            for node, count in patterns[s]:
+                if node not in amount_dict:
+                    correct_nodes.append(node)
+                    amount_dict[node] = 0
+                amount_dict[node] += count
+        return amount_dict, correct_nodes
+
+    print(colored("Scanning the sets of labels and clustering the base types:", "yellow"))
+    with SchemaWriter(file, distinct_labels) as writer, ThreadPoolExecutor(scan_workers) as threads:
+        ordered = OrderedWriter(writer)
+        processes = ProcessPoolExecutor(cluster_workers) if cluster_workers != 0 else None
+
+        def finished(b, hierarchy, clusters):
+            hierarchy_tree[b] = hierarchy
+            all_clusters.extend(clusters)
+            if ordered.add(b, hierarchy) and "first_base_type" not in timings:
+                timings["first_base_type"] = time.perf_counter() - t
+
+        try:
+            pending = {threads.submit(scan_label_set, driver, scanned, database): ("scan", s)
+                       for s, scanned in enumerate(scanned_sets)}
+
+            while pending:
+                done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, i = pending.pop(future)
+
+                    if kind == "cluster":
+                        finished(i, *future.result())
+                        continue
+
+                    patterns[i] = future.result()
+                    if all(scanned is not None for scanned in patterns):
+                        timings["scanning"] = time.perf_counter() - t
+
+                    for b in waiting_for[i]:
+                        remaining[b].discard(i)
+                        if remaining[b]:
+                            continue
+
+                        # every set of labels of the base type is scanned : it can be clustered
+                        amount_dict, correct_nodes = members(b)
+                        base_seed = seed+b if seed is not None else None
+                        if processes is None:
+                            with tracing.span("base type", labels=":".join(labs_sets[b])):
+                                finished(b, *cluster_base_type(amount_dict, correct_nodes, distinct_labels, labs_sets[b],
+                                                               warm_start, base_seed))
+                        else:
+                            pending[processes.submit(cluster_base_type, amount_dict, correct_nodes, distinct_labels,
+                                                     labs_sets[b], warm_start, base_seed)] = ("cluster", b)
+        finally:
+            if processes is not None:
+                processes.shutdown(cancel_futures=True)
+    print(colored("Done.", "green"))
+
+    timings["total"] = time.perf_counter() - t
+
+    # the profile of the whole graph, as preprocessing returns it
+    amount_dict = {}
+    list_of_distinct_nodes = []
+    for scanned in patterns:
+        for node, count in scanned:
+            if node not in amount_dict:
+                list_of_distinct_nodes.append(node)
+                amount_dict[node] = 0
+            amount_dict[node] += count
+
+    return {"file": file, "amount_dict": amount_dict, "list_of_distinct_nodes": list_of_distinct_nodes,
+            "distinct_labels": distinct_labels, "labs_sets": labs_sets,
+            "hierarchy_tree": hierarchy_tree, "all_clusters": all_clusters, "timings": timings}
@@ -0,0 +1,236 @@
+""" Sweep of the settings of the inference over one profile, for model selection
+
+The database is profiled once into a profile directory (see columnar_profile). Each configuration of the grid
+(training percentage, seed, clustering settings) is run by a worker process : sampling, clustering, storing, then the
+f-score and the Hdbscan indexes. Workers receive the name of the profile directory only, not a pickled copy of the
+profile : each process reads the columns of the directory and loads the profile in memory once (sampling and
+iter_gmm run on Python dicts and lists, so each process holds its own copy).
+Every finished configuration is appended to results.csv with its quality metrics and the time spent in each stage :
+a sweep that is stopped goes on from the configurations missing in results.csv when it is run again, the rows of
+the configurations that failed being removed from the file before they are run again.
+"""
+
+##### Imports
+import csv
+import itertools
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from termcolor import colored
+
+### Columns of the results table
+HEADER = ["config", "training_percentage", "seed", "warm_start", "share", "patterns", "types", "f_score", "ari", "ami",
+          "sampling_s", "clustering_s", "storing_s", "f_score_s", "hdbscan_s", "error"]
+
+### Grid of the sweep when a setting is not given
+DEFAULT_GRID = {"training_percentage": [80], "seed": [0], "warm_start": [False], "share": [False]}
+
+def expand_grid(grid):
+    """ Every combination of the values of a grid
+
+    Parameters
+    ----------
+    grid : Python dict
+        The values of each setting, the settings missing take their values in DEFAULT_GRID
+        Its format is : {'training_percentage': [80, 50], 'seed': [0, 1, 2], 'warm_start': [False, True]}
+
+    Returns
+    -------
+    configs : Python list of dict
+        One dictionary per combination, with its name in config
+    """
+    grid = dict(DEFAULT_GRID, **grid)
+    names = sorted(grid)
+    configs = []
+    for values in itertools.product(*(grid[name] for name in names)):
+        config = dict(zip(names, values))
+        config["config"] = config_name(config)
+        configs.append(config)
+    return configs
+
+def config_name(config):
+    """ Name of a configuration, the same from one run of the sweep to another """
+    return "-".join(name+"="+str(config[name]) for name in sorted(config) if name != "config")
+
+def profile_once(driver, directory, database=None):
+    """ Profiles the database into a profile directory, unless the directory already holds a profile
+
+    Returns
+    -------
+    profile : ColumnarProfile
+    """
+    from columnar_profile import ColumnarProfile, write_profile
+    from preprocessing_step import preprocessing
+
+    if os.path.exists(os.path.join(directory, "meta.json")):
+        print(colored("Reusing the profile of "+directory+".", "green"))
+        return ColumnarProfile(directory)
+
+    amount_dict, list_of_distinct_nodes, distinct_labels, labs_sets = preprocessing(driver, database)
+    return write_profile(directory, amount_dict, list_of_distinct_nodes, distinct_labels, labs_sets)
+
+### Profile loaded by a worker process, by directory
+_loaded = {}
+
+def load_profile(profile):
+    """ The in-memory profile of a ColumnarProfile, loaded once per process """
+    if profile.directory not in _loaded:
+        _loaded.clear()
+        _loaded[profile.directory] = profile.to_profile()
+    return _loaded[profile.directory]
+
+def run_config(profile, config, output_dir, metrics=("f_score", "hdbscan")):
+    """ Runs one configuration of the sweep, in a worker process
+
+    Parameters
+    ----------
+    profile : ColumnarProfile
+        The profile of the database (pickled as the name of its directory)
+    config : Python dict
+        A configuration returned by expand_grid
+    output_dir : String
+        The schema is written into output_dir/schemas/<config>.csv
+    metrics : Python tuple
+        The quality metrics to compute : f_score and hdbscan (ARI and AMI)
+
+    Returns
+    -------
+    row : Python dict
+        The row of the configuration in the results table (see HEADER)
+    """
+    import numpy as np
+    from sampling import sampling
+    from GMM_clustering import iter_gmm
+    from storing import storing
+
+    amount_dict, list_of_distinct_nodes, distinct_labels, labs_sets = load_profile(profile)
+    row = {name: config.get(name) for name in HEADER}
+    row["patterns"] = len(list_of_distinct_nodes)
+
+    # the Gaussian Mixture Models draw from numpy's generator
+    random.seed(config["seed"])
+    np.random.seed(config["seed"])
+
+    t = time.perf_counter()
+    validate = test = None
+    if config["training_percentage"] is not None:
+        amount_dict, list_of_distinct_nodes, validate, test = sampling(dict(amount_dict), list_of_distinct_nodes,
+                                                                      config["training_percentage"])
+    row["sampling_s"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    all_clusters, hierarchy_tree = iter_gmm(amount_dict, list_of_distinct_nodes, distinct_labels, labs_sets,
+                                            config["warm_start"], config["share"])
+    row["clustering_s"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    file = storing(distinct_labels, labs_sets, hierarchy_tree, os.path.join(output_dir, "schemas", config["config"]+".csv"))
+    row["storing_s"] = time.perf_counter() - t
+
+    with open(file) as f:
+        ids = [int(line[0]) for line in csv.reader(f) if line != [] and line[0] != "id"]
+    row["types"] = len(ids)
+
+    errors = []
+    if "f_score" in metrics and test is not None:
+        from f_score import compute_f_score
+        t = time.perf_counter()
+        try:
+            row["f_score"] = compute_f_score(test, distinct_labels, file)
+        except ValueError as e:
+            # a test node matching no type
+            errors.append("f_score: "+str(e))
+        row["f_score_s"] = time.perf_counter() - t
+
+    if "hdbscan" in metrics and validate is not None:
+        from hdbscan_indexes import hdbscan_indexes
+        t = time.perf_counter()
+        try:
+            # row ids are used as indexes : base types without properties leave gaps in the ids
+            row["ari"], row["ami"] = hdbscan_indexes(validate, distinct_labels, max(ids, default=0), file)
+        except ImportError as e:
+            errors.append("hdbscan: "+str(e))
+        row["hdbscan_s"] = time.perf_counter() - t
+
+    row["error"] = "; ".join(errors)
+    return row
+
+def read_results(file):
+    """ Rows of a results table, by configuration (the rows of failed configurations are left out)
+
+    When the file has rows that are left out (failed configurations, or a configuration written twice), it is
+    rewritten with the rows kept only, so that a configuration run again is never written twice.
+    """
+    if not os.path.exists(file):
+        return {}
+    with open(file, newline="") as f:
+        rows = list(csv.DictReader(f))
+
+    done = {}
+    for row in rows:
+        if not row["error"].startswith("failed"):
+            done[row["config"]] = row
+
+    if len(done) != len(rows):
+        # the file is replaced at once, a stopped rewrite leaves the previous file
+        temporary = file+".tmp"
+        with open(temporary, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=HEADER)
+            writer.writeheader()
+            writer.writerows(done.values())
+        os.replace(temporary, file)
+    return done
+
+def sweep(profile, grid, output_dir, workers=None, metrics=("f_score", "hdbscan")):
+    """ Runs every configuration of a grid over one profile
+
+    Parameters
+    ----------
+    profile : ColumnarProfile
+        The profile of the database (see profile_once)
+    grid : Python dict
+        The values of each setting (see expand_grid)
+    output_dir : String
+        Directory of the results table (results.csv) and of the schemas
+    workers : Int
+        Number of processes, the number of cpus by default
+    metrics : Python tuple
+        The quality metrics to compute : f_score and hdbscan (ARI and AMI)
+
+    Returns
+    -------
+    rows : Python list of dict
+        The rows of the results table, in the order of the grid (with the rows of a previous run)
+    """
+    os.makedirs(os.path.join(output_dir, "schemas"), exist_ok=True)
+    results_file = os.path.join(output_dir, "results.csv")
+
+    configs = expand_grid(grid)
+    done = read_results(results_file)
+    todo = [config for config in configs if config["config"] not in done]
+    print(colored(str(len(configs)-len(todo))+" configurations already done, "+str(len(todo))+" to run.", "yellow"))
+
+    new_file = not os.path.exists(results_file)
+    with open(results_file, "a", newline="") as f, ProcessPoolExecutor(workers) as processes:
+        writer = csv.DictWriter(f, fieldnames=HEADER)
+        if new_file:
+            writer.writeheader()
+
+        running = {processes.submit(run_config, profile, config, output_dir, metrics): config for config in todo}
+        for future in as_completed(running):
+            config = running[future]
+            try:
+                row = future.result()
+            except Exception as e:
+                print(colored("Configuration "+config["config"]+" failed: "+str(e), "red"))
+                row = {name: config.get(name) for name in HEADER}
+                row["error"] = "failed: "+repr(e)
+
+            # each row is written as soon as its configuration is done
+            writer.writerow(row)
+            f.flush()
+            done[config["config"]] = row
+            print(colored(config["config"]+" done.", "green"))
+
+    return [done[config["config"]] for config in configs if config["config"] in done]
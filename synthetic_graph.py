@@ -0,0 +1,272 @@
+""" Generate synthetic property graph profiles to test the inference at scale """
+
+##### Imports
+import csv
+import os
+import numpy as np
+from termcolor import colored
+
+def plant_types(rng, n_base_types, key_vocabulary, core_keys, optional_keys, subtype_depth, subtype_branching, extra_keys):
+    """ Plants a hierarchy of types : base types with subtypes adding mandatory properties
+
+    Parameters
+    ----------
+    rng : numpy.random.Generator
+        Seeded random generator
+    n_base_types : Int
+        Number of base types, base type i is labelled 'Li'
+    key_vocabulary : Int
+        Number of distinct property keys, named 'k0', 'k1', ...
+    core_keys : Int
+        Number of mandatory properties of a base type
+    optional_keys : Int
+        Number of optional properties of each type
+    subtype_depth : Int
+        Depth of the planted subtype trees (0 for base types only)
+    subtype_branching : Int
+        Number of subtypes of each non leaf type
+    extra_keys : Int
+        Number of mandatory properties added by a subtype to its parent's ones
+
+    Returns
+    -------
+    types : Python dict
+        A dictionary with type names as keys and their description as a value
+        Its format is : {'L0': {'labels': ['L0'], 'mandatory': ['k1', 'k7'], 'optional': ['k3'], 'parent': None}, 'L0.1': {...}, ...}
+    """
+    keys = ["k"+str(i) for i in range(key_vocabulary)]
+
+    def draw_keys(n, excluded):
+        candidates = [key for key in keys if key not in excluded]
+        n = min(n, len(candidates))
+        return sorted(rng.choice(candidates, size=n, replace=False).tolist()) if n > 0 else []
+
+    types = {}
+
+    def plant(name, labels, mandatory, parent, depth):
+        optional = draw_keys(optional_keys, set(mandatory))
+        types[name] = {"labels": labels, "mandatory": mandatory, "optional": optional, "parent": parent}
+
+        if depth < subtype_depth:
+            for child in range(subtype_branching):
+                child_mandatory = sorted(mandatory + draw_keys(extra_keys, set(mandatory) | set(optional)))
+                plant(name+"."+str(child), labels, child_mandatory, name, depth+1)
+
+    for base in range(n_base_types):
+        plant("L"+str(base), ["L"+str(base)], draw_keys(core_keys, set()), None, 0)
+
+    return types
+
+def seeded_types(seed, parameters):
+    """ Plants the types of a synthetic graph, taking their parameters out of the ones given to iter_patterns
+
+    Parameters
+    ----------
+    seed : Int
+        Seed of the random generator
+    parameters : Python dict
+        Parameters of iter_patterns, the ones used to plant the types are removed from it
+
+    Returns
+    -------
+    types : Python dict
+        Planted types (see plant_types)
+    """
+    rng = np.random.default_rng(seed)
+    return plant_types(rng, parameters.pop("n_base_types", 5), parameters.pop("key_vocabulary", 50),
+                       parameters.pop("core_keys", 3), parameters.pop("optional_keys", 3),
+                       parameters.pop("subtype_depth", 2), parameters.pop("subtype_branching", 2),
+                       parameters.pop("extra_keys", 2))
+
+def iter_patterns(n_nodes, n_base_types=5, overlap_rate=0.1, optional_prob=0.3, key_vocabulary=50,
+                  zipf_exponent=1.2, subtype_depth=2, subtype_branching=2, patterns_per_type=8,
+                  core_keys=3, optional_keys=3, extra_keys=2, seed=0, types=None):
+    """ Streams the distinct patterns of a synthetic graph with their number of occurrences
+
+    The same parameters and seed always give the same patterns and counts.
+
+    Parameters
+    ----------
+    n_nodes : Int
+        Number of nodes of the synthetic graph
+    n_base_types : Int
+        Number of base types
+    overlap_rate : Float
+        Probability for a pattern to also carry the label of another base type (multi-labelled nodes)
+    optional_prob : Float
+        Probability for an optional property of a type to be present in a pattern
+    key_vocabulary : Int
+        Number of distinct property keys
+    zipf_exponent : Float
+        Exponent s of the Zipfian law followed by the pattern frequencies (frequency of rank r ~ 1/r^s)
+    subtype_depth, subtype_branching : Int
+        Shape of the planted subtype trees
+    patterns_per_type : Int
+        Number of variants drawn for each planted type (identical variants are merged)
+    core_keys, optional_keys, extra_keys : Int
+        Number of mandatory properties of a base type, optional properties of a type
+        and mandatory properties added by a subtype
+    seed : Int
+        Seed of the random generator
+    types : Python dict
+        Planted types (as returned by plant_types), planted from the other parameters when None
+
+    Returns
+    -------
+    A generator of tuples (labels, keys, count, planted type name)
+    Its format is : (['L0', 'L2'], ['k1', 'k3'], int, 'L0.1'), ...
+    """
+    rng = np.random.default_rng(seed)
+
+    if types is None:
+        types = plant_types(rng, n_base_types, key_vocabulary, core_keys, optional_keys,
+                            subtype_depth, subtype_branching, extra_keys)
+
+    base_labels = sorted(set(type_desc["labels"][0] for type_desc in types.values()))
+
+    # draw the variants of every planted type
+    patterns = {}
+    for name in types:
+        type_desc = types[name]
+        for variant in range(patterns_per_type):
+            keys = list(type_desc["mandatory"])
+            for key in type_desc["optional"]:
+                if rng.random() < optional_prob:
+                    keys.append(key)
+
+            labels = list(type_desc["labels"])
+            if len(base_labels) > 1 and rng.random() < overlap_rate:
+                others = [label for label in base_labels if label not in labels]
+                labels.append(others[rng.integers(len(others))])
+
+            pattern = (tuple(sorted(labels)), tuple(sorted(set(keys))))
+
+            # identical variants are the same pattern
+            if pattern not in patterns:
+                patterns[pattern] = name
+
+    # Zipfian frequencies over a random ranking of the patterns
+    ranks = rng.permutation(len(patterns)) + 1
+    weights = 1.0 / np.power(ranks, zipf_exponent)
+    counts = rng.multinomial(n_nodes, weights / weights.sum())
+
+    for (pattern, name), count in zip(patterns.items(), counts):
+        if count > 0:
+            yield list(pattern[0]), list(pattern[1]), int(count), name
+
+def generate_profile(n_nodes, seed=0, **parameters):
+    """ Generates a synthetic profile in the same format as the one returned by preprocessing
+
+    Parameters
+    ----------
+    n_nodes : Int
+        Number of nodes of the synthetic graph
+    seed : Int
+        Seed of the random generator
+    parameters :
+        Any other parameter of iter_patterns
+
+    Returns
+    -------
+    amount_dict : Python dict
+        A dictionary with node strings as keys and the number of occurrences of the node as a value
+        Its format is : {'Label1 Label2 Label3 prop1 prop2 prop3 ...': int, ...}
+    list_of_distinct_nodes : Python list
+        A list of node strings
+        Its format is : ['Label1 Label2 prop1', 'Label1 Label3 prop2', 'prop4 prop5', ...]
+    distinct_labels : Python list
+        A list of labels
+        Its format is : ['Label1', 'Label2', 'Label3', ...]
+    labs_sets : Python list of list
+        A list of all labels sets
+        Its format is : [['Label 1','Label2'],['Label1'],['Label3'],...]
+    ground_truth : Python dict
+        The planted types and the planted type of each node string
+        Its format is : {'types': {'L0': {'labels': [...], 'mandatory': [...], 'optional': [...], 'parent': None}, ...},
+                         'patterns': {'Label1 prop1 prop2': 'L0.1', ...}}
+    """
+    types = seeded_types(seed, parameters)
+
+    amount_dict = {}
+    list_of_distinct_nodes = []
+    distinct_labels = []
+    labs_sets = []
+    patterns = {}
+
+    for labels, keys, count, name in iter_patterns(n_nodes, seed=seed+1, types=types, **parameters):
+        labels_properties_str = ' '.join(labels+keys)
+        list_of_distinct_nodes.append(labels_properties_str)
+        amount_dict[labels_properties_str] = count
+        patterns[labels_properties_str] = name
+
+        for label in labels:
+            if label not in distinct_labels:
+                distinct_labels.append(label)
+        if labels not in labs_sets:
+            labs_sets.append(labels)
+
+    ground_truth = {"types": types, "patterns": patterns}
+
+    return amount_dict, list_of_distinct_nodes, distinct_labels, labs_sets, ground_truth
+
+def write_neo4j_admin_csv(directory, n_nodes, seed=0, chunk_size=100000, **parameters):
+    """ Streams the nodes of a synthetic graph into csv files that neo4j-admin import can load
+
+    The header is written in its own file :
+    neo4j-admin import --nodes=<directory>/nodes_header.csv,<directory>/nodes.csv
+
+    Parameters
+    ----------
+    directory : String
+        Directory the files are written into
+    n_nodes : Int
+        Number of nodes of the synthetic graph
+    seed : Int
+        Seed of the random generator
+    chunk_size : Int
+        Number of rows written at once
+    parameters :
+        Any other parameter of iter_patterns
+
+    Returns
+    -------
+    ground_truth : Python dict
+        The planted types and the planted type of each node string (see generate_profile)
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    types = seeded_types(seed, parameters)
+
+    # every key that may appear is a column
+    all_keys = sorted(set(key for type_desc in types.values() for key in type_desc["mandatory"]+type_desc["optional"]),
+                      key=lambda key: int(key[1:]))
+    column = {key: i for i, key in enumerate(all_keys)}
+
+    with open(os.path.join(directory, "nodes_header.csv"), "w", newline="") as f:
+        csv.writer(f).writerow(["id:ID", ":LABEL"]+all_keys)
+
+    patterns = {}
+    node_id = 0
+
+    print(colored("Writing synthetic nodes:", "yellow"))
+    with open(os.path.join(directory, "nodes.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+
+        for labels, keys, count, name in iter_patterns(n_nodes, seed=seed+1, types=types, **parameters):
+            patterns[' '.join(labels+keys)] = name
+
+            # an empty field is a missing property for neo4j-admin
+            row = [""]*len(all_keys)
+            for key in keys:
+                row[column[key]] = "1"
+            labels_str = ";".join(labels)
+
+            written = 0
+            while written < count:
+                n = min(chunk_size, count-written)
+                writer.writerows([str(node_id+i), labels_str]+row for i in range(n))
+                node_id += n
+                written += n
+    print(colored("Done.", "green"))
+
+    return {"types": types, "patterns": patterns}
@@ -0,0 +1,20 @@
+""" Import time budget of the library : python3 -m pytest test_import_time.py (or python3 -m unittest) """
+
+##### Imports
+import unittest
+
+### File imports
+from cli import LIBRARY_MODULES, import_time
+
+### Import time budget in seconds, as the default of cli.py check-imports
+BUDGET = 0.5
+
+class ImportTimeTest(unittest.TestCase):
+
+    def test_import_time(self):
+        duration, heavy = import_time(LIBRARY_MODULES)
+        self.assertEqual(heavy, [], "heavy modules imported at import time")
+        self.assertLessEqual(duration, BUDGET, "the import time budget is exceeded")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,291 @@
+""" Nested spans to trace the time, cpu and memory used by each step of the inference """
+
+##### Imports
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+class NoSpan:
+    """ Span returned when tracing is disabled, every method does nothing """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __bool__(self):
+        return False
+
+    def set(self, **args):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+NO_SPAN = NoSpan()
+
+class Span:
+    """ A timed section of the inference, spans opened inside it are its children """
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+        # counters incremented while this span is the innermost one
+        self.counters = {}
+
+        # counters of this span and all its children
+        self.total_counters = {}
+
+        self.children_wall = 0.0
+        self.max_memory = 0
+
+    def __bool__(self):
+        return True
+
+    def set(self, **args):
+        """ Adds information to the span (number of patterns, weight...) """
+        self.args.update(args)
+
+    def count(self, name, n=1):
+        """ Increments a counter of the span (iterations, kernel calls...) """
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def __enter__(self):
+        stack = self.tracer.stack()
+        self.parent = stack[-1] if stack else None
+
+        if self.tracer.memory:
+            # the peak of the parent so far is kept before measuring this span alone
+            if self.parent is not None:
+                self.parent.max_memory = max(self.parent.max_memory, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+
+        stack.append(self)
+        self.start = time.perf_counter()
+        self.start_cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.start
+        cpu = time.process_time() - self.start_cpu
+        self.tracer.stack().pop()
+
+        peak = 0
+        if self.tracer.memory:
+            peak = max(self.max_memory, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+
+        for name, n in self.counters.items():
+            self.total_counters[name] = self.total_counters.get(name, 0) + n
+
+        if self.parent is not None:
+            self.parent.children_wall += wall
+            self.parent.max_memory = max(self.parent.max_memory, peak)
+            for name, n in self.total_counters.items():
+                self.parent.total_counters[name] = self.parent.total_counters.get(name, 0) + n
+
+        self.tracer.record(self, wall, cpu, peak)
+        return False
+
+class Tracer:
+    """ Collects the spans of a run and exports them
+
+    Parameters
+    ----------
+    memory : Boolean
+        When memory is at True, the peak memory of each span is measured with tracemalloc (slower)
+    """
+
+    def __init__(self, memory=True):
+        self.memory = memory
+        self.origin = time.perf_counter()
+        self.events = []
+        self.local = threading.local()
+
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stack(self):
+        """ Opened spans of the current thread """
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def span(self, name, **args):
+        return Span(self, name, args)
+
+    def current(self):
+        stack = self.stack()
+        return stack[-1] if stack else None
+
+    def record(self, span, wall, cpu, peak):
+        stack = self.stack()
+
+        # a span nested in a span of the same name is already counted in its ancestor's time
+        nested = False
+        for opened in stack:
+            if opened.name == span.name:
+                nested = True
+                break
+
+        self.events.append({
+            "name": span.name,
+            "start": span.start - self.origin,
+            "wall": wall,
+            "self_wall": wall - span.children_wall,
+            "cpu": cpu,
+            "peak_memory": peak,
+            "nested": nested,
+            "args": dict(span.args),
+            "counters": dict(span.counters),
+            "total_counters": dict(span.total_counters),
+            "tid": threading.get_ident(),
+        })
+
+    def write_chrome_trace(self, file):
+        """ Writes the spans in the Chrome trace format (chrome://tracing, Perfetto)
+
+        Parameters
+        ----------
+        file : String
+            Name of the json file written
+
+        Returns
+        -------
+        file : String
+            Name of the json file written
+        """
+        pid = os.getpid()
+        trace_events = []
+
+        for event in self.events:
+            args = dict(event["args"])
+            args.update(event["total_counters"])
+            args["cpu_s"] = event["cpu"]
+            if self.memory:
+                args["peak_memory_bytes"] = event["peak_memory"]
+
+            trace_events.append({
+                "name": event["name"],
+                "ph": "X",
+                "ts": event["start"]*1e6,
+                "dur": event["wall"]*1e6,
+                "pid": pid,
+                "tid": event["tid"],
+                "args": args,
+            })
+
+        with open(file, "w") as f:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f, default=str)
+
+        return file
+
+    def summary(self):
+        """ Aggregates the spans by name
+
+        Returns
+        -------
+        rows : Python list of dict
+            One dictionary per span name, sorted by decreasing self time
+            Its format is : [{'name': 'split', 'calls': int, 'wall': float, 'self_wall': float, 'cpu': float, 'peak_memory': int, 'counters': {...}}, ...]
+        """
+        rows = {}
+
+        for event in self.events:
+            if event["name"] not in rows:
+                rows[event["name"]] = {"name": event["name"], "calls": 0, "wall": 0.0, "self_wall": 0.0,
+                                       "cpu": 0.0, "peak_memory": 0, "counters": {}}
+            row = rows[event["name"]]
+            row["calls"] += 1
+            row["self_wall"] += event["self_wall"]
+            row["peak_memory"] = max(row["peak_memory"], event["peak_memory"])
+
+            if not event["nested"]:
+                row["wall"] += event["wall"]
+                row["cpu"] += event["cpu"]
+
+            for name, n in event["counters"].items():
+                row["counters"][name] = row["counters"].get(name, 0) + n
+
+        return sorted(rows.values(), key=lambda row: -row["self_wall"])
+
+    def top(self, name, n=10):
+        """ The n longest spans of a given name (for instance the base types that take the most time)
+
+        Parameters
+        ----------
+        name : String
+            Name of the spans
+        n : Int
+            Number of spans returned
+
+        Returns
+        -------
+        events : Python list of dict
+            The recorded spans, sorted by decreasing wall time
+        """
+        events = [event for event in self.events if event["name"] == name]
+        return sorted(events, key=lambda event: -event["wall"])[:n]
+
+    def print_summary(self, top_name="base type", n=10):
+        """ Prints the summary table and the longest spans of top_name """
+        print("{:<24}{:>8}{:>12}{:>12}{:>12}{:>14}  {}".format("span", "calls", "wall (s)", "self (s)", "cpu (s)", "peak (MiB)", "counters"))
+        for row in self.summary():
+            counters = ", ".join(name+"="+str(value) for name, value in sorted(row["counters"].items()))
+            print("{:<24}{:>8}{:>12.3f}{:>12.3f}{:>12.3f}{:>14.1f}  {}".format(
+                row["name"][:24], row["calls"], row["wall"], row["self_wall"], row["cpu"], row["peak_memory"]/2**20, counters))
+
+        events = self.top(top_name, n)
+        if events != []:
+            print("Longest '"+top_name+"' spans:")
+            for event in events:
+                args = ", ".join(key+"="+str(value) for key, value in sorted(event["args"].items()))
+                counters = ", ".join(key+"="+str(value) for key, value in sorted(event["total_counters"].items()))
+                print("{:>12.3f}s  {}  {}".format(event["wall"], args, counters))
+
+### Module level tracer, None when tracing is disabled
+_tracer = None
+
+def enable(memory=True):
+    """ Starts tracing the spans opened from now on
+
+    Parameters
+    ----------
+    memory : Boolean
+        Measure the peak memory of each span with tracemalloc
+
+    Returns
+    -------
+    tracer : Tracer
+    """
+    global _tracer
+    _tracer = Tracer(memory)
+    return _tracer
+
+def disable():
+    """ Stops tracing and returns the tracer that was used (None if tracing was not enabled) """
+    global _tracer
+    tracer = _tracer
+    _tracer = None
+    if tracer is not None and tracer.memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    return tracer
+
+def span(name, **args):
+    """ Opens a span, to be used in a with statement. Returns NO_SPAN when tracing is disabled. """
+    if _tracer is None:
+        return NO_SPAN
+    return _tracer.span(name, **args)
+
+def count(name, n=1):
+    """ Increments a counter of the innermost opened span """
+    if _tracer is None:
+        return
+    current = _tracer.current()
+    if current is not None:
+        current.count(name, n)